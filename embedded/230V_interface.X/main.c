@@ -32,6 +32,9 @@
 #pragma config LPBOR = ON
 #pragma config LVP = ON
 
+// Sent in the data stage of GET_STATE, so it must outlive the request.
+static t_state state_report;
+
 
 void interrupt isr()
 {
@@ -43,6 +46,7 @@ void main()
 	setup();
 
 	uint8_t len;
+	uint8_t i;
 	const unsigned char *data;
 
 	TRISAbits.TRISA5 = 0;
@@ -53,19 +57,55 @@ void main()
 		if (usb_is_configured() && usb_out_endpoint_has_data(1))
 		{
 			len = usb_get_out_buffer(1, &data);
-			if (data[0])
+			if (len > 1 && data[0] == BATCH_MARKER)
 			{
-				LATAbits.LATA5 = 1;
+				// Apply the commands of a batch in order.
+				for (i = 1; i < len; i++)
+				{
+					apply_command(data[i]);
+				}
 			}
-			else
+			else if (len > 0)
 			{
-				LATAbits.LATA5 = 0;
+				apply_command(data[0]);
 			}
 			usb_arm_out_endpoint(1);
 		}
 	}
 }
 
+void apply_command(unsigned char command)
+{
+	if (command)
+	{
+		LATAbits.LATA5 = 1;
+	}
+	else
+	{
+		LATAbits.LATA5 = 0;
+	}
+}
+
+t_state get_state()
+{
+	return LATAbits.LATA5;
+}
+
+int8_t app_unknown_setup_request_callback(const struct setup_packet *setup)
+{
+	// Answer GET_STATE, a vendor request from the host, with the
+	// current state so the host need not wait for it to change.
+	if (setup->REQUEST.type == VENDOR_REQUEST_TYPE &&
+		setup->REQUEST.direction == DEVICE_TO_HOST &&
+		setup->bRequest == GET_STATE_REQUEST && setup->wLength >= 1)
+	{
+		state_report = get_state();
+		usb_send_data_stage((char *) &state_report, 1, 0, 0);
+		return 0;
+	}
+	return -1; // Stall unknown requests.
+}
+
 void setup()
 {
 	OSCCONbits.IRCF = 0b1111; // 16MHz HFINTOSC postscaler.
@@ -24,12 +24,15 @@
 
 #define USB_USE_INTERRUPTS			// Use interrupts instead of polling.
 
+// Handles the GET_STATE vendor request, see main.c.
+#define UNKNOWN_SETUP_REQUEST_CALLBACK app_unknown_setup_request_callback
+
 //////////////////////////
 // Other settings.
 
 #define ID_VENDOR 0x04D8
 #define ID_PRODUCT 0x5901
-#define DEVICE_VERSION 0x0001
+#define DEVICE_VERSION 0x0002
 
 #define USB_VERSION 0x0200			// USB 2.0
 
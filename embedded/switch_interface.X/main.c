@@ -32,6 +32,9 @@
 #pragma config LPBOR = ON
 #pragma config LVP = ON
 
+// Sent in the data stage of GET_STATE, so it must outlive the request.
+static t_state state_report;
+
 
 void interrupt isr()
 {
@@ -95,6 +98,21 @@ void send_state(t_state state)
 	usb_send_in_buffer(1, 1);
 }
 
+int8_t app_unknown_setup_request_callback(const struct setup_packet *setup)
+{
+	// Answer GET_STATE, a vendor request from the host, with the
+	// current state so the host need not wait for it to change.
+	if (setup->REQUEST.type == VENDOR_REQUEST_TYPE &&
+		setup->REQUEST.direction == DEVICE_TO_HOST &&
+		setup->bRequest == GET_STATE_REQUEST && setup->wLength >= 1)
+	{
+		state_report = get_state();
+		usb_send_data_stage((char *) &state_report, 1, 0, 0);
+		return 0;
+	}
+	return -1; // Stall unknown requests.
+}
+
 bool endpoint_ready()
 {
    return !usb_in_endpoint_halted(1) && !usb_in_endpoint_busy(1);
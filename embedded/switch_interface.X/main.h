@@ -1,10 +1,21 @@
 #ifndef MAIN_H
 #define	MAIN_H
 
+#include <stdint.h>
+
 typedef unsigned char t_state;
 
+// Vendor request answered with the current state, see
+// app_unknown_setup_request_callback.
+#define GET_STATE_REQUEST 0x01
+#define VENDOR_REQUEST_TYPE 2
+#define DEVICE_TO_HOST 1
+
+struct setup_packet;
+
 t_state get_state();
 void setup();
+int8_t app_unknown_setup_request_callback(const struct setup_packet *setup);
 void send_state(t_state state);
 void send_state_if_changed(unsigned char state);
 unsigned char endpoint_ready();
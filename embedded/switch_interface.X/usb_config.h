@@ -24,6 +24,9 @@
 
 #define USB_USE_INTERRUPTS			// Use interrupts instead of polling.
 
+// Handles the GET_STATE vendor request, see main.c.
+#define UNKNOWN_SETUP_REQUEST_CALLBACK app_unknown_setup_request_callback
+
 //////////////////////////
 // Other settings.
 
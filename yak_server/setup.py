@@ -31,4 +31,6 @@ setuptools.setup(
     keywords='',
 
     packages=['yak_server'],
+
+    extras_require={'analytics': ['numpy']},
 )
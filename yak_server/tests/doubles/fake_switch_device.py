@@ -5,10 +5,13 @@ from yak_server import usbdevice
 
 class FakeUsbDeviceBase:
     DEVICE_CLASS_ID = None
+    max_packet_size = 8
 
     def __init__(self):
+        self.identifier = 'fake-{}'.format(id(self))
         self._read_buffer = b''
         self._read_queue = queue.Queue()
+        self.written = []
 
     def connect(self):
         pass
@@ -23,6 +26,13 @@ class FakeUsbDeviceBase:
             self._update_read_buffer()
         return self._get_read_data(number_of_bytes)
 
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    def query_state(self, number_of_bytes):
+        raise usbdevice.USBError('GET_STATE is not supported.')
+
     @property
     def class_identifier(self):
         return self.DEVICE_CLASS_ID
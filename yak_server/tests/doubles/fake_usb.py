@@ -52,6 +52,7 @@ class FakeUSBInEndpoint:
 
     def __init__(self):
         self.bEndpointAddress = 0x80 # noqa
+        self.wMaxPacketSize = 8 # noqa
         self.read_count = 0
 
     def read(self, number_of_bytes):
@@ -75,6 +76,7 @@ class FakeUSBInEndpoint:
 class FakeUSBOutEndpoint:
     def __init__(self):
         self.bEndpointAddress = 0x00 #noqa
+        self.wMaxPacketSize = 8 # noqa
 
     def write(self, data):
         return len(data)
@@ -0,0 +1,195 @@
+"""Latency, jitter and fault injection for the fake USB stack.
+
+A 'Simulator' decides, per transfer, how long the transfer takes and
+whether it times out, is only partially written or finds the device
+disconnected. All decisions come from a seeded random number
+generator so a run can be reproduced exactly.
+
+The simulator is attached to the fakes by wrapping them: the raw
+endpoints of 'fake_usb' with 'simulate_raw_device' and the device
+level fakes of 'fake_switch_device' with 'SimulatedUsbDevice'.
+"""
+
+import errno
+import random
+import time
+
+import usb
+
+from yak_server import usbdevice
+
+
+def constant(value):
+    """Return a latency distribution that always gives 'value'."""
+    return lambda rng: value
+
+
+def uniform(low, high):
+    """Return a latency distribution uniform between 'low' and 'high'."""
+    return lambda rng: rng.uniform(low, high)
+
+
+def exponential(mean):
+    """Return an exponential latency distribution with the given mean."""
+    return lambda rng: rng.expovariate(1 / mean) if mean else 0.0
+
+
+def lognormal(median, sigma):
+    """Return a log-normal latency distribution (long tail)."""
+    return lambda rng: median * rng.lognormvariate(0, sigma)
+
+
+class TransferProfile:
+    """Describes how transfers to a simulated device behave.
+
+    Latencies are in seconds. The rates are the probability that a
+    single transfer has the corresponding fault.
+    """
+
+    def __init__(self, latency=constant(0.0), jitter=0.0, timeout_rate=0.0,
+                 partial_write_rate=0.0, disconnect_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.partial_write_rate = partial_write_rate
+        self.disconnect_rate = disconnect_rate
+
+
+class Simulator:
+    """Apply a TransferProfile to transfers.
+
+    'sleep' is called with the latency of every transfer. Pass a fake
+    sleep function to simulate latency without actually waiting, the
+    total simulated time is kept in 'elapsed'.
+    """
+
+    def __init__(self, profile=None, seed=0, sleep=time.sleep):
+        self.profile = profile or TransferProfile()
+        self.connected = True
+        self.elapsed = 0.0
+        self.latencies = []
+        self._rng = random.Random(seed)
+        self._sleep = sleep
+
+    def disconnect(self):
+        self.connected = False
+
+    def reconnect(self):
+        self.connected = True
+
+    def read(self, read_function, number_of_bytes):
+        self._start_transfer()
+        return read_function(number_of_bytes)
+
+    def write(self, write_function, data):
+        self._start_transfer()
+        if self._happens(self.profile.partial_write_rate) and len(data) > 0:
+            data = data[:self._rng.randrange(len(data))]
+        return write_function(data)
+
+    def _start_transfer(self):
+        if self.connected and self._happens(self.profile.disconnect_rate):
+            self.disconnect()
+        if not self.connected:
+            raise usb.core.USBError('No such device', errno=errno.ENODEV)
+        self._wait(self._latency())
+        if self._happens(self.profile.timeout_rate):
+            raise usb.core.USBError('Operation timed out',
+                                    errno=errno.ETIMEDOUT)
+
+    def _latency(self):
+        latency = self.profile.latency(self._rng)
+        if self.profile.jitter:
+            latency += self._rng.uniform(-self.profile.jitter,
+                                         self.profile.jitter)
+        return max(latency, 0.0)
+
+    def _wait(self, latency):
+        self.latencies.append(latency)
+        self.elapsed += latency
+        if latency:
+            self._sleep(latency)
+
+    def _happens(self, rate):
+        return rate > 0 and self._rng.random() < rate
+
+
+class SimulatedUSBInEndpoint:
+    """Wrap a raw IN endpoint so reads go through a simulator."""
+
+    def __init__(self, endpoint, simulator):
+        self._endpoint = endpoint
+        self._simulator = simulator
+        self.bEndpointAddress = endpoint.bEndpointAddress # noqa
+        self.wMaxPacketSize = endpoint.wMaxPacketSize # noqa
+
+    def read(self, number_of_bytes):
+        return self._simulator.read(self._endpoint.read, number_of_bytes)
+
+
+class SimulatedUSBOutEndpoint:
+    """Wrap a raw OUT endpoint so writes go through a simulator."""
+
+    def __init__(self, endpoint, simulator):
+        self._endpoint = endpoint
+        self._simulator = simulator
+        self.bEndpointAddress = endpoint.bEndpointAddress # noqa
+        self.wMaxPacketSize = endpoint.wMaxPacketSize # noqa
+
+    def write(self, data):
+        return self._simulator.write(self._endpoint.write, data)
+
+
+def simulate_raw_device(raw_device, simulator):
+    """Route all endpoint transfers of a FakeRawUSBDevice via 'simulator'."""
+    interface = raw_device.configuration.interface
+    interface.in_endpoint = SimulatedUSBInEndpoint(interface.in_endpoint,
+                                                   simulator)
+    interface.out_endpoint = SimulatedUSBOutEndpoint(interface.out_endpoint,
+                                                     simulator)
+    interface.endpoint_list = [interface.in_endpoint, interface.out_endpoint]
+    return raw_device
+
+
+class SimulatedUsbDevice:
+    """Wrap a device level fake so reads and writes go via a simulator.
+
+    Faults are handled the way USBDevice handles them. A failed read
+    transfer is ignored and the read is retried untill all requested
+    bytes have arrived. A failed write raises usbdevice.USBError and
+    a partial write raises usbdevice.IncompleteUSBWrite. Reads and
+    writes of a disconnected device raise usbdevice.DeviceDisconnected.
+    """
+
+    def __init__(self, device, simulator):
+        self._device = device
+        self.simulator = simulator
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def read(self, number_of_bytes):
+        data = b''
+        while len(data) < number_of_bytes:
+            bytes_remaining = number_of_bytes - len(data)
+            try:
+                data += self.simulator.read(self._device.read,
+                                            bytes_remaining)
+            except usb.core.USBError as exception:
+                if exception.errno == errno.ENODEV:
+                    raise usbdevice.DeviceDisconnected(
+                        str(exception)) from exception
+        return data
+
+    def write(self, data):
+        try:
+            bytes_written = self.simulator.write(self._device.write, data)
+        except usb.core.USBError as exception:
+            if exception.errno == errno.ENODEV:
+                raise usbdevice.DeviceDisconnected(
+                    str(exception)) from exception
+            raise usbdevice.USBError(str(exception)) from exception
+        if bytes_written != len(data):
+            raise usbdevice.IncompleteUSBWrite(
+                'Wrote {} of {} bytes.'.format(bytes_written, len(data)))
+        return bytes_written
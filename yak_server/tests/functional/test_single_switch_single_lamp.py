@@ -2,6 +2,8 @@
 
 # pylint: disable = no-self-use
 
+import os.path
+import tempfile
 import threading
 import unittest
 import unittest.mock
@@ -30,6 +32,11 @@ class TestSingleSwitchSingleLamp(util.TestCase):
     def setUp(self):
         self.start_patch('yak_server.usbdevice.find',
                          side_effect=self.map_mock_device)
+        cache_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_directory.cleanup)
+        self.start_patch('yak_server.manifest.default_path',
+                         return_value=os.path.join(cache_directory.name,
+                                                   'manifest.json'))
 
         self.mock_switch_device = tests.doubles.FakeSwitchDeviceV0_0_0()
 
@@ -39,6 +46,7 @@ class TestSingleSwitchSingleLamp(util.TestCase):
         self.mock_ac_device = unittest.mock.Mock()
         self.mock_ac_device.write.side_effect = self.queue_output_data
         self.mock_ac_device.class_identifier = ac_class_id
+        self.mock_ac_device.identifier = 'fake-ac'
 
         self.output_queue = queue.Queue()
 
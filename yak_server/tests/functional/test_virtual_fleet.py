@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import clock
+from yak_server import virtual
+
+
+class TestVirtualFleet(util.TestCase):
+    """Test running the server on a fleet of virtual devices.
+
+    Many switches are connected and each press and release must
+    reach the lamp, once the rate limiter lets it through.
+    """
+
+    SWITCH_COUNT = 50
+
+    def test_every_switch_drives_the_lamp(self):
+        fleet = virtual.VirtualFleet(switch_count=self.SWITCH_COUNT,
+                                     ac_count=1)
+        application = yak_server.__main__.Application(
+            device_backend=fleet, server_clock=clock.VirtualClock())
+        application.setup()
+        lamp = fleet.ac_devices[0]
+
+        for switch in fleet.switches:
+            switch.press()
+            while not lamp.lamp_on:
+                application.main_loop_iteration()
+            switch.release()
+            while lamp.lamp_on:
+                application.main_loop_iteration()
+
+        self.assertEqual(fleet.ac_devices[0].write_count,
+                         2 * self.SWITCH_COUNT)
+
+    def test_events_carry_the_switch_identifier(self):
+        fleet = virtual.VirtualFleet(switch_count=3, ac_count=1)
+        application = yak_server.__main__.Application(device_backend=fleet)
+        application.setup()
+
+        fleet.switches[2].press()
+        event = application.get_event()
+
+        self.assertEqual(event.device, fleet.switches[2].identifier)
+
+    def test_switches_are_spread_over_ac_devices(self):
+        fleet = virtual.VirtualFleet(switch_count=4, ac_count=2)
+        application = yak_server.__main__.Application(device_backend=fleet)
+        application.setup()
+
+        for switch in fleet.switches:
+            switch.press()
+            application.main_loop_iteration()
+
+        self.assertEqual([ac.write_count for ac in fleet.ac_devices], [2, 2])
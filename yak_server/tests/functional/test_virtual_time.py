@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import datetime
+import time
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import clock
+from yak_server import events
+from yak_server import virtual
+
+
+class TestVirtualTime(util.TestCase):
+    """Test simulating a long stretch of traffic on a virtual clock.
+
+    A switch is toggled every ten minutes for a whole day. The events
+    must carry the simulated times, while the test finishes in well
+    under a second of real time.
+    """
+
+    STEP = 600
+    STEPS = 144
+
+    def setUp(self):
+        self.virtual_clock = clock.VirtualClock()
+        previous_clock = clock.set_clock(self.virtual_clock)
+        self.addCleanup(clock.set_clock, previous_clock)
+
+    def test_a_day_of_traffic_in_virtual_time(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        application = yak_server.__main__.Application(device_backend=fleet)
+        application.setup()
+        start = time.perf_counter()
+
+        timestamps = []
+        for step in range(self.STEPS):
+            fleet.play([(self.STEP, 0, step % 2 == 0)], speed=1)
+            event = application.get_event()
+            application.handle_event(event)
+            timestamps.append(event.timestamp)
+
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(timestamps[-1] - timestamps[0],
+                         datetime.timedelta(seconds=self.STEP *
+                                            (self.STEPS - 1)))
+        self.assertFalse(fleet.ac_devices[0].lamp_on)
+
+    def test_get_event_timeout_passes_virtual_time(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        application = yak_server.__main__.Application(device_backend=fleet)
+        application.setup()
+
+        event = application.get_event(timeout=3600)
+
+        self.assertIsNone(event)
+        self.assertEqual(self.virtual_clock.monotonic(), 3600)
+
+    def test_lamp_turns_off_ten_minutes_after_press(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        application = yak_server.__main__.Application(device_backend=fleet)
+        application.setup()
+        lamp = fleet.ac_devices[0]
+
+        fleet.switches[0].press()
+        application.main_loop_iteration()
+        application.schedule_command(
+            600, events.LampOffEvent(device=lamp.identifier), key='lamp')
+        self.assertTrue(lamp.lamp_on)
+
+        while lamp.lamp_on:
+            application.main_loop_iteration()
+
+        self.assertAlmostEqual(self.virtual_clock.monotonic(), 600)
@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from tests import util
+
+from yak_server import bus
+from yak_server import events
+from yak_server import history
+
+try:
+    import numpy
+    from yak_server import analytics
+except ImportError:
+    numpy = None
+
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def at(milliseconds, event_type, device, **fields):
+    """Return an event 'milliseconds' after START."""
+    return event_type(device=device, timestamp=START + datetime.timedelta(
+        milliseconds=milliseconds), **fields)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed.')
+class TestAnalytics(util.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'history')
+
+    def load(self, recorded):
+        recorder = history.HistoryRecorder(self.path)
+        for kind, event in recorded:
+            recorder.record(kind, event)
+        recorder.close()
+        return analytics.load(self.path)
+
+    def test_load_columns(self):
+        columns = self.load([
+            (bus.EVENT, at(0, events.ButtonDownEvent, 'hall')),
+            (bus.COMMAND, at(1, events.LampOnEvent, 'ac'))])
+
+        self.assertEqual(len(columns), 2)
+        self.assertEqual(columns.devices, ['hall', 'ac'])
+        self.assertEqual(columns.device.tolist(), [0, 1])
+        self.assertEqual(columns.kind.tolist(), [bus.EVENT, bus.COMMAND])
+        self.assertEqual(int(columns.timestamp[1] - columns.timestamp[0]),
+                         analytics.MILLISECOND)
+        self.assertEqual(len(columns.select(columns.kind == bus.EVENT)), 1)
+
+    def test_buckets_and_heatmap(self):
+        columns = self.load([
+            (bus.EVENT, at(0, events.ButtonDownEvent, 'hall')),
+            (bus.EVENT, at(10, events.ButtonUpEvent, 'hall')),
+            (bus.EVENT, at(2500, events.ButtonDownEvent, 'garden')),
+            (bus.EVENT, at(2600, events.ButtonDownEvent, 'hall'))])
+
+        starts, counts = analytics.bucket_counts(columns, analytics.SECOND)
+        self.assertEqual(counts.tolist(), [2, 2])
+        self.assertEqual(int(starts[1] - starts[0]), 2 * analytics.SECOND)
+        starts, counts = analytics.heatmap(columns, analytics.SECOND)
+        self.assertEqual(len(starts), 3)
+        self.assertEqual(counts.tolist(), [[2, 0, 1], [0, 0, 1]])
+        self.assertEqual(analytics.device_counts(columns).tolist(), [3, 1])
+
+    def test_group_by_device(self):
+        columns = self.load([
+            (bus.EVENT, at(0, events.ButtonDownEvent, 'hall')),
+            (bus.EVENT, at(1, events.ButtonDownEvent, 'garden')),
+            (bus.EVENT, at(2, events.ButtonUpEvent, 'hall'))])
+
+        groups = analytics.group_by_device(columns)
+
+        self.assertEqual({name: group.tolist()
+                          for name, group in groups.items()},
+                         {'hall': [0, 2], 'garden': [1]})
+
+    def test_press_durations(self):
+        columns = self.load([
+            (bus.EVENT, at(0, events.ButtonDownEvent, 'hall')),
+            (bus.EVENT, at(5, events.ButtonDownEvent, 'garden')),
+            (bus.EVENT, at(30, events.ButtonUpEvent, 'hall')),
+            (bus.EVENT, at(40, events.ButtonUpEvent, 'hall')),
+            (bus.EVENT, at(50, events.ButtonDownEvent, 'hall')),
+            (bus.EVENT, at(60, events.PatternEvent, 'hall',
+                           pattern='double')),
+            (bus.EVENT, at(70, events.ButtonDownEvent, 'hall')),
+            (bus.EVENT, at(75, events.ButtonUpEvent, 'hall')),
+            (bus.COMMAND, at(80, events.LampOffEvent, 'hall'))])
+
+        devices, pressed_at, durations = analytics.press_durations(columns)
+
+        self.assertEqual(devices.tolist(), [0, 0])
+        self.assertEqual((pressed_at - columns.timestamp[0]).tolist(),
+                         [0, 70 * analytics.MILLISECOND])
+        self.assertEqual(durations.tolist(), [30 * analytics.MILLISECOND,
+                                              5 * analytics.MILLISECOND])
+
+    def test_empty_history(self):
+        columns = self.load([])
+
+        starts, counts = analytics.heatmap(columns, analytics.HOUR)
+        self.assertEqual((len(starts), counts.shape), (0, (0, 0)))
+        self.assertEqual(len(analytics.press_durations(columns)[0]), 0)
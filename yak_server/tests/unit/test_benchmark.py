@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, unused-argument
+
+import subprocess
+import sys
+
+from tests import util
+
+from yak_server import benchmark
+
+
+class TestFleetBenchmark(util.TestCase):
+    def test_measure_fleet_handles_every_event(self):
+        result = benchmark.measure_fleet(switch_count=5, ac_count=2,
+                                         press_count=20)
+
+        self.assertEqual(result.event_count, 40)
+        self.assertEqual(len(result.latencies), 40)
+        self.assertGreater(result.throughput(), 0)
+
+    def test_percentile(self):
+        result = benchmark.FleetResult(switch_count=1, ac_count=1,
+                                       event_count=4, elapsed=2.0,
+                                       latencies=[1, 2, 3, 4])
+
+        self.assertEqual(result.percentile(0.5), 3)
+        self.assertEqual(result.percentile(0.99), 4)
+        self.assertEqual(result.throughput(), 2.0)
+
+    def test_format_result(self):
+        result = benchmark.FleetResult(switch_count=1, ac_count=1,
+                                       event_count=0, elapsed=0,
+                                       latencies=[])
+
+        self.assertIn('switches', benchmark.format_result(result))
+
+
+class TestTransportBenchmark(util.TestCase):
+    def test_measure_transports(self):
+        results = benchmark.measure_transports(transfer_count=10)
+
+        self.assertEqual([result.transport for result in results],
+                         ['pyusb', 'usbfs'])
+        for result in results:
+            self.assertGreater(result.write_time, 0)
+            self.assertGreater(result.read_time, 0)
+
+    def test_usbfs_is_only_imported_to_measure_it(self):
+        check = ('import sys, yak_server.benchmark; '
+                 'print("yak_server.usbfs" in sys.modules)')
+
+        output = subprocess.run([sys.executable, '-c', check], check=True,
+                                stdout=subprocess.PIPE).stdout
+
+        self.assertEqual(output.strip(), b'False')
@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import bus
+from yak_server import events
+from yak_server import virtual
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Condition not met in time.')
+        time.sleep(0.001)
+
+
+class BusTestCase(util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.bus').setLevel(logging.ERROR)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'bus')
+
+    def start_bus(self, **kwargs):
+        event_bus = bus.EventBus(self.path, **kwargs)
+        event_bus.start()
+        self.addCleanup(event_bus.close)
+        return event_bus
+
+
+class TestMessages(util.TestCase):
+    def test_round_trip(self):
+        event = events.PatternEvent(pattern='double', device='1-2')
+
+        message = bus.decode_message(
+            bus.encode_message(bus.EVENT, event)[bus.MESSAGE_LENGTH.size:])
+
+        self.assertEqual(message, bus.BusMessage(
+            kind=bus.EVENT, type_name='PatternEvent',
+            timestamp=event.timestamp, device='1-2', detail='double'))
+
+
+class TestEventBus(BusTestCase):
+    def test_subscribers_get_the_messages_they_asked_for(self):
+        event_bus = self.start_bus()
+        received = []
+
+        def read():
+            messages = bus.subscribe(self.path, devices=['1-2'],
+                                     types=bus.type_names(
+                                         events.ButtonDownEvent))
+            for message in messages:
+                received.append(message)
+                if len(received) == 2:
+                    return
+        threading.Thread(target=read, daemon=True).start()
+        wait_until(lambda: event_bus.subscriber_count() == 1)
+
+        event_bus.publish(bus.EVENT, events.ButtonDownEvent(device='1-3'))
+        event_bus.publish(bus.EVENT, events.ButtonUpEvent(device='1-2'))
+        event_bus.publish(bus.EVENT, events.ButtonDownEvent(device='1-2'))
+        event_bus.publish(bus.COMMAND, events.LampOnEvent(device='1-2'))
+        wait_until(lambda: len(received) == 2)
+
+        self.assertEqual([(message.kind, message.device)
+                          for message in received],
+                         [(bus.EVENT, '1-2'), (bus.COMMAND, '1-2')])
+
+    def test_slow_subscriber_lags_without_blocking(self):
+        event_bus = self.start_bus(buffer_size=4)
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(connection.close)
+        connection.connect(self.path)
+        connection.sendall(b'{}\n')
+        wait_until(lambda: event_bus.subscriber_count() == 1)
+
+        start = time.monotonic()
+        for _ in range(20000):
+            event_bus.publish(bus.EVENT, events.ButtonDownEvent(device='d'))
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(event_bus.subscriber_count(), 1)
+        # pylint: disable = protected-access
+        self.assertGreater(event_bus._subscribers[0].lagged, 0)
+
+    def test_slow_subscriber_is_disconnected(self):
+        event_bus = self.start_bus(buffer_size=4, policy=bus.DISCONNECT)
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(connection.close)
+        connection.connect(self.path)
+        connection.sendall(b'{}\n')
+        wait_until(lambda: event_bus.subscriber_count() == 1)
+
+        for _ in range(20000):
+            event_bus.publish(bus.EVENT, events.ButtonDownEvent(device='d'))
+
+        self.assertEqual(event_bus.subscriber_count(), 0)
+
+
+class TestApplicationBus(BusTestCase):
+    def test_events_and_commands_are_published(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        event_bus = bus.EventBus(self.path)
+        self.addCleanup(event_bus.close)
+        application = yak_server.__main__.Application(
+            device_backend=fleet, event_bus=event_bus)
+        application.setup()
+        received = []
+
+        def read():
+            for message in bus.subscribe(self.path):
+                received.append(message)
+        threading.Thread(target=read, daemon=True).start()
+        wait_until(lambda: event_bus.subscriber_count() == 1)
+
+        application.handle_event(events.ButtonDownEvent(
+            device=fleet.switches[0].identifier))
+        wait_until(lambda: len(received) == 2)
+
+        self.assertEqual([message.kind for message in received],
+                         [bus.EVENT, bus.COMMAND])
+        self.assertEqual(received[1].device, fleet.ac_devices[0].identifier)
@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, unused-argument
+
+import io
+import unittest.mock
+
+from tests import util
+from tests.doubles import fake_usb
+
+from yak_server import capture
+from yak_server import clock
+from yak_server import usbdevice
+
+
+CLASS_ID = usbdevice.DeviceClassID(vendor_id=0x04d8,
+                                   product_id=0x5900,
+                                   release_number=0x0000)
+
+
+class UnclosableBytesIO(io.BytesIO):
+    def close(self):
+        pass
+
+
+def make_capture(records, interval=0.0):
+    """Return a reader for a capture containing the given records.
+
+    The records are 'interval' seconds apart.
+    """
+    file = UnclosableBytesIO()
+    capture_clock = clock.VirtualClock()
+    writer = capture.CaptureWriter(file, CLASS_ID, capture_clock)
+    for direction, data in records:
+        capture_clock.advance(interval)
+        if direction == capture.READ:
+            writer.record_read(data)
+        else:
+            writer.record_write(data)
+    file.seek(0)
+    return capture.CaptureReader(file)
+
+
+class TestCapture(util.TestCase):
+    def test_records_round_trip(self):
+        reader = make_capture([(capture.READ, b'\x01'),
+                               (capture.WRITE, b'\x00\x01')])
+
+        records = list(reader)
+
+        self.assertEqual(reader.class_identifier, CLASS_ID)
+        self.assertEqual([(r.direction, r.data) for r in records],
+                         [(capture.READ, b'\x01'),
+                          (capture.WRITE, b'\x00\x01')])
+
+    def test_records_are_timestamped_in_order(self):
+        reader = make_capture([(capture.READ, b'\x01')] * 3)
+
+        timestamps = [record.timestamp for record in reader]
+
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_invalid_file_raises_capture_error(self):
+        with self.assertRaises(capture.CaptureError):
+            capture.CaptureReader(io.BytesIO(b'not a capture'))
+
+    def test_truncated_record_raises_capture_error(self):
+        file = io.BytesIO()
+        capture.CaptureWriter(file, CLASS_ID).record_read(b'\x01\x02')
+        reader = capture.CaptureReader(io.BytesIO(file.getvalue()[:-1]))
+
+        with self.assertRaises(capture.CaptureError):
+            list(reader)
+
+
+class TestUSBDeviceCapture(util.TestCase):
+    def test_capture_records_reads(self):
+        mock_writer = unittest.mock.Mock()
+        usb_device = usbdevice.USBDevice(fake_usb.FakeRawUSBDevice())
+        usb_device.connect()
+        usb_device.start_capture(mock_writer)
+
+        usb_device.read(2)
+
+        mock_writer.record_read.assert_called_once_with(b'ab')
+
+    def test_capture_records_writes(self):
+        mock_writer = unittest.mock.Mock()
+        fake_raw_device = fake_usb.FakeRawUSBDevice()
+        interface = fake_raw_device.configuration.interface
+        interface.endpoint_list = [interface.out_endpoint]
+        usb_device = usbdevice.USBDevice(fake_raw_device)
+        usb_device.connect()
+        usb_device.start_capture(mock_writer)
+
+        usb_device.write(b'test')
+
+        mock_writer.record_write.assert_called_once_with(b'test')
+
+    def test_stop_capture(self):
+        mock_writer = unittest.mock.Mock()
+        usb_device = usbdevice.USBDevice(fake_usb.FakeRawUSBDevice())
+        usb_device.connect()
+        usb_device.start_capture(mock_writer)
+        usb_device.stop_capture()
+
+        usb_device.read(2)
+
+        mock_writer.record_read.assert_not_called()
+
+
+class TestReplayDevice(util.TestCase):
+    def test_replays_reads_at_maximum_speed(self):
+        reader = make_capture([(capture.READ, b'\x01'),
+                               (capture.WRITE, b'\x01'),
+                               (capture.READ, b'\x00')])
+        device = capture.ReplayDevice(reader, speed=None)
+        device.connect()
+
+        data = device.read(1) + device.read(1)
+
+        self.assertEqual(data, b'\x01\x00')
+
+    def test_splits_records_over_reads(self):
+        reader = make_capture([(capture.READ, b'\x00\x04')])
+        device = capture.ReplayDevice(reader, speed=None)
+
+        self.assertEqual(device.read(1), b'\x00')
+        self.assertEqual(device.read(1), b'\x04')
+
+    def test_collects_written_data(self):
+        device = capture.ReplayDevice(make_capture([]), speed=None)
+
+        device.write(b'\x01')
+
+        self.assertEqual(device.written, [b'\x01'])
+
+    def test_read_after_end_returns_when_closed(self):
+        device = capture.ReplayDevice(make_capture([]), speed=None)
+        device.close()
+
+        data = device.read(1)
+
+        self.assertEqual(data, b'')
+        self.assertTrue(device.finished.is_set())
+
+    def test_replay_respects_speed(self):
+        reader = make_capture([(capture.READ, b'\x01'),
+                               (capture.READ, b'\x00')], interval=1.0)
+        replay_clock = clock.VirtualClock()
+        device = capture.ReplayDevice(reader, speed=2.0,
+                                      replay_clock=replay_clock)
+        device.connect()
+
+        self.assertEqual(device.read(2), b'\x01\x00')
+        self.assertEqual(replay_clock.monotonic(), 0.5)
+
+    def test_can_stand_in_for_usb_device(self):
+        device = capture.ReplayDevice(make_capture([]), identifier='cap')
+
+        self.assertEqual(device.identifier, 'cap')
+        self.assertIn('cap', device.device_info())
+
+    def test_close_closes_reader(self):
+        reader = unittest.mock.MagicMock()
+
+        with capture.ReplayDevice(reader, speed=None):
+            pass
+
+        reader.close.assert_called_once_with()
+
+    def test_measures_read_to_write_latency_and_rates(self):
+        replay_clock = clock.VirtualClock()
+        reader = make_capture([(capture.READ, b'\x01')])
+        device = capture.ReplayDevice(reader, speed=None,
+                                      replay_clock=replay_clock)
+        device.connect()
+        replay_clock.advance(1.0)
+
+        device.read(1)
+        replay_clock.advance(0.5)
+        device.write(b'\x01')
+        replay_clock.advance(0.5)
+
+        self.assertEqual(device.latencies(), [0.5])
+        self.assertEqual(device.read_rate(), 0.5)
+        self.assertEqual(device.write_rate(), 0.5)
@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, unused-argument
+
+import datetime
+import queue
+import threading
+
+from tests import util
+
+from yak_server import clock
+
+
+class TestSystemClock(util.TestCase):
+    def test_get_returns_queued_item(self):
+        source_queue = queue.Queue()
+        source_queue.put('item')
+
+        self.assertEqual(clock.SystemClock().get(source_queue), 'item')
+
+    def test_get_raises_empty_on_timeout(self):
+        with self.assertRaises(queue.Empty):
+            clock.SystemClock().get(queue.Queue(), timeout=0)
+
+    def test_wait_returns_if_event_is_set(self):
+        event = threading.Event()
+        event.set()
+
+        self.assertTrue(clock.SystemClock().wait(event, timeout=10))
+
+
+class TestVirtualClock(util.TestCase):
+    def setUp(self):
+        self.start = datetime.datetime(2017, 5, 7, 21, 5)
+        self.clock = clock.VirtualClock(start=self.start)
+
+    def test_starts_at_start_time(self):
+        self.assertEqual(self.clock.now(), self.start)
+        self.assertEqual(self.clock.monotonic(), 0)
+
+    def test_advance(self):
+        self.clock.advance(3600)
+
+        self.assertEqual(self.clock.now(),
+                         self.start + datetime.timedelta(hours=1))
+        self.assertEqual(self.clock.monotonic(), 3600)
+
+    def test_can_not_go_back(self):
+        with self.assertRaises(ValueError):
+            self.clock.advance(-1)
+
+    def test_sleep_advances_immediately(self):
+        self.clock.sleep(24 * 3600)
+
+        self.assertEqual(self.clock.monotonic(), 24 * 3600)
+
+    def test_get_timeout_advances_clock(self):
+        with self.assertRaises(queue.Empty):
+            self.clock.get(queue.Queue(), timeout=10)
+
+        self.assertEqual(self.clock.monotonic(), 10)
+
+    def test_get_returns_item_without_advancing(self):
+        source_queue = queue.Queue()
+        source_queue.put('item')
+
+        self.assertEqual(self.clock.get(source_queue, timeout=10), 'item')
+        self.assertEqual(self.clock.monotonic(), 0)
+
+    def test_wait_timeout_advances_clock(self):
+        self.assertFalse(self.clock.wait(threading.Event(), timeout=10))
+
+        self.assertEqual(self.clock.monotonic(), 10)
+
+    def test_concurrent_sleepers_wake_at_their_deadlines(self):
+        virtual_clock = clock.VirtualClock(settle=0.05)
+        woken = {}
+        barrier = threading.Barrier(2)
+
+        def sleep(seconds):
+            barrier.wait()
+            virtual_clock.sleep(seconds)
+            woken[seconds] = virtual_clock.monotonic()
+        threads = [threading.Thread(target=sleep, args=(seconds,))
+                   for seconds in (5, 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(woken, {3: 3, 5: 5})
+        self.assertEqual(virtual_clock.monotonic(), 5)
+
+    def test_get_sees_an_item_put_while_settling(self):
+        virtual_clock = clock.VirtualClock(settle=0.5)
+        source_queue = queue.Queue()
+        timer = threading.Timer(0.01, source_queue.put, args=('item',))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.assertEqual(virtual_clock.get(source_queue, timeout=10), 'item')
+        self.assertEqual(virtual_clock.monotonic(), 0)
+
+
+class TestDefaultClock(util.TestCase):
+    def test_set_clock_returns_previous(self):
+        virtual_clock = clock.VirtualClock()
+
+        previous_clock = clock.set_clock(virtual_clock)
+        self.addCleanup(clock.set_clock, previous_clock)
+
+        self.assertIs(clock.get_clock(), virtual_clock)
+        self.assertIsInstance(previous_clock, clock.SystemClock)
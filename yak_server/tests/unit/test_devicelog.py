@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import io
+import json
+import logging
+import unittest.mock
+
+from tests import util
+
+from yak_server import clock
+from yak_server import devicelog
+from yak_server import usbdevice
+
+
+class TestDeviceLog(util.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('tests.devicelog')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.stream = io.StringIO()
+        self.handler = devicelog.JsonLinesHandler(self.stream)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.describe = unittest.mock.Mock(return_value='board')
+        self.clock = clock.VirtualClock()
+        self.log = devicelog.DeviceLog(self.logger, self.describe,
+                                       error_burst=2, error_interval=10,
+                                       log_clock=self.clock)
+
+    def records(self):
+        lines = self.stream.getvalue().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_disabled_levels_cost_no_formatting(self):
+        self.log.debug('reading {device} {size}', size=8)
+
+        self.describe.assert_not_called()
+        self.assertEqual(self.stream.getvalue(), '')
+
+    def test_description_is_built_once(self):
+        self.log.info('one {device}')
+        self.log.info('two {device}')
+
+        self.describe.assert_called_once_with()
+
+    def test_records_are_structured(self):
+        self.log.info('claimed {interface} of {device}', interface=0)
+
+        record, = self.records()
+        self.assertEqual(record['template'], 'claimed {interface} of {device}')
+        self.assertEqual(record['fields'], {'interface': 0})
+        self.assertEqual(record['device'], 'board')
+        self.assertEqual(record['level'], 'INFO')
+
+    def test_messages_are_formatted_for_text_handlers(self):
+        with self.assertLogs(self.logger, level='INFO') as logs:
+            self.log.info('claimed {interface} of {device}', interface=0)
+
+        self.assertIn('claimed 0 of board', logs.output[0])
+
+    def test_repeated_errors_are_suppressed_and_counted(self):
+        for _ in range(5):
+            self.log.error('write to {device} failed')
+        self.clock.advance(10)
+        self.log.error('write to {device} failed')
+
+        records = self.records()
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[2]['fields'], {'suppressed': 3})
+
+    def test_errors_are_limited_per_message(self):
+        for _ in range(3):
+            self.log.error('first {device}')
+            self.log.error('second {device}')
+
+        self.assertEqual(len(self.records()), 4)
+
+
+class TestBinaryLogHandler(util.TestCase):
+    def test_round_trip(self):
+        logger = logging.getLogger('tests.devicelog.binary')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        stream = io.BytesIO()
+        handler = devicelog.BinaryLogHandler(stream)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        log = devicelog.DeviceLog(logger, lambda: 'board')
+
+        log.info('wrote {length} bytes to {device}', length=2)
+        logger.warning('plain message')
+        stream.seek(0)
+        records = list(devicelog.read_binary_log(stream))
+
+        self.assertEqual([record[1:] for record in records], [
+            (logging.INFO, 'wrote {length} bytes to {device}', 'board',
+             {'length': 2}),
+            (logging.WARNING, 'plain message', None, {})])
+
+    def test_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            list(devicelog.read_binary_log(io.BytesIO(b'nope')))
+
+
+class TestUSBDeviceLog(util.TestCase):
+    def test_device_info_is_cached(self):
+        raw_device = unittest.mock.MagicMock()
+        raw_device.__repr__ = unittest.mock.Mock(return_value='raw')
+        usb_device = usbdevice.USBDevice(raw_device)
+
+        usb_device.device_info()
+        usb_device.device_info()
+
+        self.assertEqual(usb_device.device_info(), 'raw')
+        raw_device.__repr__.assert_called_once_with()
@@ -2,14 +2,22 @@
 
 # pylint: disable = no-self-use, unused-argument
 
+import os
+import subprocess
+import sys
 import unittest
 import unittest.mock
 
 from tests import util
 
+import yak_server.clock
 import yak_server.events
 
 
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
 class TestEvent(util.TestCase):
     def test_initialize_with_timestamp(self):
         event = yak_server.events.Event(timestamp='yesterday')
@@ -17,8 +25,43 @@ class TestEvent(util.TestCase):
         self.assertEqual(event.timestamp, 'yesterday')
 
     def test_uses_current_time_if_none_given(self):
-        datetime_patch_target = 'yak_server.events.datetime.datetime'
+        datetime_patch_target = 'yak_server.clock.datetime.datetime'
         with unittest.mock.patch(datetime_patch_target) as datetime_mock:
             event = yak_server.events.Event()
 
             self.assertEqual(event.timestamp, datetime_mock.now.return_value)
+
+    def test_uses_time_of_default_clock(self):
+        virtual_clock = yak_server.clock.VirtualClock()
+        virtual_clock.advance(60)
+        previous_clock = yak_server.clock.set_clock(virtual_clock)
+        self.addCleanup(yak_server.clock.set_clock, previous_clock)
+
+        event = yak_server.events.Event()
+
+        self.assertEqual(event.timestamp, virtual_clock.now())
+
+    def test_device_defaults_to_none(self):
+        event = yak_server.events.Event()
+
+        self.assertIsNone(event.device)
+
+    def test_from_device_copies_event(self):
+        event = yak_server.events.ButtonDownEvent(timestamp='yesterday')
+
+        device_event = event.from_device('1-2')
+
+        self.assertIsInstance(device_event, yak_server.events.ButtonDownEvent)
+        self.assertEqual(device_event.device, '1-2')
+        self.assertEqual(device_event.timestamp, 'yesterday')
+
+    def test_defaults_do_not_depend_on_hash_seed(self):
+        # Value fields are kept in a set, so their order depends on the
+        # hash seed. Event creation must work for any order.
+        code = ('from yak_server import events; '
+                'events.LampOnEvent(); events.Event(device="d")')
+        for seed in range(8):
+            environment = dict(os.environ, PYTHONHASHSEED=str(seed))
+            subprocess.run([sys.executable, '-c', code], env=environment,
+                           cwd=PROJECT_DIR, check=True,
+                           stderr=subprocess.DEVNULL)
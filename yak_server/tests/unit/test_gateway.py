@@ -0,0 +1,173 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import logging
+import queue
+import socket
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import events
+from yak_server import gateway
+from yak_server import virtual
+
+
+class TestFrames(util.TestCase):
+    def test_round_trip(self):
+        event_list = [events.ButtonDownEvent(device='switch'),
+                      events.ButtonUpEvent()]
+
+        node, decoded = gateway.decode_frame(
+            gateway.encode_frame('hall', event_list))
+
+        self.assertEqual(node, 'hall')
+        self.assertEqual(len(decoded), 2)
+        self.assert_event_equal(decoded[0], event_list[0])
+        self.assert_event_equal(decoded[1], event_list[1])
+        self.assertEqual(decoded[0].timestamp, event_list[0].timestamp)
+
+    def test_events_are_compact(self):
+        frame = gateway.encode_frame('n', [events.ButtonDownEvent(device='s')])
+
+        self.assertEqual(len(frame), 16)
+
+    def test_invalid_frames_raise_gateway_error(self):
+        frame = gateway.encode_frame('n', [events.ButtonDownEvent()])
+
+        with self.assertRaises(gateway.GatewayError):
+            gateway.decode_frame(frame[:-1])
+        with self.assertRaises(gateway.GatewayError):
+            gateway.decode_frame(b'\x09' + frame[1:])
+
+    def test_only_button_events_are_sent(self):
+        with self.assertRaises(gateway.GatewayError):
+            gateway.encode_frame('n', [events.Event()])
+
+    def test_remote_names(self):
+        name = gateway.remote_name('hall', '1-2')
+
+        self.assertEqual(gateway.split_remote_name(name), ('hall', '1-2'))
+        self.assertEqual(gateway.split_remote_name('1-2'), (None, '1-2'))
+
+
+class TestLoopbackNode(util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.gateway').setLevel(logging.ERROR)
+        self.gateway = gateway.GatewayInterface()
+
+    def test_events_carry_remote_device_names(self):
+        node = gateway.LoopbackNode('hall', self.gateway)
+
+        node.forward_all([events.ButtonDownEvent(device='a'),
+                          events.ButtonUpEvent(device='b')])
+
+        self.assertEqual([self.gateway.get_event().device for _ in range(2)],
+                         ['hall/a', 'hall/b'])
+
+    def test_commands_go_to_their_node_in_one_frame(self):
+        hall = gateway.LoopbackNode('hall', self.gateway)
+        garden = gateway.LoopbackNode('garden', self.gateway)
+
+        self.gateway.send_commands([events.LampOnEvent(device='hall/ac'),
+                                    events.LampOffEvent(device='hall/ac')])
+
+        self.assertEqual(hall.frame_count, 1)
+        self.assertEqual([command.device for command in hall.commands],
+                         ['ac', 'ac'])
+        self.assertEqual(garden.commands, [])
+
+    def test_commands_for_unknown_nodes_are_dropped(self):
+        node = gateway.LoopbackNode('hall', self.gateway)
+        node.close()
+
+        self.gateway.send_command(events.LampOnEvent(device='hall/ac'))
+
+        self.assertEqual(node.commands, [])
+        self.assertEqual(self.gateway.nodes(), [])
+
+
+class TestNetwork(util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.gateway').setLevel(logging.ERROR)
+        self.gateway = gateway.GatewayInterface(host='127.0.0.1', port=0)
+        self.gateway.initialize()
+        self.addCleanup(self.gateway.close)
+
+    def test_events_and_commands_over_tcp(self):
+        commands = queue.Queue()
+        node = gateway.GatewayNode('hall', self.gateway.address,
+                                   on_command=commands.put)
+        node.connect()
+        self.addCleanup(node.close)
+
+        for _ in range(3):
+            node.forward(events.ButtonDownEvent(device='switch'))
+        received = [self.gateway.get_event() for _ in range(3)]
+        self.gateway.send_command(events.LampOnEvent(device='hall/ac'))
+
+        self.assertEqual({event.device for event in received},
+                         {'hall/switch'})
+        self.assertEqual(commands.get(timeout=5).device, 'ac')
+        self.assertEqual(self.gateway.nodes(), ['hall'])
+
+    def test_node_reconnects_after_losing_the_connection(self):
+        commands = queue.Queue()
+        node = gateway.GatewayNode('hall', self.gateway.address,
+                                   on_command=commands.put,
+                                   initial_delay=0.01)
+        node.connect()
+        self.addCleanup(node.close)
+        lost = node._socket  # pylint: disable = protected-access
+
+        lost.shutdown(socket.SHUT_RDWR)
+        node.forward(events.ButtonDownEvent(device='switch'))
+        received = self.gateway.get_event()
+        self.gateway.send_command(events.LampOnEvent(device='hall/ac'))
+
+        self.assertEqual(received.device, 'hall/switch')
+        self.assertEqual(commands.get(timeout=5).device, 'ac')
+
+    def test_events_over_udp(self):
+        frame = gateway.encode_frame('hall',
+                                     [events.ButtonUpEvent(device='s')])
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+            udp.sendto(frame, self.gateway.address)
+
+        self.assertEqual(self.gateway.get_event().device, 'hall/s')
+
+
+class TestApplicationGateway(util.TestCase):
+    def test_remote_switch_drives_remote_lamp(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        remote_gateway = gateway.GatewayInterface(host='127.0.0.1', port=0)
+        self.addCleanup(remote_gateway.close)
+        application = yak_server.__main__.Application(
+            device_backend=fleet, gateway=remote_gateway)
+        application.setup()
+        node = gateway.LoopbackNode('hall', remote_gateway)
+
+        node.forward(events.ButtonDownEvent(device='switch'))
+        event = application.get_event()
+        application.send_command(events.LampOnEvent(device='hall/ac'))
+
+        self.assertEqual(event.device, 'hall/switch')
+        self.assertEqual([command.device for command in node.commands],
+                         ['ac'])
+
+    def test_remote_switch_events_go_back_to_their_node(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        remote_gateway = gateway.GatewayInterface(host='127.0.0.1', port=0)
+        self.addCleanup(remote_gateway.close)
+        application = yak_server.__main__.Application(
+            device_backend=fleet, gateway=remote_gateway)
+        application.setup()
+        node = gateway.LoopbackNode('hall', remote_gateway)
+
+        node.forward(events.ButtonDownEvent(device='switch'))
+        application.handle_event(application.get_event())
+
+        self.assertEqual([(type(command), command.device)
+                          for command in node.commands],
+                         [(events.LampOnEvent, 'switch')])
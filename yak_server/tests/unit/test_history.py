@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import datetime
+import os
+import tempfile
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import bus
+from yak_server import events
+from yak_server import history
+from yak_server import virtual
+
+
+class HistoryTestCase(util.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'history')
+
+    def open_recorder(self):
+        recorder = history.HistoryRecorder(self.path)
+        self.addCleanup(recorder.close)
+        return recorder
+
+
+class TestHistoryRecorder(HistoryTestCase):
+    def test_records_are_fixed_size(self):
+        timestamp = datetime.datetime(2024, 1, 2, 3, 4, 5, 678901)
+        recorder = self.open_recorder()
+
+        recorder.record(bus.EVENT, events.ButtonDownEvent(
+            device='hall', timestamp=timestamp))
+        recorder.record(bus.COMMAND, events.LampOffEvent(
+            device='ac', timestamp=timestamp))
+        recorder.record(bus.EVENT, events.PatternEvent(
+            device='hall', pattern='double', timestamp=timestamp))
+
+        self.assertEqual(os.path.getsize(self.path), 3 * history.RECORD.size)
+        nanoseconds = history.timestamp_ns(timestamp)
+        self.assertEqual(nanoseconds % 1000000000, 678901000)
+        self.assertEqual(history.read_records(self.path), [
+            (nanoseconds, 0, history.DOWN, bus.EVENT),
+            (nanoseconds, 1, history.UP, bus.COMMAND),
+            (nanoseconds, 0, history.PATTERN, bus.EVENT)])
+        self.assertEqual(history.read_devices(self.path), ['hall', 'ac'])
+
+    def test_device_numbers_are_kept_when_reopened(self):
+        self.open_recorder().record(bus.EVENT, events.ButtonDownEvent(
+            device='hall'))
+        recorder = self.open_recorder()
+
+        recorder.record(bus.EVENT, events.ButtonDownEvent(device='garden'))
+        recorder.record(bus.EVENT, events.ButtonUpEvent(device='hall'))
+
+        self.assertEqual([record[1] for record in
+                          history.read_records(self.path)], [0, 1, 0])
+        self.assertEqual(history.read_devices(self.path), ['hall', 'garden'])
+
+    def test_partial_records_are_ignored(self):
+        self.open_recorder().record(bus.EVENT, events.ButtonDownEvent(
+            device='hall'))
+        with open(self.path, 'ab') as history_file:
+            history_file.write(b'\0\0\0')
+
+        self.assertEqual(len(history.read_records(self.path)), 1)
+
+
+class TestApplicationHistory(HistoryTestCase):
+    def test_events_and_commands_are_recorded(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        application = yak_server.__main__.Application(
+            device_backend=fleet, history=self.open_recorder())
+        application.setup()
+
+        application.handle_event(events.ButtonDownEvent(
+            device=fleet.switches[0].identifier))
+
+        self.assertEqual([record[2:] for record in
+                          history.read_records(self.path)],
+                         [(history.DOWN, bus.EVENT),
+                          (history.DOWN, bus.COMMAND)])
+        self.assertEqual(history.read_devices(self.path),
+                         [fleet.switches[0].identifier,
+                          fleet.ac_devices[0].identifier])
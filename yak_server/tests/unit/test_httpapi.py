@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import http.client
+import json
+import logging
+import socket
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import events
+from yak_server import httpapi
+from yak_server import virtual
+
+
+class TestHttpApi(util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.httpapi').setLevel(logging.CRITICAL)
+        self.fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        self.application = yak_server.__main__.Application(
+            device_backend=self.fleet)
+        self.application.setup()
+        self.api = httpapi.HttpApi(self.application, port=0)
+        self.api.start()
+        self.addCleanup(self.api.close)
+        self.switch = self.fleet.switches[0].identifier
+        self.lamp = self.fleet.ac_devices[0].identifier
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection(*self.api.address, timeout=5)
+        self.addCleanup(connection.close)
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_interfaces(self):
+        status, payload = self.request('GET', '/interfaces')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(payload, {'inputs': [self.switch],
+                                   'outputs': [self.lamp]})
+
+    def test_states_follow_handled_events(self):
+        self.application.handle_event(events.ButtonDownEvent(
+            device=self.switch))
+
+        self.assertEqual(self.request('GET', '/state'), (200, {
+            self.switch: True, self.lamp: True}))
+        self.assertEqual(self.request('GET', '/state/' + self.lamp), (200, {
+            'device': self.lamp, 'on': True}))
+
+    def test_errors(self):
+        self.assertEqual(self.request('GET', '/state/unknown')[0], 404)
+        self.assertEqual(self.request('GET', '/nothing')[0], 404)
+        self.assertEqual(self.request('POST', '/interfaces')[0], 405)
+        self.assertEqual(self.request('POST', '/commands', b'{')[0], 400)
+        self.assertEqual(self.request('POST', '/commands', b'{}')[0], 400)
+
+    def test_invalid_commands_are_not_sent(self):
+        for command, expected_status in (
+                ({'device': 'unknown', 'on': True}, 404),
+                ({'device': self.switch, 'on': True}, 404),
+                ({'device': [self.lamp], 'on': True}, 400),
+                ({'device': self.lamp, 'on': 'false'}, 400)):
+            status, _ = self.request('POST', '/commands', json.dumps(
+                [{'device': self.lamp, 'on': True}, command]))
+
+            self.assertEqual(status, expected_status)
+        self.assertIsNone(self.application.get_event(timeout=0))
+
+    def test_commands_are_sent_from_the_main_loop(self):
+        status, payload = self.request('POST', '/commands', json.dumps(
+            [{'device': self.lamp, 'on': True},
+             {'device': self.lamp, 'on': False},
+             {'device': self.lamp, 'on': True}]))
+
+        self.assertEqual((status, payload), (202, {'accepted': 3}))
+        self.assertFalse(self.fleet.ac_devices[0].lamp_on)
+        self.application.handle_event(self.application.get_event(timeout=5))
+        self.assertTrue(self.fleet.ac_devices[0].lamp_on)
+        self.assertEqual(self.application.device_states[self.lamp], True)
+
+    def test_pipelined_requests_are_answered_in_order(self):
+        client = socket.create_connection(self.api.address, timeout=5)
+        self.addCleanup(client.close)
+        request = b'GET /state/%s HTTP/1.1\r\nHost: x\r\n\r\n'
+        client.sendall(request % b'unknown' + b'GET /state HTTP/1.1\r\n'
+                       b'Connection: close\r\n\r\n')
+        received = b''
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            received += data
+
+        responses = received.split(b'HTTP/1.1 ')[1:]
+        self.assertEqual([response[:3] for response in responses],
+                         [b'404', b'200'])
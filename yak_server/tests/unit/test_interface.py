@@ -2,12 +2,17 @@
 
 # pylint: disable = no-self-use, unused-argument
 
+import threading
+import time
 import unittest
 import unittest.mock
 
 from tests import util
 
+import yak_server.events
 import yak_server.interface
+import yak_server.supervisor
+import yak_server.translators
 import yak_server.usbdevice
 
 
@@ -35,6 +40,28 @@ class TestUSBInterface(util.TestCase):
 
         self.assertEqual(event, b'a_event')
 
+    def test_commands_for_a_device_not_connected_yet_are_kept(self):
+        # pylint: disable = protected-access
+        stub_usbdevice = unittest.mock.Mock(identifier='1-1')
+        supervised = yak_server.supervisor.SupervisedDevice(stub_usbdevice)
+        interface = yak_server.interface.USBInterface(
+            supervised, yak_server.translators.ACInterfaceTranslatorV0_0_2())
+        self.start_patch('yak_server.supervisor._LOGGER')
+
+        interface.send_commands([yak_server.events.LampOnEvent(),
+                                 yak_server.events.LampOffEvent()])
+
+        stub_usbdevice.write.assert_not_called()
+        self.assertEqual(supervised._last_written, b'\xba\x01\x00')
+
+    def test_no_data_is_no_event(self):
+        stub_usbdevice = unittest.mock.Mock()
+        stub_usbdevice.read.return_value = b''
+        interface = yak_server.interface.USBInterface(
+            stub_usbdevice, yak_server.translators.SwitchInterfaceTranslator())
+
+        self.assertIsNone(interface.get_event())
+
     def test_send_command(self):
         mock_usbdevice = unittest.mock.Mock()
         stub_translator = unittest.mock.Mock()
@@ -47,6 +74,41 @@ class TestUSBInterface(util.TestCase):
 
         mock_usbdevice.write.assert_called_once_with(b'a')
 
+    def test_send_commands_writes_the_packets_of_the_translator(self):
+        mock_usbdevice = unittest.mock.Mock()
+        mock_usbdevice.max_packet_size = 8
+        stub_translator = unittest.mock.Mock()
+        stub_translator.events_to_raw_packets.return_value = [b'ab', b'c']
+        interface = yak_server.interface.USBInterface(mock_usbdevice,
+                                                      stub_translator)
+
+        interface.send_commands([b'a', b'b', b'c'])
+
+        stub_translator.events_to_raw_packets.assert_called_once_with(
+            [b'a', b'b', b'c'], 8)
+        self.assertEqual(mock_usbdevice.write.call_args_list,
+                         [unittest.mock.call(b'ab'), unittest.mock.call(b'c')])
+
+    def test_sync_state_translates_the_state_of_the_device(self):
+        stub_usbdevice = unittest.mock.Mock()
+        stub_usbdevice.query_state.return_value = b'\x01'
+        interface = yak_server.interface.USBInterface(
+            stub_usbdevice, yak_server.translators.SwitchInterfaceTranslator())
+
+        event = interface.sync_state()
+
+        stub_usbdevice.query_state.assert_called_once_with(1)
+        self.assertIsInstance(event, yak_server.events.ButtonDownEvent)
+
+    def test_sync_state_of_a_device_that_cannot_tell(self):
+        stub_usbdevice = unittest.mock.Mock()
+        stub_usbdevice.query_state.side_effect = (
+            yak_server.usbdevice.USBError('Pipe error'))
+        interface = yak_server.interface.USBInterface(
+            stub_usbdevice, yak_server.translators.SwitchInterfaceTranslator())
+
+        self.assertIsNone(interface.sync_state())
+
 
 class TestInterfaceManager(util.TestCase):
     DEFAULT_DEVICE_CLASS_ID = yak_server.usbdevice.DeviceClassID(
@@ -60,6 +122,7 @@ class TestInterfaceManager(util.TestCase):
                 product_id=0x5900,
                 release_number=0x0000)):
             self._device_class_id = device_class_id
+            self.identifier = '1-{}'.format(id(self))
 
         @property
         def class_identifier(self):
@@ -78,7 +141,8 @@ class TestInterfaceManager(util.TestCase):
             mock_usb_find.assert_called_once_with(vendor_id=0x04d8,
                                                   product_id=0x5900)
 
-        devices = [interface._usb_device for interface in interfaces]
+        devices = [interface._usb_device.usb_device
+                   for interface in interfaces]
         self.assertCountEqual(devices, connected_devices)
 
     def test_find_output_interfaces(self):
@@ -94,5 +158,164 @@ class TestInterfaceManager(util.TestCase):
             mock_usb_find.assert_called_once_with(vendor_id=0x04d8,
                                                   product_id=0x5901)
 
-        devices = [interface._usb_device for interface in interfaces]
+        devices = [interface._usb_device.usb_device
+                   for interface in interfaces]
         self.assertCountEqual(devices, connected_devices)
+
+    def test_uses_given_device_backend(self):
+        # pylint: disable = protected-access
+        stub_backend = unittest.mock.Mock()
+        stub_backend.find.return_value = [self.StubRawDevice()]
+        interface_manager = yak_server.interface.InterfaceManager(
+            stub_backend)
+
+        interfaces = interface_manager.input_interfaces()
+
+        stub_backend.find.assert_called_once_with(vendor_id=0x04d8,
+                                                  product_id=0x5900)
+        self.assertEqual(len(interfaces), 1)
+
+    def test_devices_are_found_again_by_identifier(self):
+        # pylint: disable = protected-access
+        lost_device = self.StubRawDevice()
+        new_device = self.StubRawDevice()
+        new_device.identifier = lost_device.identifier
+        stub_backend = unittest.mock.Mock()
+        stub_backend.find.return_value = [lost_device]
+        interface_manager = yak_server.interface.InterfaceManager(
+            stub_backend)
+        interface = interface_manager.input_interfaces()[0]
+
+        stub_backend.find.return_value = [self.StubRawDevice(), new_device]
+
+        self.assertIs(interface._usb_device._rediscover(), new_device)
+        stub_backend.find.return_value = []
+        with self.assertRaises(yak_server.usbdevice.USBError):
+            interface._usb_device._rediscover()
+
+    def test_supervisors_report_to_the_listener(self):
+        # pylint: disable = protected-access
+        stub_backend = unittest.mock.Mock()
+        stub_backend.find.return_value = [unittest.mock.Mock(
+            class_identifier=self.DEFAULT_DEVICE_CLASS_ID)]
+        listener = unittest.mock.Mock()
+        interface_manager = yak_server.interface.InterfaceManager(
+            stub_backend, listener=listener)
+        interface = interface_manager.input_interfaces()[0]
+
+        interface.initialize()
+
+        listener.assert_called_once_with(
+            interface.name, yak_server.supervisor.DISCONNECTED,
+            yak_server.supervisor.CONNECTED)
+
+    def test_translators_come_from_the_manifest(self):
+        stub_backend = unittest.mock.Mock()
+        stub_backend.find.return_value = [self.StubRawDevice()]
+        stub_manifest = unittest.mock.Mock()
+        stub_manifest.translator_class.return_value = unittest.mock.Mock
+        interface_manager = yak_server.interface.InterfaceManager(
+            stub_backend, stub_manifest)
+
+        interface = interface_manager.input_interfaces()[0]
+
+        self.assertIsInstance(interface.translator, unittest.mock.Mock)
+        stub_manifest.record.assert_not_called()
+
+    def test_translators_looked_up_are_recorded_in_the_manifest(self):
+        device = self.StubRawDevice()
+        stub_backend = unittest.mock.Mock()
+        stub_backend.find.return_value = [device]
+        stub_manifest = unittest.mock.Mock()
+        stub_manifest.translator_class.return_value = None
+        interface_manager = yak_server.interface.InterfaceManager(
+            stub_backend, stub_manifest)
+
+        interface_manager.input_interfaces()
+        interface_manager.check_manifest()
+
+        stub_manifest.record.assert_called_once_with(
+            device, yak_server.translators.SwitchInterfaceTranslator)
+        stub_manifest.check.assert_called_once_with([device])
+
+
+class TestInitializeAll(util.TestCase):
+    class StubInterface(yak_server.interface.Interface):
+        def __init__(self, name, release=None, error=None):
+            self.name = name
+            self.release = release
+            self.error = error
+
+        def initialize(self):
+            if self.release:
+                self.release.wait(timeout=5)
+            if self.error:
+                raise self.error
+
+    def setUp(self):
+        self.start_patch('yak_server.interface._LOGGER')
+        self.ready = []
+
+    def test_ready_interfaces_do_not_wait_for_slow_ones(self):
+        release = threading.Event()
+        slow = self.StubInterface('slow', release=release)
+        fast = self.StubInterface('fast')
+
+        not_ready = yak_server.interface.initialize_all(
+            [slow, fast], self.ready.append, timeout=0.05)
+
+        self.assertEqual(self.ready, [fast])
+        self.assertEqual(not_ready, [slow])
+        release.set()
+
+    def test_slow_interfaces_are_ready_later(self):
+        release = threading.Event()
+        slow = self.StubInterface('slow', release=release)
+        on_ready = threading.Event()
+
+        yak_server.interface.initialize_all(
+            [slow], lambda interface: on_ready.set(), timeout=0)
+        release.set()
+
+        self.assertTrue(on_ready.wait(timeout=5))
+
+    def test_failed_interfaces_are_not_ready(self):
+        broken = self.StubInterface(
+            'broken', error=yak_server.usbdevice.USBError('no'))
+
+        not_ready = yak_server.interface.initialize_all(
+            [broken], self.ready.append)
+
+        self.assertEqual(self.ready, [])
+        self.assertEqual(not_ready, [])
+
+    def test_interfaces_initializing_later_are_ready(self):
+        broken = self.StubInterface(
+            'broken', error=yak_server.usbdevice.USBError('no'))
+        broken.initialize_later = unittest.mock.Mock(return_value=True)
+
+        yak_server.interface.initialize_all([broken], self.ready.append)
+
+        broken.initialize_later.assert_called_once_with()
+        self.assertEqual(self.ready, [broken])
+
+    def test_number_of_parallel_initializations_is_bounded(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        class CountingInterface(yak_server.interface.Interface):
+            def initialize(self):
+                with lock:
+                    running.append(self)
+                    peak.append(len(running))
+                time.sleep(0.01)
+                with lock:
+                    running.remove(self)
+
+        yak_server.interface.initialize_all(
+            [CountingInterface() for _ in range(6)], self.ready.append,
+            max_workers=2)
+
+        self.assertEqual(len(self.ready), 6)
+        self.assertEqual(max(peak), 2)
@@ -0,0 +1,184 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import time
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import bus
+from yak_server import events
+from yak_server import httpapi
+from yak_server import livestream
+from yak_server import virtual
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Condition not met in time.')
+        time.sleep(0.001)
+
+
+class Client:
+    """A minimal WebSocket client reading text messages."""
+
+    def __init__(self, address, key='dGhlIHNhbXBsZSBub25jZQ=='):
+        self.socket = socket.create_connection(address, timeout=5)
+        self.file = self.socket.makefile('rb')
+        self.socket.sendall(
+            'GET /live HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\n'
+            'Connection: Upgrade\r\nSec-WebSocket-Key: {}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'.format(key).encode())
+        self.head = b''
+        while not self.head.endswith(b'\r\n\r\n'):
+            self.head += self.file.readline()
+
+    def receive(self):
+        first, length = self.file.read(2)
+        if length == 126:
+            length, = struct.unpack('!H', self.file.read(2))
+        payload = self.file.read(length)
+        return first & 0x0f, payload
+
+    def receive_message(self):
+        return json.loads(self.receive()[1])
+
+    def send(self, opcode, payload):
+        mask = os.urandom(4)
+        masked = bytes(byte ^ mask[index % 4]
+                       for index, byte in enumerate(payload))
+        self.socket.sendall(bytes([0x80 | opcode, 0x80 | len(payload)]) +
+                            mask + masked)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+class TestFrames(util.TestCase):
+    def test_accept_key(self):
+        self.assertEqual(livestream.accept_key('dGhlIHNhbXBsZSBub25jZQ=='),
+                         's3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+
+    def test_frame_lengths(self):
+        for length, head_size in [(5, 2), (200, 4), (70000, 10)]:
+            frame = livestream.encode_frame(livestream.TEXT, b'x' * length)
+
+            self.assertEqual(len(frame), head_size + length)
+            self.assertEqual(frame[0], 0x81)
+
+    def test_client_frames_are_unmasked(self):
+        async def read(data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            return await livestream.read_frame(reader)
+
+        for payload in [b'', b'a', b'hello', b'12345678']:
+            mask = b'\x01\x02\x03\x04'
+            masked = bytes(byte ^ mask[index % 4]
+                           for index, byte in enumerate(payload))
+            frame = bytes([0x89, 0x80 | len(payload)]) + mask + masked
+
+            self.assertEqual(asyncio.run(read(frame)),
+                             (livestream.PING, payload))
+
+
+class TestCoalescing(util.TestCase):
+    def test_newer_states_replace_waiting_ones(self):
+        client = livestream._Client(queue_size=8)
+        for event in [events.ButtonDownEvent(device='a'),
+                      events.ButtonDownEvent(device='b'),
+                      events.ButtonUpEvent(device='a')]:
+            client.put(livestream.coalescing_key(bus.EVENT, event),
+                       event.device.encode() + str(
+                           isinstance(event, events.ButtonDownEvent)).encode())
+
+        self.assertEqual(client.take(), b'aFalsebTrue')
+        self.assertFalse(client.ready.is_set())
+
+    def test_full_queue_drops_the_oldest_message(self):
+        client = livestream._Client(queue_size=2)
+        for device in 'abc':
+            client.put(device, device.encode())
+
+        self.assertEqual(client.take(), b'bc')
+        self.assertEqual(client.lagged, 1)
+
+
+class TestLiveStream(util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.livestream').setLevel(logging.ERROR)
+        self.fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        self.stream = livestream.LiveStream()
+        self.application = yak_server.__main__.Application(
+            device_backend=self.fleet, live_stream=self.stream)
+        self.application.setup()
+        api = httpapi.HttpApi(self.application, port=0)
+        self.stream.attach(api)
+        api.start()
+        self.addCleanup(api.close)
+        self.address = api.address
+        self.switch = self.fleet.switches[0].identifier
+
+    def connect(self):
+        client = Client(self.address)
+        self.addCleanup(client.close)
+        return client
+
+    def test_clients_get_the_states_and_then_the_events(self):
+        self.application.handle_event(events.ButtonDownEvent(
+            device=self.switch))
+        client = self.connect()
+
+        self.assertIn(b' 101 ', client.head)
+        self.assertIn(b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=', client.head)
+        self.assertEqual(client.receive_message()['states'][self.switch],
+                         True)
+        self.application.handle_event(events.ButtonUpEvent(
+            device=self.switch))
+        received = [client.receive_message(), client.receive_message()]
+        self.assertEqual([(item['kind'], item['on']) for item in received],
+                         [('event', False), ('command', False)])
+        self.assertEqual(received[0]['device'], self.switch)
+
+    def test_messages_are_encoded_once_for_all_clients(self):
+        clients = [self.connect() for _ in range(3)]
+        for client in clients:
+            client.receive_message()
+        wait_until(lambda: self.stream.client_count() == 3)
+        encode = self.start_patch('yak_server.livestream._encode_message',
+                                  wraps=livestream._encode_message)
+
+        self.stream.publish(bus.EVENT, events.PatternEvent(
+            device=self.switch, pattern='double'))
+
+        for client in clients:
+            self.assertEqual(client.receive_message()['pattern'], 'double')
+        self.assertEqual(encode.mock.call_count, 1)
+
+    def test_ping_and_close(self):
+        client = self.connect()
+        client.receive_message()
+
+        client.send(livestream.PING, b'hi')
+        self.assertEqual(client.receive(), (livestream.PONG, b'hi'))
+        client.send(livestream.CLOSE, b'\x03\xe8')
+        self.assertEqual(client.receive(), (livestream.CLOSE, b'\x03\xe8'))
+        wait_until(lambda: self.stream.client_count() == 0)
+
+    def test_handshake_needs_a_key(self):
+        connection = socket.create_connection(self.address, timeout=5)
+        self.addCleanup(connection.close)
+        connection.sendall(b'GET /live HTTP/1.1\r\nUpgrade: websocket\r\n'
+                           b'Connection: Upgrade\r\n\r\n')
+
+        self.assertTrue(connection.recv(4096).startswith(b'HTTP/1.1 400'))
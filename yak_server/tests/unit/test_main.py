@@ -2,12 +2,19 @@
 
 # pylint: disable = no-self-use, unused-argument
 
+import subprocess
+import sys
 import unittest
 import unittest.mock
 
 from tests import util
 
 import yak_server.__main__
+import yak_server.clock
+import yak_server.events
+import yak_server.statetable
+import yak_server.supervisor
+import yak_server.virtual
 
 
 MAIN_LOOP_PATCH_TARGET = 'yak_server.__main__.Application.main_loop_iteration'
@@ -48,6 +55,98 @@ class TestApplication(util.TestCase):
         application_mock.handle_event.assert_called_once_with(expected_arg)
 
 
+class TestReaders(util.TestCase):
+    def test_reader_error_is_raised_from_get_event(self):
+        stub_interface = unittest.mock.Mock()
+        stub_interface.get_event.side_effect = ValueError('bad message')
+        application = yak_server.__main__.Application()
+        application.input_interfaces = [stub_interface]
+        self.start_patch('yak_server.__main__._LOGGER')
+
+        application._start_readers()  # pylint: disable = protected-access
+
+        with self.assertRaises(yak_server.__main__.ReaderError):
+            application.get_event()
+
+    def test_inputs_are_synced_once_connected(self):
+        # pylint: disable = protected-access
+        stub_interface = unittest.mock.Mock()
+        stub_interface.name = 'switch'
+        stub_interface.sync_state.return_value = (
+            yak_server.events.ButtonDownEvent())
+        application = yak_server.__main__.Application()
+        application._inputs_by_name = {'switch': stub_interface}
+
+        application._device_state_changed(
+            'ac', yak_server.supervisor.DISCONNECTED,
+            yak_server.supervisor.CONNECTED)
+        application._device_state_changed(
+            'switch', yak_server.supervisor.CONNECTED,
+            yak_server.supervisor.DISCONNECTED)
+        application._device_state_changed(
+            'switch', yak_server.supervisor.RECONNECTING,
+            yak_server.supervisor.CONNECTED)
+
+        event = application.get_event(timeout=0)
+        self.assertIsInstance(event, yak_server.events.ButtonDownEvent)
+        self.assertEqual(event.device, 'switch')
+        self.assertIsNone(application.get_event(timeout=0))
+
+    def test_route_defaults_to_first_output(self):
+        application = yak_server.__main__.Application()
+        application.ac_interface = unittest.mock.Mock()
+
+        output_interface = application.route(yak_server.events.Event())
+
+        self.assertIs(output_interface, application.ac_interface)
+
+    def test_switches_without_outputs_drive_nothing(self):
+        fleet = yak_server.virtual.VirtualFleet(switch_count=2, ac_count=0)
+        application = yak_server.__main__.Application(device_backend=fleet)
+        application.setup()
+
+        application.handle_event(
+            yak_server.events.ButtonDownEvent(device='virtual-switch-0'))
+
+        self.assertEqual(application.output_interfaces, [])
+
+
+class TestStartup(util.TestCase):
+    def test_pyusb_is_not_imported_at_startup(self):
+        check = ('import sys, yak_server.__main__; '
+                 'print("usb.core" in sys.modules)')
+
+        output = subprocess.run([sys.executable, '-c', check], check=True,
+                                stdout=subprocess.PIPE).stdout
+
+        self.assertEqual(output.strip(), b'False')
+
+    def test_asyncio_and_entry_points_are_not_imported_at_startup(self):
+        check = ('import sys, yak_server.__main__; '
+                 'print("asyncio" in sys.modules, '
+                 '"importlib.metadata" in sys.modules)')
+
+        output = subprocess.run([sys.executable, '-c', check], check=True,
+                                stdout=subprocess.PIPE).stdout
+
+        self.assertEqual(output.strip(), b'False False')
+
+    def test_time_to_first_event_is_recorded(self):
+        application = yak_server.__main__.Application(
+            server_clock=yak_server.clock.VirtualClock())
+        application.ac_interface = unittest.mock.Mock()
+        application.clock.advance(2)
+        self.start_patch('yak_server.__main__._LOGGER')
+
+        application.handle_event(None)
+        self.assertIsNone(application.time_to_first_event)
+        application.handle_event(yak_server.events.Event())
+        application.clock.advance(1)
+        application.handle_event(yak_server.events.Event())
+
+        self.assertEqual(application.time_to_first_event, 2)
+
+
 class TestMainFunction(util.TestCase):
     def setUp(self):
         application_patch = self.start_patch('yak_server.__main__.Application')
@@ -65,3 +164,49 @@ class TestMainFunction(util.TestCase):
         yak_server.__main__.main()
 
         self.application_mock.assert_has_calls(expected_calls)
+
+    def test_gateway_option_serves_nodes_on_port(self):
+        yak_server.__main__.main(['--gateway', '5901'])
+
+        _, kwargs = yak_server.__main__.Application.call_args
+        self.assertEqual(kwargs['gateway'].port, 5901)
+
+    def test_gateway_option_is_rejected_with_shards(self):
+        self.start_patch('sys.stderr')
+
+        with self.assertRaises(SystemExit):
+            yak_server.__main__.main(['--shards', '2', '--gateway', '5901'])
+
+    def test_http_option_is_rejected_with_shards(self):
+        self.start_patch('sys.stderr')
+
+        with self.assertRaises(SystemExit):
+            yak_server.__main__.main(['--shards', '2', '--http', '8080'])
+
+    def test_rollups_option_is_rejected_with_shards(self):
+        self.start_patch('sys.stderr')
+
+        with self.assertRaises(SystemExit):
+            yak_server.__main__.main(['--shards', '2', '--rollups', 'path'])
+
+    def test_history_option_is_rejected_with_shards(self):
+        self.start_patch('sys.stderr')
+
+        with self.assertRaises(SystemExit):
+            yak_server.__main__.main(['--shards', '2', '--history', 'path'])
+
+    def test_bus_option_publishes_on_path(self):
+        yak_server.__main__.main(['--bus', '/run/yak_server/bus'])
+
+        _, kwargs = yak_server.__main__.Application.call_args
+        self.assertEqual(kwargs['event_bus'].path, '/run/yak_server/bus')
+
+    def test_state_table_option_publishes_in_shared_memory(self):
+        table_patch = self.start_patch('yak_server.statetable.StateTable')
+
+        yak_server.__main__.main(['--state-table'])
+
+        table_patch.mock.assert_called_once_with(
+            yak_server.statetable.default_path())
+        _, kwargs = yak_server.__main__.Application.call_args
+        self.assertIs(kwargs['state_table'], table_patch.mock.return_value)
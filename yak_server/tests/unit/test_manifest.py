@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import logging
+import os
+import tempfile
+import unittest.mock
+
+from tests import util
+
+from yak_server import manifest
+from yak_server import translators
+from yak_server import usbdevice
+
+
+AC_CLASS_ID = usbdevice.DeviceClassID(vendor_id=0x04d8, product_id=0x5901,
+                                      release_number=0x0002)
+
+
+class StubDevice:
+    def __init__(self, identifier, class_identifier=AC_CLASS_ID):
+        self.identifier = identifier
+        self.class_identifier = class_identifier
+
+
+class TestManifest(util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.manifest').setLevel(logging.ERROR)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache', 'manifest.json')
+
+    def test_missing_manifest_is_empty(self):
+        self.assertEqual(manifest.Manifest.load(self.path).entries, {})
+
+    def test_invalid_manifest_is_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as manifest_file:
+            manifest_file.write('{not json')
+
+        self.assertEqual(manifest.Manifest.load(self.path).entries, {})
+
+    def test_recorded_translator_survives_save_and_load(self):
+        device = StubDevice('1-1')
+        saved = manifest.Manifest(self.path)
+        saved.record(device, translators.ACInterfaceTranslatorV0_0_2)
+        saved.save()
+
+        loaded = manifest.Manifest.load(self.path)
+
+        self.assertIs(loaded.translator_class(device),
+                      translators.ACInterfaceTranslatorV0_0_2)
+
+    def test_entry_is_ignored_when_device_class_changed(self):
+        recorded = manifest.Manifest(self.path)
+        recorded.record(StubDevice('1-1'),
+                        translators.ACInterfaceTranslatorV0_0_2)
+        new_firmware = usbdevice.DeviceClassID(
+            vendor_id=0x04d8, product_id=0x5901, release_number=0x0003)
+
+        self.assertIsNone(recorded.translator_class(
+            StubDevice('1-1', new_firmware)))
+
+    def test_entry_is_ignored_when_translator_is_gone(self):
+        recorded = manifest.Manifest(self.path, {'1-1': {
+            'class_id': '04d8:5901:0002', 'translator': 'nowhere:Gone'}})
+
+        self.assertIsNone(recorded.translator_class(StubDevice('1-1')))
+
+    def test_check_adds_new_and_removes_gone_devices(self):
+        recorded = manifest.Manifest(self.path)
+        recorded.record(StubDevice('1-1'),
+                        translators.ACInterfaceTranslatorV0_0_2)
+        recorded.save()
+        loaded = manifest.Manifest.load(self.path)
+
+        added, removed = loaded.check([StubDevice('1-2')])
+
+        self.assertEqual((added, removed), (['1-2'], ['1-1']))
+        self.assertEqual(list(manifest.Manifest.load(self.path).entries),
+                         ['1-2'])
+
+    def test_check_does_not_save_unchanged_manifest(self):
+        loaded = manifest.Manifest.load(self.path)
+
+        self.assertEqual(loaded.check([]), ([], []))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_default_path_is_in_cache_directory(self):
+        with unittest.mock.patch.dict(os.environ, XDG_CACHE_HOME='/cache'):
+            self.assertEqual(manifest.default_path(),
+                             '/cache/yak_server/manifest.json')
@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, unused-argument
+
+import datetime
+import unittest.mock
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import events
+from yak_server import patterns
+
+
+START = datetime.datetime(2017, 5, 7)
+
+
+def down(seconds, device='a'):
+    return events.ButtonDownEvent(
+        device=device, timestamp=START + datetime.timedelta(seconds=seconds))
+
+
+def up(seconds, device='a'):
+    return events.ButtonUpEvent(
+        device=device, timestamp=START + datetime.timedelta(seconds=seconds))
+
+
+class TestPatternMatcher(util.TestCase):
+    def feed(self, matcher, event_list):
+        matches = []
+        for event in event_list:
+            matches.extend(matcher.feed(event))
+        return matches
+
+    def test_double_press(self):
+        matcher = patterns.PatternMatcher([patterns.double_press('double')])
+
+        matches = self.feed(matcher, [down(0), up(0.1), down(0.2)])
+
+        self.assertEqual(len(matches), 1)
+        self.assertEqual(matches[0].pattern, 'double')
+        self.assertEqual(matches[0].device, 'a')
+        self.assertEqual(matches[0].timestamp, down(0.2).timestamp)
+
+    def test_double_press_too_slow(self):
+        matcher = patterns.PatternMatcher([patterns.double_press('double')])
+
+        matches = self.feed(matcher, [down(0), up(0.1), down(1)])
+
+        self.assertEqual(matches, [])
+
+    def test_double_press_on_different_devices_does_not_match(self):
+        matcher = patterns.PatternMatcher([patterns.double_press('double')])
+
+        matches = self.feed(matcher, [down(0, 'a'), up(0.1, 'a'),
+                                      down(0.2, 'b')])
+
+        self.assertEqual(matches, [])
+
+    def test_long_press(self):
+        matcher = patterns.PatternMatcher([patterns.long_press('long')])
+
+        short = self.feed(matcher, [down(0), up(0.5)])
+        long = self.feed(matcher, [down(1), up(3)])
+
+        self.assertEqual(short, [])
+        self.assertEqual([match.pattern for match in long], ['long'])
+
+    def test_combination(self):
+        matcher = patterns.PatternMatcher(
+            [patterns.combination('both', ['a', 'b'])])
+
+        matches = self.feed(matcher, [down(0, 'a'), down(0.1, 'b')])
+
+        self.assertEqual([match.pattern for match in matches], ['both'])
+
+    def test_combination_in_wrong_order(self):
+        matcher = patterns.PatternMatcher(
+            [patterns.combination('both', ['a', 'b'])])
+
+        matches = self.feed(matcher, [down(0, 'b'), down(0.1, 'a')])
+
+        self.assertEqual(matches, [])
+
+    def test_expired_partial_matches_are_dropped(self):
+        matcher = patterns.PatternMatcher([patterns.double_press('double')])
+        self.feed(matcher, [down(0, device) for device in 'abcdef'])
+
+        self.feed(matcher, [up(10, 'z')])
+
+        self.assertEqual(matcher.active_matches(), 0)
+
+    def test_partial_matches_do_not_grow_with_repeats(self):
+        matcher = patterns.PatternMatcher([patterns.long_press('long')])
+
+        self.feed(matcher, [down(seconds) for seconds in range(100)])
+
+        self.assertEqual(matcher.active_matches(), 1)
+
+    def test_many_patterns_only_track_relevant_matches(self):
+        matcher = patterns.PatternMatcher(
+            [patterns.double_press(str(i), device=str(i))
+             for i in range(500)])
+
+        self.feed(matcher, [down(0, '7')])
+
+        self.assertEqual(matcher.active_matches(), 1)
+
+    def test_pattern_without_steps_is_rejected(self):
+        with self.assertRaises(ValueError):
+            patterns.Pattern('empty', [])
+
+
+class TestApplicationPatterns(util.TestCase):
+    def test_pattern_event_goes_to_handler(self):
+        application = yak_server.__main__.Application()
+        application.ac_interface = unittest.mock.Mock()
+        handler = unittest.mock.Mock()
+        application.add_pattern(patterns.double_press('double'), handler)
+
+        for event in [down(0), up(0.1), down(0.2)]:
+            application.handle_event(event)
+
+        handler.assert_called_once()
+        self.assertEqual(handler.call_args[0][0].pattern, 'double')
+        self.assertEqual(application.ac_interface.send_command.call_count, 3)
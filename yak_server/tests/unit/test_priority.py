@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, protected-access
+
+import threading
+import time
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import events
+from yak_server import interface
+from yak_server import priority
+from yak_server import virtual
+
+
+class RecordingOutput(interface.Interface):
+    name = 'ac'
+
+    def __init__(self):
+        self.writes = []
+
+    def send_command(self, command):
+        self.writes.append([command])
+
+    def send_commands(self, commands):
+        self.writes.append(list(commands))
+
+
+class TestPriorityGate(util.TestCase):
+    def setUp(self):
+        self.gate = priority.PriorityGate(starvation_limit=2)
+        self.order = []
+        self.threads = []
+
+    def start_writer(self, name, writer_priority):
+        waiting = self.gate._waiting[writer_priority]
+
+        def write():
+            with self.gate.hold(writer_priority):
+                self.order.append(name)
+
+        thread = threading.Thread(target=write, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        while self.gate._waiting[writer_priority] == waiting:
+            time.sleep(0.001)
+
+    def release_and_join(self, hold):
+        hold.__exit__(None, None, None)
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def test_interactive_goes_before_waiting_background(self):
+        hold = self.gate.hold(priority.BACKGROUND)
+        hold.__enter__()
+        self.start_writer('background', priority.BACKGROUND)
+        self.start_writer('interactive', priority.INTERACTIVE)
+
+        self.release_and_join(hold)
+
+        self.assertEqual(self.order, ['interactive', 'background'])
+
+    def test_background_is_not_starved(self):
+        hold = self.gate.hold(priority.INTERACTIVE)
+        hold.__enter__()
+        self.start_writer('background', priority.BACKGROUND)
+        for _ in range(4):
+            self.start_writer('interactive', priority.INTERACTIVE)
+
+        self.release_and_join(hold)
+
+        self.assertEqual(self.order.index('background'), 2)
+
+    def test_wait_times_are_kept_per_priority(self):
+        with self.gate.hold(priority.INTERACTIVE):
+            pass
+
+        self.assertEqual(len(self.gate.wait_times(priority.INTERACTIVE)), 1)
+        self.assertEqual(self.gate.wait_times(priority.BACKGROUND), [])
+        self.assertEqual(self.gate.percentile(priority.BACKGROUND, 0.99), 0.0)
+
+
+class TestPrioritizedInterface(util.TestCase):
+    def test_commands_are_written_in_chunks(self):
+        output = RecordingOutput()
+        background = priority.PrioritizedInterface(
+            output, priority.PriorityGate(), priority.BACKGROUND,
+            chunk_size=2)
+
+        background.send_commands([1, 2, 3, 4, 5])
+
+        self.assertEqual(output.writes, [[1, 2], [3, 4], [5]])
+
+    def test_views_share_a_gate(self):
+        interactive, background = priority.prioritized(RecordingOutput())
+
+        self.assertIs(interactive.gate, background.gate)
+        self.assertEqual(interactive.name, 'ac')
+
+
+class TestApplicationPriorities(util.TestCase):
+    def test_scheduled_commands_are_background_work(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        application = yak_server.__main__.Application(device_backend=fleet)
+        application.setup()
+        lamp = fleet.ac_devices[0]
+
+        application.send_command(events.LampOnEvent(device=lamp.identifier))
+        application.send_background_command(
+            events.LampOffEvent(device=lamp.identifier))
+
+        self.assertFalse(lamp.lamp_on)
+        self.assertEqual(
+            len(application.output_wait_times(priority.INTERACTIVE)), 1)
+        self.assertEqual(
+            len(application.output_wait_times(priority.BACKGROUND)), 1)
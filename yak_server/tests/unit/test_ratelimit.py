@@ -0,0 +1,145 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import unittest.mock
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import clock
+from yak_server import events
+from yak_server import interface
+from yak_server import ratelimit
+
+
+class RecordingOutput(interface.Interface):
+    name = 'ac'
+
+    def __init__(self):
+        self.writes = []
+
+    def send_command(self, command):
+        self.writes.append([command])
+
+    def send_commands(self, commands):
+        self.writes.append(list(commands))
+
+
+def on():
+    return events.LampOnEvent(device='ac')
+
+
+def off():
+    return events.LampOffEvent(device='ac')
+
+
+class TestTokenBucket(util.TestCase):
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+        self.bucket = ratelimit.TokenBucket(rate=2, burst=2,
+                                            bucket_clock=self.clock)
+
+    def test_allows_a_burst(self):
+        self.assertTrue(self.bucket.try_take())
+        self.assertTrue(self.bucket.try_take())
+        self.assertFalse(self.bucket.try_take())
+
+    def test_tokens_come_back_at_rate(self):
+        self.bucket.try_take()
+        self.bucket.try_take()
+
+        self.assertAlmostEqual(self.bucket.time_until_available(), 0.5)
+        self.clock.advance(self.bucket.time_until_available())
+        self.assertTrue(self.bucket.try_take())
+
+    def test_tokens_do_not_exceed_burst(self):
+        self.clock.advance(100)
+
+        self.assertTrue(self.bucket.try_take())
+        self.assertTrue(self.bucket.try_take())
+        self.assertFalse(self.bucket.try_take())
+
+
+class TestRateLimiter(util.TestCase):
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+        self.limiter = ratelimit.RateLimiter(rate=1, burst=1,
+                                             limiter_clock=self.clock)
+        self.output = RecordingOutput()
+        self.limited = self.limiter.wrap(self.output)
+
+    def stats(self):
+        return self.limiter.stats()[('ac', 0)]
+
+    def test_sends_while_tokens_are_left(self):
+        command = on()
+
+        self.limited.send_command(command)
+
+        self.assertEqual(self.output.writes, [[command]])
+        self.assertIsNone(self.limiter.timeout())
+
+    def test_throttled_commands_are_replaced_by_the_newest(self):
+        first, second, third = on(), off(), on()
+        self.limited.send_command(first)
+        self.limited.send_command(second)
+        self.limited.send_command(off())
+
+        self.assertAlmostEqual(self.limiter.timeout(), 1.0)
+        self.limited.send_command(third)
+        self.clock.advance(1.0)
+        self.limiter.flush()
+
+        self.assertEqual(self.output.writes, [[first]])
+        self.assertEqual(self.stats(), ratelimit.ChannelStats(
+            sent=1, coalesced=2, dropped=1))
+
+    def test_pending_state_is_sent_when_a_token_comes_back(self):
+        first, second = on(), off()
+        self.limited.send_command(first)
+        self.limited.send_command(second)
+
+        self.clock.advance(self.limiter.timeout())
+        self.limiter.flush()
+
+        self.assertEqual(self.output.writes, [[first], [second]])
+        self.assertIsNone(self.limiter.timeout())
+
+    def test_batches_keep_the_newest_command_per_channel(self):
+        last = off()
+
+        self.limited.send_commands([on(), off(), on(), last])
+
+        self.assertEqual(self.output.writes, [[last]])
+        self.assertEqual(self.stats().coalesced, 3)
+
+    def test_channels_have_their_own_bucket(self):
+        limiter = ratelimit.RateLimiter(
+            rate=1, burst=1, limiter_clock=self.clock,
+            channel_of=lambda command: command.channel)
+        commands = [unittest.mock.Mock(channel=channel)
+                    for channel in range(3)]
+
+        limiter.wrap(self.output).send_commands(commands)
+
+        self.assertEqual(self.output.writes, [commands])
+
+
+class TestApplicationRateLimit(util.TestCase):
+    def test_main_loop_sends_throttled_commands(self):
+        # pylint: disable = protected-access
+        server_clock = clock.VirtualClock()
+        application = yak_server.__main__.Application(
+            server_clock=server_clock)
+        application.rate_limiter = ratelimit.RateLimiter(
+            rate=1, burst=1, limiter_clock=server_clock)
+        output = RecordingOutput()
+        application._outputs = {'ac': application.rate_limiter.wrap(output)}
+        application.send_command(on())
+        application.send_command(off())
+
+        application.main_loop_iteration()
+
+        self.assertEqual(len(output.writes), 2)
+        self.assertAlmostEqual(server_clock.monotonic(), 1.0)
@@ -0,0 +1,186 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import datetime
+import os
+import tempfile
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import bus
+from yak_server import clock
+from yak_server import events
+from yak_server import rollups
+from yak_server import virtual
+
+
+START = 1700000000 - 1700000000 % rollups.DAY
+
+
+def at(seconds, event_type, device):
+    """Return an event 'seconds' after START."""
+    return event_type(device=device, timestamp=datetime.datetime.fromtimestamp(
+        START + seconds))
+
+
+class TestSlidingCounter(util.TestCase):
+    def test_old_counts_slide_out(self):
+        counter = rollups.SlidingCounter(span=10, bucket_count=10)
+        counter.add(100)
+        counter.add(105, count=2)
+
+        self.assertEqual(counter.total(105), 3)
+        self.assertEqual(counter.total(110.5), 2)
+        self.assertEqual(counter.total(200), 0)
+
+
+class TestRollups(util.TestCase):
+    def setUp(self):
+        self.rollups = rollups.Rollups(durations=[rollups.HOUR])
+
+    def test_presses_and_peak_rate(self):
+        for seconds, device in [(1, 'a'), (2, 'a'), (2.5, 'b'), (2.9, 'a')]:
+            self.rollups.record(bus.EVENT, at(seconds, events.ButtonDownEvent,
+                                              device))
+        self.rollups.record(bus.EVENT, at(3, events.ButtonUpEvent, 'a'))
+        self.assertEqual(self.rollups.query(rollups.HOUR), [])
+
+        self.rollups.record(bus.EVENT, at(3600, events.ButtonDownEvent, 'b'))
+
+        rollup, = self.rollups.query(rollups.HOUR)
+        self.assertEqual(rollup.start, datetime.datetime.fromtimestamp(START))
+        self.assertEqual(rollup.presses, {'a': 3, 'b': 1})
+        self.assertEqual(rollup.event_count, 5)
+        self.assertEqual(rollup.peak_rate, 3)
+        self.assertEqual(self.rollups.current(rollups.HOUR).presses,
+                         {'b': 1})
+
+    def test_lamp_on_time_is_split_over_windows(self):
+        self.rollups.record(bus.COMMAND, at(3000, events.LampOnEvent, 'ac'))
+        self.rollups.record(bus.COMMAND, at(3100, events.LampOnEvent, 'ac'))
+        self.rollups.record(bus.COMMAND, at(4000, events.LampOffEvent, 'ac'))
+        self.rollups.record(bus.COMMAND, at(7300, events.LampOnEvent, 'ac'))
+
+        first, second = self.rollups.query(rollups.HOUR)
+        self.assertEqual(first.on_time, {('ac', 0): 600})
+        self.assertEqual(second.on_time, {('ac', 0): 400})
+        self.assertEqual(self.rollups.current(rollups.HOUR).on_time, {})
+        self.rollups.record(bus.EVENT, at(7360, events.ButtonUpEvent, 's'))
+        self.assertEqual(self.rollups.current(rollups.HOUR).on_time,
+                         {('ac', 0): 60})
+
+    def test_windows_without_events_are_closed(self):
+        self.rollups.record(bus.COMMAND, at(37800, events.LampOnEvent, 'ac'))
+        self.rollups.record(bus.COMMAND,
+                            at(47700, events.LampOffEvent, 'ac'))
+
+        self.assertEqual(
+            [(rollup.start.timestamp() - START, rollup.on_time)
+             for rollup in self.rollups.query(rollups.HOUR)],
+            [(hour * rollups.HOUR, {('ac', 0): seconds}) for hour, seconds
+             in ((10, 1800), (11, 3600), (12, 3600))])
+        self.assertEqual(self.rollups.current(rollups.HOUR).on_time,
+                         {('ac', 0): 900})
+
+    def test_windows_close_without_events(self):
+        now = datetime.datetime.fromtimestamp(START + 3000)
+        self.assertIsNone(self.rollups.timeout(now))
+        self.rollups.record(bus.COMMAND, at(600, events.LampOnEvent, 'ac'))
+
+        self.assertEqual(self.rollups.timeout(now), 600)
+        self.rollups.close_due(now)
+        self.assertEqual(self.rollups.query(rollups.HOUR), [])
+        self.rollups.close_due(now + datetime.timedelta(seconds=600))
+        rollup, = self.rollups.query(rollups.HOUR)
+        self.assertEqual(rollup.on_time, {('ac', 0): 3000})
+
+    def test_query_since(self):
+        for hour in range(3):
+            self.rollups.record(bus.EVENT, at(hour * 3600,
+                                              events.ButtonDownEvent, 'a'))
+
+        rollup, = self.rollups.query(
+            rollups.HOUR, since=datetime.datetime.fromtimestamp(START + 1))
+        self.assertEqual(rollup.start,
+                         datetime.datetime.fromtimestamp(START + 3600))
+
+    def test_event_rate(self):
+        for index in range(30):
+            self.rollups.record(bus.EVENT, at(index, events.ButtonDownEvent,
+                                              'a'))
+
+        self.assertEqual(self.rollups.event_rate(), 0.5)
+
+
+class TestRollupStore(util.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rollups')
+
+    def test_closed_rollups_are_stored_and_loaded(self):
+        store = rollups.RollupStore(self.path)
+        aggregated = rollups.Rollups(durations=[rollups.HOUR], store=store)
+        aggregated.record(bus.COMMAND, at(0, events.LampOnEvent, 'ac'))
+        aggregated.record(bus.EVENT, at(10, events.ButtonDownEvent, 'hall'))
+        aggregated.record(bus.EVENT, at(3600, events.ButtonDownEvent, 'hall'))
+
+        loaded = rollups.Rollups(durations=[rollups.HOUR], store=store)
+
+        self.assertEqual(loaded.query(rollups.HOUR),
+                         aggregated.query(rollups.HOUR))
+        rollup, = loaded.query(rollups.HOUR)
+        self.assertEqual(rollup.presses, {'hall': 1})
+        self.assertEqual(rollup.on_time, {('ac', 0): 3600})
+        self.assertLess(os.path.getsize(self.path), 64)
+
+    def test_long_names_are_cut_off(self):
+        rollup = rollups.Rollup(
+            start=datetime.datetime.fromtimestamp(START), duration=60,
+            event_count=0, peak_rate=0, presses={'a' * 300: 1},
+            on_time={('\u00e9' * 200, 0): 1.0})
+
+        decoded = rollups.decode_rollup(
+            rollups.encode_rollup(rollup)[rollups.RECORD_LENGTH.size:])
+
+        self.assertEqual(decoded.presses, {'a' * 255: 1})
+        self.assertEqual(decoded.on_time, {('\u00e9' * 127, 0): 1.0})
+
+    def test_missing_file_has_no_rollups(self):
+        self.assertEqual(rollups.RollupStore(self.path).load(), [])
+
+
+class TestApplicationRollups(util.TestCase):
+    def test_handled_events_are_aggregated(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        aggregated = rollups.Rollups()
+        application = yak_server.__main__.Application(
+            device_backend=fleet, rollups=aggregated)
+        application.setup()
+        switch = fleet.switches[0].identifier
+
+        application.handle_event(events.ButtonDownEvent(device=switch))
+
+        self.assertEqual(aggregated.current(rollups.DAY).presses, {switch: 1})
+
+    def test_main_loop_closes_windows(self):
+        virtual_clock = clock.VirtualClock(
+            start=datetime.datetime.fromtimestamp(START))
+        previous_clock = clock.set_clock(virtual_clock)
+        self.addCleanup(clock.set_clock, previous_clock)
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        aggregated = rollups.Rollups(durations=[rollups.HOUR])
+        application = yak_server.__main__.Application(
+            device_backend=fleet, rollups=aggregated)
+        application.setup()
+        application.handle_event(events.ButtonDownEvent(
+            device=fleet.switches[0].identifier))
+
+        application.main_loop_iteration()
+
+        self.assertEqual(virtual_clock.monotonic(), rollups.HOUR)
+        rollup, = aggregated.query(rollups.HOUR)
+        self.assertEqual(rollup.on_time,
+                         {(fleet.ac_devices[0].identifier, 0): rollups.HOUR})
@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, unused-argument
+
+import threading
+import time
+import unittest.mock
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import events
+from yak_server import interface
+from yak_server import scenes
+
+
+class SlowOutput(interface.Interface):
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.commands = []
+        self.threads = set()
+
+    def send_command(self, command):
+        self.threads.add(threading.get_ident())
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.commands.append(command)
+
+
+class TestSceneRunner(util.TestCase):
+    def setUp(self):
+        self.runner = scenes.SceneRunner(timeout=1.0)
+        self.addCleanup(self.runner.close)
+
+    def test_commands_keep_their_order_per_device(self):
+        output = SlowOutput()
+        commands = [events.LampOnEvent(device='a'),
+                    events.LampOffEvent(device='a')]
+
+        results = self.runner.run(scenes.Scene('s', commands), {'a': output})
+
+        self.assertEqual(output.commands, commands)
+        self.assertTrue(results['a'].ok())
+        self.assertEqual(results['a'].submitted, 2)
+
+    def test_devices_are_written_in_parallel(self):
+        outputs = {str(i): SlowOutput(delay=0.1) for i in range(5)}
+        scene = scenes.Scene('s', [events.LampOnEvent(device=device)
+                                   for device in outputs])
+
+        start = time.perf_counter()
+        results = self.runner.run(scene, outputs)
+        duration = time.perf_counter() - start
+
+        self.assertLess(duration, 0.3)
+        self.assertTrue(all(result.ok() for result in results.values()))
+
+    def test_error_is_reported_per_device(self):
+        outputs = {'good': SlowOutput(), 'bad': SlowOutput(error=OSError())}
+        scene = scenes.Scene('s', [events.LampOnEvent(device='good'),
+                                   events.LampOnEvent(device='bad')])
+        self.start_patch('yak_server.scenes._LOGGER')
+
+        results = self.runner.run(scene, outputs)
+
+        self.assertTrue(results['good'].ok())
+        self.assertIsInstance(results['bad'].error, OSError)
+
+    def test_timeout_is_reported(self):
+        self.runner.timeout = 0.01
+        outputs = {'slow': SlowOutput(delay=0.2)}
+        self.start_patch('yak_server.scenes._LOGGER')
+
+        results = self.runner.run(
+            scenes.Scene('s', [events.LampOnEvent(device='slow')]), outputs)
+
+        self.assertTrue(results['slow'].timed_out)
+
+    def test_unknown_device_raises_before_sending(self):
+        output = SlowOutput()
+        scene = scenes.Scene('s', [events.LampOnEvent(device='a'),
+                                   events.LampOnEvent(device='missing')])
+
+        with self.assertRaises(ValueError):
+            self.runner.run(scene, {'a': output})
+        self.assertEqual(output.commands, [])
+
+    def test_one_worker_per_device(self):
+        output = SlowOutput()
+        scene = scenes.Scene('s', [events.LampOnEvent(device='a')])
+
+        self.runner.run(scene, {'a': output})
+        self.runner.run(scene, {'a': output})
+
+        self.assertEqual(len(output.threads), 1)
+
+
+class TestApplicationScenes(util.TestCase):
+    def test_run_scene_uses_background_outputs(self):
+        # pylint: disable = protected-access
+        application = yak_server.__main__.Application()
+        output = unittest.mock.Mock()
+        application._background_outputs = {'a': output}
+        command = events.LampOnEvent(device='a')
+
+        results = application.run_scene(scenes.Scene('s', [command]))
+
+        output.send_commands.assert_called_once_with([command])
+        self.assertTrue(results['a'].ok())
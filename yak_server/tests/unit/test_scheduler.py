@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, unused-argument
+
+import datetime
+import random
+import unittest.mock
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import clock
+from yak_server import events
+from yak_server import scheduler
+
+
+class TestTimerWheel(util.TestCase):
+    def setUp(self):
+        self.wheel = scheduler.TimerWheel()
+        self.fired = []
+
+    def add(self, deadline_tick):
+        timer = scheduler.Timer(deadline_tick, self.fired.append,
+                                (deadline_tick, ))
+        self.wheel.add(timer)
+        return timer
+
+    def fire_until(self, tick):
+        for timer in self.wheel.advance(tick):
+            timer.fire()
+
+    def test_fires_at_deadline(self):
+        self.add(5)
+
+        self.fire_until(4)
+        self.assertEqual(self.fired, [])
+        self.fire_until(5)
+        self.assertEqual(self.fired, [5])
+
+    def test_cancelled_timer_does_not_fire(self):
+        timer = self.add(5)
+
+        self.wheel.cancel(timer)
+        self.fire_until(10)
+
+        self.assertEqual(self.fired, [])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_overdue_timer_fires_on_next_tick(self):
+        self.fire_until(10)
+        self.add(3)
+
+        self.fire_until(11)
+
+        self.assertEqual(self.fired, [3])
+
+    def test_timers_on_higher_levels_fire_at_their_deadline(self):
+        deadlines = [255, 256, 257, 300, 65535, 65536, 70000, 1 << 24]
+        for deadline in deadlines:
+            self.add(deadline)
+
+        fire_ticks = {}
+        for deadline in deadlines:
+            self.fire_until(deadline)
+            fire_ticks[deadline] = list(self.fired)
+
+        for index, deadline in enumerate(deadlines):
+            self.assertEqual(fire_ticks[deadline], deadlines[:index + 1])
+
+    def test_many_random_timers(self):
+        rng = random.Random(0)
+        deadlines = [rng.randrange(1, 100000) for _ in range(5000)]
+        timers = [self.add(deadline) for deadline in deadlines]
+        for timer in timers[::2]:
+            self.wheel.cancel(timer)
+
+        self.fire_until(100000)
+
+        self.assertEqual(sorted(self.fired), sorted(deadlines[1::2]))
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_ticks_until_next(self):
+        self.assertIsNone(self.wheel.ticks_until_next())
+        self.add(7)
+
+        self.assertEqual(self.wheel.ticks_until_next(), 7)
+
+    def test_ticks_until_next_stops_at_wrap_for_later_levels(self):
+        self.add(1000)
+
+        self.assertEqual(self.wheel.ticks_until_next(), 256)
+
+
+class TestScheduler(util.TestCase):
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+        self.scheduler = scheduler.Scheduler(self.clock)
+        self.callback = unittest.mock.Mock()
+
+    def test_call_later(self):
+        self.scheduler.call_later(600, self.callback, 'off')
+
+        self.clock.advance(599.9)
+        self.scheduler.run_due()
+        self.callback.assert_not_called()
+        self.clock.advance(0.1)
+        self.scheduler.run_due()
+        self.callback.assert_called_once_with('off')
+
+    def test_call_at(self):
+        when = self.clock.now() + datetime.timedelta(hours=23)
+        self.scheduler.call_at(when, self.callback)
+
+        self.clock.advance(23 * 3600)
+        self.scheduler.run_due()
+
+        self.callback.assert_called_once_with()
+
+    def test_cancel(self):
+        timer = self.scheduler.call_later(1, self.callback)
+
+        self.scheduler.cancel(timer)
+        self.clock.advance(2)
+        self.scheduler.run_due()
+
+        self.callback.assert_not_called()
+
+    def test_timeout_reaches_the_deadline(self):
+        self.scheduler.call_later(600, self.callback)
+
+        while not self.callback.called:
+            self.clock.advance(self.scheduler.timeout())
+            self.scheduler.run_due()
+
+        self.assertAlmostEqual(self.clock.monotonic(), 600)
+
+    def test_timeout_is_none_without_timers(self):
+        self.assertIsNone(self.scheduler.timeout())
+
+
+class TestApplicationScheduling(util.TestCase):
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+        self.application = yak_server.__main__.Application(
+            server_clock=self.clock)
+        self.output = unittest.mock.Mock()
+        self.application.ac_interface = self.output
+
+    def test_scheduled_command_is_sent(self):
+        command = events.LampOffEvent()
+        self.application.schedule_command(600, command)
+
+        self.clock.advance(600)
+        self.application.scheduler.run_due()
+
+        self.output.send_command.assert_called_once_with(command)
+
+    def test_keyed_command_replaces_pending_one(self):
+        self.application.schedule_command(600, 'first', key='lamp')
+        self.application.schedule_command(600, 'second', key='lamp')
+
+        self.clock.advance(600)
+        with unittest.mock.patch.object(
+                self.application, 'send_background_command') as send_command:
+            self.application.scheduler.run_due()
+
+        send_command.assert_called_once_with('second')
@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, protected-access
+
+import multiprocessing
+import time
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import events
+from yak_server import sharding
+from yak_server import virtual
+
+
+def _push_records(name, count):
+    ring = sharding.ShmRing.attach(name)
+    for number in range(count):
+        while not ring.push(number.to_bytes(4, 'little')):
+            time.sleep(0.0001)
+    ring.close()
+
+
+class TestShmRing(util.TestCase):
+    def make_ring(self, **kwargs):
+        ring = sharding.ShmRing.create(**kwargs)
+        self.addCleanup(ring.close)
+        return ring
+
+    def test_records_come_out_in_order(self):
+        ring = self.make_ring(capacity=2, record_size=4)
+
+        popped = []
+        for data in (b'a', b'bc', b'def', b'ghij'):
+            self.assertTrue(ring.push(data))
+            popped.append(ring.pop())
+
+        self.assertEqual(popped, [b'a', b'bc', b'def', b'ghij'])
+        self.assertIsNone(ring.pop())
+
+    def test_full_ring_refuses_records(self):
+        ring = self.make_ring(capacity=2, record_size=4)
+
+        self.assertTrue(ring.push(b'1'))
+        self.assertTrue(ring.push(b'2'))
+        self.assertFalse(ring.push(b'3'))
+
+    def test_records_must_fit(self):
+        ring = self.make_ring(record_size=4)
+
+        with self.assertRaises(ValueError):
+            ring.push(b'12345')
+
+    def test_records_from_another_process(self):
+        ring = self.make_ring(capacity=16, record_size=4)
+        count = 1000
+        producer = multiprocessing.Process(target=_push_records,
+                                           args=(ring.name, count))
+        producer.start()
+
+        received = []
+        deadline = time.monotonic() + 10
+        while len(received) < count and time.monotonic() < deadline:
+            data = ring.pop()
+            if data is not None:
+                received.append(int.from_bytes(data, 'little'))
+        producer.join()
+
+        self.assertEqual(received, list(range(count)))
+
+
+class TestPlanShards(util.TestCase):
+    def test_devices_are_dealt_round_robin(self):
+        shards = sharding.plan_shards(['s0', 's1', 's2'], ['a0', 'a1'], 2)
+
+        self.assertEqual([shard.devices for shard in shards],
+                         [{'s0', 's2', 'a0'}, {'s1', 'a1'}])
+        self.assertEqual(shards[0].routes,
+                         {'s0': 'a0', 's1': 'a1', 's2': 'a0'})
+        self.assertEqual(shards[1].owners, {'a0': 0, 'a1': 1})
+
+    def test_inputs_without_outputs_drive_nothing(self):
+        shards = sharding.plan_shards(['s0', 's1'], [], 2)
+
+        self.assertEqual([shard.devices for shard in shards],
+                         [{'s0'}, {'s1'}])
+        self.assertEqual(shards[0].routes, {})
+
+
+class TestShardApplication(util.TestCase):
+    def test_switch_drives_lamp_of_other_shard(self):
+        fleet = virtual.VirtualFleet(switch_count=2, ac_count=1)
+        shards = sharding.plan_shards(
+            ['virtual-switch-0', 'virtual-switch-1'], ['virtual-ac-0'], 2)
+        ring_names = {}
+        for source, target in ((0, 1), (1, 0)):
+            ring = sharding.ShmRing.create()
+            self.addCleanup(ring.close)
+            ring_names[source, target] = ring.name
+        doorbells = [multiprocessing.Semaphore(0) for _ in shards]
+        applications = []
+        for shard in shards:
+            sharding.attach_rings(shard, ring_names, doorbells)
+            application = sharding.ShardApplication(
+                shard, device_backend=sharding._ShardBackend(
+                    fleet, shard.devices))
+            application.setup()
+            applications.append(application)
+
+        applications[1].handle_event(
+            events.ButtonDownEvent(device='virtual-switch-1'))
+        applications[0].handle_event(applications[0].get_event(timeout=5))
+        applications[0].rate_limiter.flush()
+
+        self.assertTrue(fleet.ac_devices[0].lamp_on)
+        self.assertIsNone(applications[1].ac_interface)
+
+
+class TestMain(util.TestCase):
+    def test_shards_option_runs_sharded(self):
+        run_sharded = self.start_patch(
+            'yak_server.sharding.run_sharded').mock
+
+        yak_server.__main__.main(['--shards', '3'])
+
+        run_sharded.assert_called_once_with(3)
@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import events
+from yak_server import statereader
+from yak_server import statetable
+from yak_server import virtual
+
+
+class StateTableTestCase(util.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'state')
+
+    def make_table(self, **kwargs):
+        table = statetable.StateTable(self.path, **kwargs)
+        self.addCleanup(table.close)
+        return table
+
+    def make_reader(self):
+        reader = statereader.StateReader(self.path)
+        self.addCleanup(reader.close)
+        return reader
+
+
+class TestStateTable(StateTableTestCase):
+    def test_reader_sees_latest_state(self):
+        table = self.make_table()
+        reader = self.make_reader()
+        press = events.ButtonDownEvent(device='1-2')
+
+        table.update(statetable.SWITCH, press)
+        pressed = reader.read('1-2')
+        table.update(statetable.SWITCH, events.ButtonUpEvent(device='1-2'))
+
+        self.assertEqual(pressed, statereader.DeviceState(
+            device='1-2', channel=0, kind=statetable.SWITCH, on=True,
+            changed=press.timestamp))
+        self.assertFalse(reader.read('1-2').on)
+
+    def test_unknown_devices_read_as_none(self):
+        self.make_table()
+
+        self.assertIsNone(self.make_reader().read('1-2'))
+
+    def test_read_all(self):
+        table = self.make_table()
+        table.update(statetable.SWITCH, events.ButtonDownEvent(device='a'))
+        table.update(statetable.LAMP, events.LampOffEvent(device='b'))
+        table.update(statetable.SWITCH, events.PatternEvent(pattern='p'))
+
+        states = self.make_reader().read_all()
+
+        self.assertEqual([(state.device, state.kind, state.on)
+                          for state in states],
+                         [('a', statetable.SWITCH, True),
+                          ('b', statetable.LAMP, False)])
+
+    def test_full_table_skips_new_devices(self):
+        logging.getLogger('yak_server.statetable').setLevel(logging.ERROR)
+        table = self.make_table(slot_count=1)
+
+        table.update(statetable.LAMP, events.LampOnEvent(device='a'))
+        table.update(statetable.LAMP, events.LampOnEvent(device='b'))
+
+        self.assertEqual(len(self.make_reader().read_all()), 1)
+
+    def test_reads_are_consistent_while_writing(self):
+        table = self.make_table()
+        reader = self.make_reader()
+        table.update(statetable.LAMP, events.LampOnEvent(device='a'))
+        done = threading.Event()
+
+        def write():
+            on = True
+            while not done.is_set():
+                on = not on
+                event_type = events.LampOnEvent if on else events.LampOffEvent
+                table.update(statetable.LAMP, event_type(device='a'))
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            states = [reader.read('a') for _ in range(2000)]
+        finally:
+            done.set()
+            thread.join()
+
+        self.assertEqual({state.device for state in states}, {'a'})
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as other_file:
+            other_file.write(b'\0' * 64)
+
+        with self.assertRaises(statereader.TableError):
+            statereader.StateReader(self.path)
+
+
+class TestOtherProcess(StateTableTestCase):
+    def test_other_process_reads_the_state(self):
+        table = self.make_table()
+        table.update(statetable.LAMP, events.LampOnEvent(device='1-3'))
+        script = ('from yak_server import statereader; '
+                  'print(statereader.StateReader({!r}).read("1-3").on)'
+                  .format(self.path))
+
+        output = subprocess.run([sys.executable, '-c', script], check=True,
+                                stdout=subprocess.PIPE).stdout
+
+        self.assertEqual(output.strip(), b'True')
+
+
+class TestApplicationStateTable(StateTableTestCase):
+    def test_handled_events_and_commands_update_the_table(self):
+        fleet = virtual.VirtualFleet(switch_count=1, ac_count=1)
+        application = yak_server.__main__.Application(
+            device_backend=fleet, state_table=self.make_table())
+        application.setup()
+        switch = fleet.switches[0].identifier
+        lamp = fleet.ac_devices[0].identifier
+
+        application.handle_event(events.ButtonDownEvent(device=switch))
+        reader = self.make_reader()
+
+        self.assertTrue(reader.read(switch).on)
+        self.assertEqual(reader.read(lamp).kind, statetable.LAMP)
+        self.assertTrue(reader.read(lamp).on)
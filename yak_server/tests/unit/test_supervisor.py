@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, protected-access
+
+import logging
+import queue
+import random
+import threading
+import unittest.mock
+
+from tests import util
+
+from yak_server import clock
+from yak_server import supervisor
+from yak_server import usbdevice
+
+
+class FlakyDevice:
+    identifier = '1-1'
+    max_packet_size = 16
+
+    def __init__(self, failed_connects=0):
+        self.failed_connects = failed_connects
+        self.gone = False
+        self.written = []
+        self.reads = queue.Queue()
+
+    def connect(self):
+        if self.failed_connects:
+            self.failed_connects -= 1
+            raise usbdevice.USBError('not there')
+        self.gone = False
+
+    def read(self, number_of_bytes):
+        data = self.reads.get(timeout=5)
+        if self.gone:
+            raise usbdevice.DeviceDisconnected('gone')
+        return data[:number_of_bytes]
+
+    def write(self, data):
+        if self.gone:
+            raise usbdevice.DeviceDisconnected('gone')
+        self.written.append(data)
+        return len(data)
+
+
+class TestSupervisedDevice(util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.supervisor').setLevel(100)
+        self.clock = clock.VirtualClock()
+        self.transitions = []
+        self.reconnected = threading.Event()
+
+    def listener(self, identifier, old_state, new_state):
+        self.transitions.append((identifier, old_state, new_state))
+        if old_state == supervisor.RECONNECTING:
+            self.reconnected.set()
+
+    def make_device(self, device, rediscover=None):
+        supervised = supervisor.SupervisedDevice(
+            device, rediscover=rediscover, listener=self.listener,
+            jitter=0, supervisor_clock=self.clock, rng=random.Random(0))
+        supervised.connect()
+        return supervised
+
+    def test_lost_device_is_reconnected_and_state_replayed(self):
+        device = FlakyDevice()
+        supervised = self.make_device(device)
+        supervised.write(b'\x01')
+        device.gone = True
+
+        self.assertEqual(supervised.write(b'\x00'), 0)
+        self.assertTrue(self.reconnected.wait(timeout=5))
+
+        self.assertEqual(device.written, [b'\x01', b'\x00'])
+        self.assertEqual([new for _, _, new in self.transitions], [
+            supervisor.CONNECTED, supervisor.DISCONNECTED,
+            supervisor.RECONNECTING, supervisor.CONNECTED])
+
+    def test_reconnect_backs_off_exponentially(self):
+        device = FlakyDevice()
+        supervised = self.make_device(device)
+        device.gone = True
+        device.failed_connects = 3
+
+        supervised.write(b'\x01')
+        self.assertTrue(self.reconnected.wait(timeout=5))
+
+        self.assertAlmostEqual(self.clock.monotonic(), 0.1 + 0.2 + 0.4 + 0.8)
+
+    def test_jitter_spreads_the_delay(self):
+        supervised = supervisor.SupervisedDevice(FlakyDevice(), jitter=0.5,
+                                                 rng=random.Random(1))
+
+        delays = {supervised._with_jitter(1.0) for _ in range(10)}
+
+        self.assertTrue(all(0.5 <= delay <= 1.5 for delay in delays))
+        self.assertGreater(len(delays), 1)
+
+    def test_reconnect_uses_rediscovered_device(self):
+        device = FlakyDevice()
+        new_device = FlakyDevice()
+        supervised = self.make_device(device, rediscover=lambda: new_device)
+        device.gone = True
+
+        supervised.write(b'\x01')
+        self.assertTrue(self.reconnected.wait(timeout=5))
+        supervised.write(b'\x00')
+
+        self.assertEqual(new_device.written, [b'\x01', b'\x00'])
+
+    def test_read_waits_for_reconnect(self):
+        device = FlakyDevice()
+        supervised = self.make_device(device)
+        device.gone = True
+        device.reads.put(b'x')
+        device.reads.put(b'y')
+
+        self.assertEqual(supervised.read(1), b'y')
+        self.assertTrue(self.reconnected.is_set())
+
+    def test_failed_write_is_kept_for_the_reconnect(self):
+        device = FlakyDevice()
+        supervised = self.make_device(device)
+        device.write = unittest.mock.Mock(
+            side_effect=usbdevice.USBError('timeout'))
+
+        self.assertEqual(supervised.write(b'\x01'), 0)
+        self.assertEqual(supervised._last_written, b'\x01')
+        self.assertEqual(supervised.state, supervisor.CONNECTED)
+
+    def test_only_a_lost_device_is_a_warning(self):
+        device = FlakyDevice()
+
+        with self.assertLogs('yak_server.supervisor') as logs:
+            supervised = self.make_device(device)
+            device.gone = True
+            supervised.write(b'\x01')
+            self.assertTrue(self.reconnected.wait(timeout=5))
+
+        self.assertEqual([record.levelname for record in logs.records],
+                         ['INFO', 'WARNING', 'INFO', 'INFO'])
+
+    def test_read_of_disconnected_device_times_out(self):
+        supervised = supervisor.SupervisedDevice(FlakyDevice())
+
+        self.assertEqual(supervised.read(1, timeout=0.01), b'')
+        self.assertEqual(supervised.state, supervisor.DISCONNECTED)
+
+    def test_failed_first_connect_is_retried_later(self):
+        device = FlakyDevice(failed_connects=2)
+        supervised = supervisor.SupervisedDevice(
+            device, listener=self.listener, jitter=0,
+            supervisor_clock=self.clock)
+        with self.assertRaises(usbdevice.USBError):
+            supervised.connect()
+
+        supervised.connect_later()
+
+        self.assertTrue(self.reconnected.wait(timeout=5))
+        self.assertEqual(supervised.state, supervisor.CONNECTED)
+
+    def test_max_packet_size_is_known_while_disconnected(self):
+        device = FlakyDevice()
+        supervised = supervisor.SupervisedDevice(device)
+
+        self.assertEqual(supervised.max_packet_size,
+                         supervisor.SupervisedDevice.DEFAULT_MAX_PACKET_SIZE)
+        supervised.connect()
+        device.max_packet_size = 64
+
+        self.assertEqual(supervised.max_packet_size, 16)
+
+    def test_connect_replays_writes_made_before(self):
+        device = FlakyDevice()
+        supervised = supervisor.SupervisedDevice(device)
+
+        self.assertEqual(supervised.write(b'\x01'), 0)
+        supervised.connect()
+
+        self.assertEqual(device.written, [b'\x01'])
@@ -2,10 +2,13 @@
 
 # pylint: disable = no-self-use, unused-argument
 
+import unittest.mock
+
 from tests import util
 
 import yak_server.translators
 import yak_server.events
+import yak_server.usbdevice
 
 
 class TestLookupTranslator(util.TestCase):
@@ -49,3 +52,87 @@ class TestLookupTranslator(util.TestCase):
         maximum_data_length = self.translator.maximum_data_length()
 
         self.assertEqual(maximum_data_length, 1)
+
+    def test_events_to_raw_packets_sends_one_event_per_packet(self):
+        event_list = [yak_server.events.ButtonUpEvent(),
+                      yak_server.events.ButtonDownEvent()]
+
+        packets = self.translator.events_to_raw_packets(event_list, 8)
+
+        self.assertEqual(packets, [b'a', b'b'])
+
+
+class TestBatchLookupTranslator(util.TestCase):
+    class BatchTranslator(yak_server.translators.LookupTranslator):
+        DEVICE_CLASS_ID = None
+        BATCH_MARKER = b'*'
+        TRANSLATION_TABLE = yak_server.translators.LookupTable({
+            b'a': yak_server.events.LampOffEvent,
+            b'b': yak_server.events.LampOnEvent})
+
+    def setUp(self):
+        self.translator = self.BatchTranslator()
+
+    def test_single_event_is_sent_without_marker(self):
+        packets = self.translator.events_to_raw_packets(
+            [yak_server.events.LampOnEvent()], 8)
+
+        self.assertEqual(packets, [b'b'])
+
+    def test_packs_events_behind_marker(self):
+        event_list = [yak_server.events.LampOnEvent(),
+                      yak_server.events.LampOffEvent(),
+                      yak_server.events.LampOnEvent()]
+
+        packets = self.translator.events_to_raw_packets(event_list, 8)
+
+        self.assertEqual(packets, [b'*bab'])
+
+    def test_splits_batches_at_max_packet_size(self):
+        event_list = [yak_server.events.LampOnEvent()] * 5
+
+        packets = self.translator.events_to_raw_packets(event_list, 3)
+
+        self.assertEqual(packets, [b'*bb', b'*bb', b'*b'])
+
+    def test_batch_translator_for_230v_interface_firmware(self):
+        device = yak_server.usbdevice.DeviceClassID(
+            vendor_id=0x04d8, product_id=0x5901, release_number=0x0002)
+        factory = yak_server.translators.TranslatorFactory()
+
+        translator_class = factory.usb_translator_class(device)
+
+        self.assertEqual(translator_class.BATCH_MARKER, b'\xba')
+
+
+class TestTranslatorPlugins(util.TestCase):
+    DEVICE_CLASS_ID = yak_server.usbdevice.DeviceClassID(
+        vendor_id=0x1234, product_id=0x0001, release_number=0x0003)
+
+    def test_plugin_is_loaded_from_entry_point(self):
+        entry_point = unittest.mock.Mock()
+        concrete_class = TestLookupTranslator.ConcreteLookupTranslator
+        entry_point.load.return_value = concrete_class
+        entry_points = self.start_patch('importlib.metadata.entry_points',
+                                        return_value=[entry_point]).mock
+        factory = yak_server.translators.TranslatorFactory()
+
+        translator_class = factory.usb_translator_class(self.DEVICE_CLASS_ID)
+
+        entry_points.assert_called_once_with(group='yak_server.translators',
+                                             name='1234:0001:0003')
+        self.assertIs(translator_class, concrete_class)
+
+    def test_unknown_device_class_raises_key_error(self):
+        self.start_patch('importlib.metadata.entry_points', return_value=[])
+        factory = yak_server.translators.TranslatorFactory()
+
+        with self.assertRaises(KeyError):
+            factory.usb_translator_class(self.DEVICE_CLASS_ID)
+
+    def test_translator_path_round_trip(self):
+        translator_class = yak_server.translators.ACInterfaceTranslatorV0_0_2
+        path = yak_server.translators.translator_path(translator_class)
+
+        self.assertIs(yak_server.translators.load_translator_class(path),
+                      translator_class)
@@ -2,14 +2,20 @@
 
 # pylint: disable = no-self-use, unused-argument
 
+import array
+import errno
 import logging
+import threading
 import unittest
 import unittest.mock
 import usb
 
 import tests.util
+from tests.doubles import fake_switch_device
 from tests.doubles import fake_usb
+from tests.doubles import simulated_usb
 
+from yak_server import clock
 from yak_server import usbdevice
 
 
@@ -249,6 +255,47 @@ class TestUSBDevice(tests.util.TestCase):
 
         self.assertEqual(data, b'cd')
 
+    def test_flush_reads_whole_packets(self):
+        usb_device = self._make_fake_raw_input_device()
+        endpoint = usb_device.raw_device.configuration.interface.in_endpoint
+        endpoint.read = unittest.mock.Mock(side_effect=[b'abcdefgh', b'i',
+                                                        b''])
+        usb_device.connect()
+
+        usb_device.flush()
+
+        self.assertEqual(endpoint.read.call_args_list,
+                         [unittest.mock.call(8)] * 3)
+
+    def test_query_state(self):
+        usb_device = self._make_fake_raw_input_device()
+        usb_device.raw_device.ctrl_transfer = unittest.mock.Mock(
+            return_value=array.array('B', [1]))
+        usb_device.connect()
+
+        self.assertEqual(usb_device.query_state(1), b'\x01')
+        usb_device.raw_device.ctrl_transfer.assert_called_once_with(
+            usbdevice.GET_STATE_REQUEST_TYPE, usbdevice.GET_STATE, 0,
+            usb_device.INTERFACE, 1)
+
+    def test_query_state_of_old_firmware_raises_usb_error(self):
+        usb_device = self._make_fake_raw_input_device()
+        usb_device.raw_device.ctrl_transfer = unittest.mock.Mock(
+            side_effect=usb.USBError('Pipe error', errno=errno.EPIPE))
+        usb_device.connect()
+
+        with self.assertRaises(usbdevice.USBError):
+            usb_device.query_state(1)
+
+    def test_query_state_of_a_lost_device(self):
+        usb_device = self._make_fake_raw_input_device()
+        usb_device.raw_device.ctrl_transfer = unittest.mock.Mock(
+            side_effect=usb.USBError('No such device', errno=errno.ENODEV))
+        usb_device.connect()
+
+        with self.assertRaises(usbdevice.DeviceDisconnected):
+            usb_device.query_state(1)
+
     def test_read(self):
         usb_device = self._make_fake_raw_input_device()
         usb_device.connect()
@@ -277,6 +324,25 @@ class TestUSBDevice(tests.util.TestCase):
 
         self.assertEqual(data, b'abc')
 
+    def test_read_with_timeout_returns_partial_data(self):
+        virtual_clock = clock.VirtualClock()
+        fake_raw_device = fake_usb.FakeRawUSBDevice()
+        endpoint = fake_raw_device.configuration.interface.in_endpoint
+        endpoint.read_data = [ord('a')] + [None] * 10
+        usb_device = usbdevice.USBDevice(fake_raw_device, virtual_clock)
+        usb_device.connect()
+        endpoint_read = endpoint.read
+
+        def slow_read(number_of_bytes):
+            virtual_clock.advance(0.1)
+            return endpoint_read(number_of_bytes)
+        endpoint.read = slow_read
+
+        data = usb_device.read(2, timeout=0.5)
+
+        self.assertEqual(data, b'a')
+        self.assertAlmostEqual(virtual_clock.monotonic(), 0.5)
+
     def test_write(self):
         usb_device = self._make_fake_raw_output_device()
         usb_device.connect()
@@ -287,7 +353,8 @@ class TestUSBDevice(tests.util.TestCase):
 
     def test_write_raises_exception_on_error(self):
         fake_raw_device = fake_usb.FakeRawUSBDevice()
-        stub_endpoint = unittest.mock.Mock()
+        stub_endpoint = unittest.mock.Mock(bEndpointAddress=0x01,
+                                           wMaxPacketSize=8)
         stub_endpoint.write.side_effect = usb.USBError('')
         fake_raw_device.configuration.interface.endpoint_list = [stub_endpoint]
         usb_device = usbdevice.USBDevice(fake_raw_device)
@@ -298,7 +365,8 @@ class TestUSBDevice(tests.util.TestCase):
 
     def test_write_raises_exception_on_incomplete_write(self):
         fake_raw_device = fake_usb.FakeRawUSBDevice()
-        stub_endpoint = unittest.mock.Mock()
+        stub_endpoint = unittest.mock.Mock(bEndpointAddress=0x01,
+                                           wMaxPacketSize=8)
         stub_endpoint.write.return_value = 2
         fake_raw_device.configuration.interface.endpoint_list = [stub_endpoint]
         usb_device = usbdevice.USBDevice(fake_raw_device)
@@ -309,7 +377,8 @@ class TestUSBDevice(tests.util.TestCase):
 
     def test_write_logs_error(self):
         fake_raw_device = fake_usb.FakeRawUSBDevice()
-        stub_endpoint = unittest.mock.Mock()
+        stub_endpoint = unittest.mock.Mock(bEndpointAddress=0x01,
+                                           wMaxPacketSize=8)
         stub_endpoint.write.side_effect = usb.USBError('')
         fake_raw_device.configuration.interface.endpoint_list = [stub_endpoint]
         usb_device = usbdevice.USBDevice(fake_raw_device)
@@ -321,6 +390,85 @@ class TestUSBDevice(tests.util.TestCase):
             except usbdevice.USBError:
                 pass
 
+    def test_reads_and_writes_use_separate_endpoints(self):
+        usb_device = self._make_fake_raw_input_device()
+        interface = usb_device.raw_device.configuration.interface
+        interface.out_endpoint.write = unittest.mock.Mock(return_value=1)
+        interface.out_endpoint.wMaxPacketSize = 64
+        usb_device.connect()
+
+        usb_device.write(b'x')
+
+        interface.out_endpoint.write.assert_called_once_with(b'x')
+        self.assertEqual(usb_device.read(2), b'ab')
+        self.assertEqual(usb_device.max_packet_size, 64)
+
+    def test_write_does_not_wait_for_read_in_progress(self):
+        usb_device = self._make_fake_raw_input_device()
+        interface = usb_device.raw_device.configuration.interface
+        read_started = threading.Event()
+        release_read = threading.Event()
+
+        def blocking_read(number_of_bytes):
+            read_started.set()
+            release_read.wait(timeout=5)
+            return b'a'
+        interface.in_endpoint.read = blocking_read
+        usb_device.connect()
+        reader = threading.Thread(target=usb_device.read, args=(1,))
+        reader.start()
+        read_started.wait(timeout=5)
+
+        bytes_written = usb_device.write(b'x')
+
+        self.assertFalse(release_read.is_set())
+        release_read.set()
+        reader.join(timeout=5)
+        self.assertEqual(bytes_written, 1)
+
+    def test_read_without_in_endpoint_raises(self):
+        usb_device = self._make_fake_raw_output_device()
+        usb_device.connect()
+
+        with self.assertRaises(usbdevice.USBError):
+            usb_device.read(1)
+
+    def test_write_to_missing_device_raises_device_disconnected(self):
+        fake_raw_device = fake_usb.FakeRawUSBDevice()
+        stub_endpoint = unittest.mock.Mock(bEndpointAddress=0x01,
+                                           wMaxPacketSize=8)
+        stub_endpoint.write.side_effect = usb.USBError(
+            'No such device', errno=errno.ENODEV)
+        fake_raw_device.configuration.interface.endpoint_list = [stub_endpoint]
+        usb_device = usbdevice.USBDevice(fake_raw_device)
+        usb_device.connect()
+
+        with self.assertRaises(usbdevice.DeviceDisconnected):
+            usb_device.write(b'test')
+
+    def test_read_from_missing_device_raises_device_disconnected(self):
+        usb_device = self._make_fake_raw_input_device()
+        endpoint = usb_device.raw_device.configuration.interface.in_endpoint
+        endpoint.read = unittest.mock.Mock(side_effect=usb.USBError(
+            'No such device', errno=errno.ENODEV))
+        usb_device.connect()
+
+        with self.assertRaises(usbdevice.DeviceDisconnected):
+            usb_device.read(1)
+
+    def test_identifier_uses_port_path(self):
+        stub_raw_device = unittest.mock.Mock(bus=1, port_numbers=(2, 3))
+        usb_device = usbdevice.USBDevice(stub_raw_device)
+
+        self.assertEqual(usb_device.identifier, '1-2.3')
+
+    def test_identifier_falls_back_to_address(self):
+        stub_raw_device = unittest.mock.Mock(bus=1, port_numbers=None,
+                                             address=7)
+        usb_device = usbdevice.USBDevice(stub_raw_device)
+
+        self.assertEqual(usb_device.identifier, '1-a7')
+
     @staticmethod
     def _make_fake_raw_input_device():
         fake_raw_device = fake_usb.FakeRawUSBDevice()
@@ -332,3 +480,97 @@ class TestUSBDevice(tests.util.TestCase):
         interface = fake_raw_device.configuration.interface
         interface.endpoint_list = [interface.out_endpoint]
         return usbdevice.USBDevice(fake_raw_device)
+
+
+class TestUSBDeviceWithSimulatedFaults(tests.util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.usbdevice').setLevel(100)
+        self.sleeps = []
+
+    def test_latency_is_applied_per_transfer(self):
+        profile = simulated_usb.TransferProfile(
+            latency=simulated_usb.constant(0.01))
+        usb_device = self._make_device(profile, output=True)
+
+        usb_device.write(b'a')
+        usb_device.write(b'b')
+
+        self.assertEqual(self.sleeps, [0.01, 0.01])
+
+    def test_jitter_is_reproducible_with_seed(self):
+        profile = simulated_usb.TransferProfile(
+            latency=simulated_usb.exponential(0.01), jitter=0.005)
+        first = simulated_usb.Simulator(profile, seed=42,
+                                        sleep=lambda latency: None)
+        second = simulated_usb.Simulator(profile, seed=42,
+                                         sleep=lambda latency: None)
+
+        for simulator in (first, second):
+            for _ in range(10):
+                simulator.write(len, b'x')
+
+        self.assertEqual(first.latencies, second.latencies)
+        self.assertTrue(all(latency >= 0 for latency in first.latencies))
+
+    def test_partial_write_raises_incomplete_write(self):
+        profile = simulated_usb.TransferProfile(partial_write_rate=1.0)
+        usb_device = self._make_device(profile, output=True)
+
+        with self.assertRaises(usbdevice.IncompleteUSBWrite):
+            usb_device.write(b'test')
+
+    def test_timeout_on_write_raises_usb_error(self):
+        profile = simulated_usb.TransferProfile(timeout_rate=1.0)
+        usb_device = self._make_device(profile, output=True)
+
+        with self.assertRaises(usbdevice.USBError):
+            usb_device.write(b'test')
+
+    def test_disconnect_persists_until_reconnect(self):
+        profile = simulated_usb.TransferProfile(disconnect_rate=1.0)
+        simulator = simulated_usb.Simulator(profile, sleep=self.sleeps.append)
+        device = simulated_usb.SimulatedUsbDevice(
+            fake_switch_device.FakeSwitchDeviceV0_0_0(), simulator)
+
+        with self.assertRaises(usbdevice.USBError):
+            device.write(b'\x01')
+        simulator.profile = simulated_usb.TransferProfile()
+        with self.assertRaises(usbdevice.USBError):
+            device.write(b'\x01')
+        simulator.reconnect()
+
+        self.assertEqual(device.write(b'\x01'), 1)
+
+    def test_simulated_fake_device_reads(self):
+        simulator = simulated_usb.Simulator(sleep=self.sleeps.append)
+        fake_device = fake_switch_device.FakeSwitchDeviceV0_0_0()
+        device = simulated_usb.SimulatedUsbDevice(fake_device, simulator)
+
+        fake_device.press_button()
+
+        self.assertEqual(device.read(1), b'\x01')
+
+    def test_simulated_fake_device_retries_failed_reads(self):
+        profile = simulated_usb.TransferProfile(timeout_rate=0.5)
+        simulator = simulated_usb.Simulator(profile, seed=2,
+                                            sleep=self.sleeps.append)
+        fake_device = fake_switch_device.FakeSwitchDeviceV0_0_0()
+        device = simulated_usb.SimulatedUsbDevice(fake_device, simulator)
+        for _ in range(5):
+            fake_device.press_button()
+
+        data = device.read(5)
+
+        self.assertEqual(data, b'\x01' * 5)
+
+    def _make_device(self, profile, output=False):
+        simulator = simulated_usb.Simulator(profile, seed=1,
+                                            sleep=self.sleeps.append)
+        fake_raw_device = fake_usb.FakeRawUSBDevice()
+        simulated_usb.simulate_raw_device(fake_raw_device, simulator)
+        if output:
+            interface = fake_raw_device.configuration.interface
+            interface.endpoint_list = [interface.out_endpoint]
+        usb_device = usbdevice.USBDevice(fake_raw_device)
+        usb_device.connect()
+        return usb_device
@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use
+
+import ctypes
+import errno
+import logging
+import os
+import struct
+import unittest.mock
+
+from tests import util
+
+import yak_server.__main__
+from yak_server import usbdevice
+from yak_server import usbfs
+
+
+class FakeKernel:
+    """Answer usbfs ioctls like the kernel does for a device."""
+
+    def __init__(self):
+        self.requests = []
+        self.written = []
+        self.read_data = b''
+        self.state = b'\x01'
+        self.errors = {}
+
+    def __call__(self, descriptor, request, argument):
+        self.requests.append(request)
+        if request in self.errors:
+            code = self.errors[request]
+            raise OSError(code, os.strerror(code))
+        if request == usbfs.USBDEVFS_BULK:
+            return self._transfer(argument)
+        if request == usbfs.USBDEVFS_CONTROL:
+            self.control = (argument.bRequestType, argument.bRequest,
+                            argument.wValue, argument.wIndex)
+            ctypes.memmove(argument.data, self.state, argument.wLength)
+            return argument.wLength
+        if request == usbfs.USBDEVFS_SETCONFIGURATION:
+            self.configuration, = struct.unpack('I', argument)
+        return 0
+
+    def _transfer(self, request):
+        if request.ep & 0x80:
+            data = self.read_data[:request.len]
+            self.read_data = self.read_data[len(data):]
+            ctypes.memmove(request.data, data, len(data))
+            return len(data)
+        self.written.append(ctypes.string_at(request.data, request.len))
+        return request.len
+
+
+class TestUsbfsTransport(util.TestCase):
+    def setUp(self):
+        logging.getLogger('yak_server.usbdevice').setLevel(logging.CRITICAL)
+        self.kernel = kernel = FakeKernel()
+
+        class Transport(usbfs.UsbfsTransport):
+            ioctl = staticmethod(kernel)
+
+            def __init__(self, raw_device):
+                super().__init__(raw_device)
+                self.path = os.devnull
+
+        self.raw_device = unittest.mock.MagicMock(bus=1, address=2)
+        self.raw_device.__getitem__.return_value.bConfigurationValue = 1
+        configuration = self.raw_device.get_active_configuration.return_value
+        configuration.interfaces.return_value = [unittest.mock.Mock()]
+        configuration.interfaces()[0].endpoints.return_value = [
+            unittest.mock.Mock(bEndpointAddress=0x81, wMaxPacketSize=8),
+            unittest.mock.Mock(bEndpointAddress=0x01, wMaxPacketSize=8)]
+        self.device = usbdevice.USBDevice(self.raw_device,
+                                          transport=Transport)
+        self.addCleanup(self.device.transport.close)
+
+    def test_device_path(self):
+        self.assertEqual(usbfs.device_path(1, 2), '/dev/bus/usb/001/002')
+
+    def test_connect_detaches_the_driver_and_claims_the_interface(self):
+        self.device.connect()
+
+        self.assertEqual(self.kernel.requests, [
+            usbfs.USBDEVFS_GETDRIVER, usbfs.USBDEVFS_IOCTL,
+            usbfs.USBDEVFS_SETCONFIGURATION, usbfs.USBDEVFS_CLAIMINTERFACE])
+        self.assertEqual(self.kernel.configuration, 1)
+        self.assertTrue(self.device.is_input())
+
+    def test_connect_without_a_driver_does_not_detach(self):
+        self.kernel.errors[usbfs.USBDEVFS_GETDRIVER] = errno.ENODATA
+
+        self.device.connect()
+
+        self.assertNotIn(usbfs.USBDEVFS_IOCTL, self.kernel.requests)
+
+    def test_failing_claim_raises_usb_error(self):
+        self.kernel.errors[usbfs.USBDEVFS_CLAIMINTERFACE] = errno.EBUSY
+
+        with self.assertRaises(usbdevice.USBError):
+            self.device.connect()
+
+    def test_transfers(self):
+        self.device.connect()
+        self.kernel.read_data = b'abcdefghijklmnopqrstuvwxyz'
+
+        self.assertEqual(self.device.write(b'\x01\x02'), 2)
+        self.assertEqual(self.device.read(1), b'a')
+        self.assertEqual(self.device.read(20), b'bcdefghijklmnopqrstu')
+        self.assertEqual(self.kernel.written, [b'\x01\x02'])
+
+    def test_query_state(self):
+        self.device.connect()
+
+        self.assertEqual(self.device.query_state(1), b'\x01')
+        self.assertEqual(self.kernel.control, (
+            usbdevice.GET_STATE_REQUEST_TYPE, usbdevice.GET_STATE, 0, 0))
+
+    def test_timed_out_reads_return_nothing(self):
+        self.device.connect()
+        self.kernel.errors[usbfs.USBDEVFS_BULK] = errno.ETIMEDOUT
+
+        self.assertEqual(self.device.read(1, timeout=0.01), b'')
+
+    def test_gone_device_stays_disconnected(self):
+        self.device.connect()
+        self.kernel.errors[usbfs.USBDEVFS_BULK] = errno.ENODEV
+
+        with self.assertRaises(usbdevice.DeviceDisconnected):
+            self.device.read(1)
+        del self.kernel.errors[usbfs.USBDEVFS_BULK]
+        with self.assertRaises(usbdevice.DeviceDisconnected):
+            self.device.write(b'\x01')
+        self.assertEqual(self.kernel.requests.count(usbfs.USBDEVFS_BULK), 1)
+
+
+class TestMain(util.TestCase):
+    def test_transport_option_selects_the_usbfs_backend(self):
+        application = self.start_patch('yak_server.__main__.Application')
+
+        yak_server.__main__.main(['--transport', 'usbfs'])
+
+        self.assertIs(application.mock.call_args[1]['device_backend'], usbfs)
@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+
+# pylint: disable = no-self-use, unused-argument
+
+from tests import util
+
+from yak_server import virtual
+
+
+class TestVirtualFleet(util.TestCase):
+    def test_from_spec_creates_devices(self):
+        fleet = virtual.VirtualFleet.from_spec({'switches': 3, 'ac': 2})
+
+        self.assertEqual(len(fleet.switches), 3)
+        self.assertEqual(len(fleet.ac_devices), 2)
+
+    def test_identifiers_are_unique(self):
+        fleet = virtual.VirtualFleet(switch_count=100, ac_count=100)
+
+        identifiers = {device.identifier for device in fleet.devices}
+
+        self.assertEqual(len(identifiers), 200)
+
+    def test_find_by_product_id(self):
+        fleet = virtual.VirtualFleet(switch_count=2, ac_count=1)
+
+        switches = fleet.find(vendor_id=0x04d8, product_id=0x5900)
+        ac_devices = fleet.find(vendor_id=0x04d8, product_id=0x5901)
+
+        self.assertEqual(list(switches), fleet.switches)
+        self.assertEqual(list(ac_devices), fleet.ac_devices)
+
+    def test_find_without_matches(self):
+        fleet = virtual.VirtualFleet()
+
+        self.assertEqual(fleet.find(vendor_id=0x1234), ())
+
+    def test_play_scripted_pattern(self):
+        fleet = virtual.VirtualFleet(switch_count=2)
+        pattern = virtual.scripted_pattern([(0, 1, True), (0, 1, False),
+                                            (0, 0, True)])
+
+        steps = fleet.play(pattern)
+
+        self.assertEqual(steps, 3)
+        self.assertEqual(fleet.switches[1].read(2), b'\x01\x00')
+        self.assertEqual(fleet.switches[0].read(1), b'\x01')
+
+    def test_random_pattern_is_reproducible(self):
+        first = list(virtual.random_pattern(10, 20, seed=3))
+        second = list(virtual.random_pattern(10, 20, seed=3))
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), 40)
+
+
+class TestVirtualDevices(util.TestCase):
+    def test_switch_only_sends_changes(self):
+        switch = virtual.VirtualSwitchDevice('switch')
+
+        switch.press()
+        switch.press()
+        switch.release()
+
+        self.assertEqual(switch.read(2), b'\x01\x00')
+
+    def test_switch_is_input(self):
+        switch = virtual.VirtualSwitchDevice('switch')
+
+        self.assertTrue(switch.is_input())
+        self.assertFalse(switch.is_output())
+
+    def test_ac_device_tracks_lamp_state(self):
+        ac_device = virtual.VirtualACDevice('ac')
+
+        ac_device.write(b'\x01')
+
+        self.assertTrue(ac_device.lamp_on)
+        self.assertEqual(ac_device.write_count, 1)
+
+    def test_flush_discards_pending_data(self):
+        switch = virtual.VirtualSwitchDevice('switch')
+        switch.press()
+
+        switch.flush()
+        switch.release()
+
+        self.assertEqual(switch.read(1), b'\x00')
@@ -2,26 +2,181 @@
 
 """The yak_server application."""
 
+import argparse
+import logging
+import queue
+import sys
+import threading
+
+from yak_server import bus
+from yak_server import clock
 from yak_server import interface
 from yak_server import events
+from yak_server import history as history_module
+from yak_server import manifest as manifest_module
+from yak_server import patterns
+from yak_server import priority
+from yak_server import ratelimit
+from yak_server import rollups as rollups_module
+from yak_server import scenes
+from yak_server import scheduler
+from yak_server import statetable
+from yak_server import supervisor
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ReaderError(Exception):
+    """Reading events from an input interface failed."""
+
+
+class _ReaderFailure:
+    """Put in the event queue when a reader thread stops on an error."""
+
+    def __init__(self, name, exception):
+        self.name = name
+        self.exception = exception
+
+
+class _CommandBatch:
+    """Put in the event queue to send commands from the main loop."""
+
+    def __init__(self, commands):
+        self.commands = commands
 
 
 class Application:
     """Object holding the main application state and main loop."""
 
-    def __init__(self):
-        """Create the application object."""
+    # Interfaces initialized at the same time during setup, and the
+    # seconds setup waits for them.
+    CONNECT_WORKERS = 8
+    CONNECT_TIMEOUT = 5.0
+
+    # Handled events are switch states, sent commands lamp states.
+    _STATE_KINDS = {bus.EVENT: statetable.SWITCH,
+                    bus.COMMAND: statetable.LAMP}
+
+    def __init__(self, device_backend=None, server_clock=None,
+                 manifest=None, gateway=None, event_bus=None,
+                 state_table=None, live_stream=None, rollups=None,
+                 history=None):
+        """Create the application object.
+
+        Devices are found through 'device_backend', with translators
+        from 'manifest' if given, see 'interface.InterfaceManager'. The
+        devices of remote nodes are served through 'gateway', a
+        'gateway.GatewayInterface', if given. Handled events and sent
+        commands are published on 'event_bus', a 'bus.EventBus', the
+        state of the devices in 'state_table', a
+        'statetable.StateTable', and streamed to the clients of
+        'live_stream', a 'livestream.LiveStream', if given. They are
+        also aggregated by 'rollups', a 'rollups.Rollups', and recorded
+        by 'history', a 'history.HistoryRecorder', if given.
+        All waiting in the main loop is done on 'server_clock', which
+        defaults to the default clock.
+        """
+        self.device_backend = device_backend
+        self.manifest = manifest
+        self.gateway = gateway
+        self.event_bus = event_bus
+        self.state_table = state_table
+        self.live_stream = live_stream
+        self.rollups = rollups
+        self.history = history
+        self.clock = server_clock or clock.get_clock()
+        self._start = self.clock.monotonic()
+        self.time_to_first_event = None
+        self.device_states = {}
+        self.input_interfaces = []
+        self.output_interfaces = []
+        self._inputs_by_name = {}
         self.switch_interface = None
         self.ac_interface = None
+        self.scheduler = scheduler.Scheduler(self.clock)
+        self.pattern_matcher = patterns.PatternMatcher()
+        self.scene_runner = scenes.SceneRunner()
+        self.rate_limiter = ratelimit.RateLimiter(limiter_clock=self.clock)
+        self._pattern_handlers = {}
+        self.output_gates = {}
+        self._routes = {}
+        self._outputs = {}
+        self._background_outputs = {}
+        self._keyed_timers = {}
+        self._event_queue = queue.Queue()
 
     def setup(self):
-        """Initialize the application in preparation for the main loop."""
-        interface_manager = interface.InterfaceManager()
-        self.switch_interface = interface_manager.input_interfaces()[0]
-        self.switch_interface.initialize()
+        """Initialize the application in preparation for the main loop.
+
+        The interfaces are initialized in parallel. Setup waits at most
+        CONNECT_TIMEOUT seconds for them, interfaces that take longer
+        are served as soon as they are ready. Commands for an output
+        that is not ready yet are sent once it is, see 'supervisor'.
+        The manifest is checked in the background afterwards.
+        Every input is synced once it is connected, see
+        '_device_state_changed'.
+        """
+        interface_manager = interface.InterfaceManager(
+            self.device_backend, self.manifest,
+            listener=self._device_state_changed)
+        self.input_interfaces = interface_manager.input_interfaces()
+        self.output_interfaces = interface_manager.output_interfaces()
+        if self.gateway is not None:
+            self.input_interfaces.append(self.gateway)
+        self._inputs_by_name = {input_interface.name: input_interface
+                                for input_interface in self.input_interfaces}
+
+        self.switch_interface = next(iter(self.input_interfaces), None)
+        self.ac_interface = next(iter(self.output_interfaces), None)
+        self._routes = self._default_routes()
+        for output_interface in self.output_interfaces:
+            self._add_output(output_interface)
+
+        if self.event_bus is not None:
+            self.event_bus.start()
+        self._start_readers()
+        self._start_thread(interface_manager.check_manifest)
 
-        self.ac_interface = interface_manager.output_interfaces()[0]
-        self.ac_interface.initialize()
+    def _interface_ready(self, ready_interface):
+        """Start serving an interface once it is initialized."""
+        if (ready_interface in self.input_interfaces and
+                not self._served_by_backend(ready_interface)):
+            self._start_thread(self._read_events, ready_interface)
+
+    def _device_state_changed(self, identifier, old_state, new_state):
+        """Queue the current state of an input once it is connected.
+
+        The supervisor of a device calls this from the thread that
+        connected it: on startup one of the threads initializing the
+        interfaces, after a reconnect the reconnect thread of the
+        device. So the inputs are synced in parallel, and the server
+        knows the position of a switch without waiting for it to
+        change.
+        """
+        # pylint: disable = unused-argument
+        input_interface = self._inputs_by_name.get(identifier)
+        if new_state != supervisor.CONNECTED or input_interface is None:
+            return
+        try:
+            event = input_interface.sync_state()
+        except Exception:  # pylint: disable = broad-except
+            _LOGGER.exception('Syncing the state of %s failed.', identifier)
+            return
+        self._queue_event(input_interface, event)
+
+    def _add_output(self, output_interface):
+        """Set up the interactive and background path to an output.
+
+        Both paths are rate limited and share the priority gate of the
+        device, see 'ratelimit' and 'priority'.
+        """
+        name = output_interface.name
+        gate = priority.PriorityGate(gate_clock=self.clock)
+        interactive, background = priority.prioritized(output_interface, gate)
+        self.output_gates[name] = gate
+        self._outputs[name] = self.rate_limiter.wrap(interactive)
+        self._background_outputs[name] = self.rate_limiter.wrap(background)
 
     def main_loop(self):
         """Run the program untill the server stops."""
@@ -34,33 +189,385 @@ class Application:
         return True
 
     def main_loop_iteration(self):
-        """Execute one iteration of the main loop."""
-        event = self.get_event()
+        """Execute one iteration of the main loop.
+
+        Wait for an event, but no longer than untill the next scheduled
+        or throttled command is due or a rollup window ends, then
+        handle the event, run due commands, send throttled commands
+        that may be sent again and close the rollup windows that ended.
+        """
+        event = self.get_event(timeout=self.next_timeout())
         self.handle_event(event)
+        self.scheduler.run_due()
+        self.rate_limiter.flush()
+        if self.rollups is not None:
+            self.rollups.close_due(self.clock.now())
+
+    def next_timeout(self):
+        """Return the seconds the main loop may wait for an event."""
+        timeouts = [self.scheduler.timeout(), self.rate_limiter.timeout()]
+        if self.rollups is not None:
+            timeouts.append(self.rollups.timeout(self.clock.now()))
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        return min(timeouts) if timeouts else None
 
-    def get_event(self):
+    def get_event(self, timeout=None):
         """Get the next event.
 
         If there is no event to be processed, block untill one becomes
-        available.
+        available or, if given, 'timeout' seconds have passed on the
+        application clock, in which case None is returned. Raise
+        ReaderError if reading from one of the input interfaces failed.
         """
-        return self.switch_interface.get_event()
+        try:
+            event = self.clock.get(self._event_queue, timeout)
+        except queue.Empty:
+            return None
+        if isinstance(event, _ReaderFailure):
+            raise ReaderError('Reading from {} failed.'.format(
+                event.name)) from event.exception
+        return event
 
     def handle_event(self, event):
-        """Handle an event."""
+        """Handle an event.
+
+        Pattern events go to the handler of their pattern. Other events
+        drive their output and are fed to the pattern matcher, the
+        pattern events it emits are handled in turn.
+        """
+        if not event:
+            return
+        if isinstance(event, _CommandBatch):
+            # Commands from submit_commands.
+            for command in event.commands:
+                self.send_command(command)
+            return
+        if self.time_to_first_event is None:
+            self._first_event_handled()
+        self._publish(bus.EVENT, event)
+        if isinstance(event, events.PatternEvent):
+            self._pattern_handlers[event.pattern](event)
+            return
+        self._handle_input_event(event)
+        if self._pattern_handlers:
+            for pattern_event in self.pattern_matcher.feed(event):
+                self.handle_event(pattern_event)
+
+    def _first_event_handled(self):
+        self.time_to_first_event = self.clock.monotonic() - self._start
+        _LOGGER.info('First event handled %.3f s after start.',
+                     self.time_to_first_event)
+
+    def add_pattern(self, pattern, handler):
+        """Call 'handler' with a PatternEvent every time 'pattern' matches.
+
+        See the 'patterns' module for how to describe patterns.
+        """
+        self.pattern_matcher.add(pattern)
+        self._pattern_handlers[pattern.name] = handler
+
+    def _handle_input_event(self, event):
+        output_interface = self.route(event)
+        if output_interface is None:
+            return
+        device = output_interface.name
+        if output_interface is self.gateway:
+            # The node drives the output paired with its input.
+            device = event.device
+        if isinstance(event, events.ButtonDownEvent):
+            command = events.LampOnEvent(device=device)
+        elif isinstance(event, events.ButtonUpEvent):
+            command = events.LampOffEvent(device=device)
+        else:
+            return
+        self.send_command(command)
+
+    def send_command(self, command):
+        """Send a command to the output interface of its device.
+
+        Commands without a known device go to the first output. The
+        command may be throttled or replaced by a newer one, see
+        'ratelimit'.
+        """
+        self._publish(bus.COMMAND, command)
+        self._output_interface(command.device).send_command(command)
+
+    def has_output(self, device):
+        """Return True if 'device' names an output, local or remote."""
+        if self.gateway is not None and self.gateway.owns(device):
+            return True
+        return device in self._outputs
+
+    def submit_commands(self, commands):
+        """Send commands from the main loop, may be called from any thread.
+
+        The commands go the same way as those for handled events, see
+        send_command.
+        """
+        self._event_queue.put(_CommandBatch(list(commands)))
+
+    def send_background_command(self, command):
+        """Send a command, giving way to interactive commands.
+
+        See send_command and the 'priority' module.
+        """
+        self._publish(bus.COMMAND, command)
+        output_interface = self._background_outputs.get(command.device)
+        if output_interface is None:
+            output_interface = self._output_interface(command.device)
+        output_interface.send_command(command)
+
+    def output_wait_times(self, command_priority):
+        """Return the sorted recent waits for the outputs of a priority."""
+        return sorted(wait_time for gate in self.output_gates.values()
+                      for wait_time in gate.wait_times(command_priority))
+
+    def run_scene(self, scene):
+        """Send all commands of a scene in parallel, see 'scenes'.
+
+        Scenes are background work. Return a dict with a DeviceResult
+        per device.
+        """
+        for command in scene.commands:
+            self._publish(bus.COMMAND, command)
+        return self.scene_runner.run(scene, self._background_outputs)
+
+    def _publish(self, kind, event):
+        if isinstance(event, (events.ButtonDownEvent, events.ButtonUpEvent)):
+            self.device_states[event.device] = isinstance(
+                event, events.ButtonDownEvent)
+        if self.event_bus is not None:
+            self.event_bus.publish(kind, event)
+        if self.state_table is not None:
+            self.state_table.update(self._STATE_KINDS[kind], event)
+        if self.live_stream is not None:
+            self.live_stream.publish(kind, event)
+        if self.rollups is not None:
+            self.rollups.record(kind, event)
+        if self.history is not None:
+            self.history.record(kind, event)
+
+    def schedule_command(self, delay, command, key=None):
+        """Send a background command after 'delay' seconds.
+
+        If a key is given, a command scheduled earlier with the same
+        key that is still pending is cancelled. Return the timer.
+        """
+        return self._schedule(key, self.scheduler.call_later, delay, command)
+
+    def schedule_command_at(self, when, command, key=None):
+        """Send a command at the datetime 'when', see schedule_command."""
+        return self._schedule(key, self.scheduler.call_at, when, command)
+
+    def _schedule(self, key, call, when, command):
+        if key is not None and key in self._keyed_timers:
+            self.scheduler.cancel(self._keyed_timers.pop(key))
+        timer = call(when, self._send_scheduled_command, key, command)
+        if key is not None:
+            self._keyed_timers[key] = timer
+        return timer
+
+    def _send_scheduled_command(self, key, command):
+        if key is not None:
+            self._keyed_timers.pop(key, None)
+        self.send_background_command(command)
+
+    def _output_interface(self, device):
+        if self.gateway is not None and self.gateway.owns(device):
+            return self.gateway
+        if device not in self._outputs:
+            device = self.ac_interface.name
+        return self._outputs.get(device, self.ac_interface)
+
+    def route(self, event):
+        """Return the output interface an input event should drive.
+
+        Input interfaces are paired with the output interfaces in
+        order, wrapping around when there are more inputs than
+        outputs. Events of remote devices go back to their node through
+        the gateway. Events of unknown origin go to the first output,
+        None is returned if there is none.
+        """
+        if self.gateway is not None and self.gateway.owns(event.device):
+            return self.gateway
+        return self._routes.get(event.device, self.ac_interface)
+
+    def _default_routes(self):
+        outputs = self.output_interfaces
+        if not outputs:
+            return {}
+        return {input_interface.name: outputs[index % len(outputs)]
+                for index, input_interface
+                in enumerate(self.input_interfaces)}
+
+    def _start_readers(self):
+        """Initialize the interfaces and start feeding the event queue.
+
+        Every input gets a reader once it is initialized. With a device
+        backend that can report which devices have input waiting (see
+        'virtual.VirtualFleet.wait_for_input') a single thread serves
+        all inputs. Otherwise, as for USB, every input gets its own
+        thread doing blocking reads, which limits the number of USB
+        inputs to what the OS handles as threads.
+        """
+        if self._serves_all_inputs():
+            self._start_thread(self._read_ready_events,
+                               self.device_backend.wait_for_input)
+        interface.initialize_all(
+            self.input_interfaces + self.output_interfaces,
+            self._interface_ready, max_workers=self.CONNECT_WORKERS,
+            timeout=self.CONNECT_TIMEOUT)
+
+    def _serves_all_inputs(self):
+        """Return True if one thread serves all inputs."""
+        return hasattr(self.device_backend, 'wait_for_input')
+
+    def _served_by_backend(self, input_interface):
+        """Return True if the backend thread serves an input."""
+        return (self._serves_all_inputs() and
+                input_interface is not self.gateway)
+
+    @staticmethod
+    def _start_thread(target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+
+    def _read_events(self, input_interface):
+        """Move events from an input interface to the event queue."""
+        try:
+            while True:
+                self._read_event(input_interface)
+        except Exception as exception:  # pylint: disable = broad-except
+            self._reader_failed(input_interface, exception)
+
+    def _read_ready_events(self, wait_for_input):
+        """Move events from all inputs with data to the event queue."""
+        interfaces = {input_interface.name: input_interface
+                      for input_interface in self.input_interfaces}
+        input_interface = None
+        try:
+            while True:
+                device = wait_for_input()
+                input_interface = interfaces[device.identifier]
+                self._read_event(input_interface)
+        except Exception as exception:  # pylint: disable = broad-except
+            self._reader_failed(input_interface, exception)
+
+    def _read_event(self, input_interface):
+        self._queue_event(input_interface, input_interface.get_event())
+
+    def _queue_event(self, input_interface, event):
         if event:
-            if isinstance(event, events.ButtonDownEvent):
-                self.ac_interface.send_command(events.LampOnEvent())
-            elif isinstance(event, events.ButtonUpEvent):
-                self.ac_interface.send_command(events.LampOffEvent())
+            if event.device is None:
+                event = event.from_device(input_interface.name)
+            self._event_queue.put(event)
+
+    def _reader_failed(self, input_interface, exception):
+        name = input_interface.name if input_interface else None
+        _LOGGER.exception('Stopped reading events from %s.', name)
+        self._event_queue.put(_ReaderFailure(name, exception))
+
 
+def main(argv=()):
+    """Run the server with the command line arguments 'argv'.
 
-def main():
-    """Run the server."""
-    application = Application()
+    With '--shards N' the devices are served by N processes, see
+    'sharding'. With '--transport usbfs' devices are claimed and
+    transferred to through Linux usbfs instead of pyusb, see 'usbfs'.
+    """
+    parser = argparse.ArgumentParser(prog='yak_server')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--transport', choices=['pyusb', 'usbfs'],
+                        default='pyusb', help='how to transfer data to the '
+                        'devices')
+    parser.add_argument('--http', type=int, metavar='PORT',
+                        help='serve the HTTP API and the live stream on '
+                        'PORT, see httpapi and livestream')
+    parser.add_argument('--rollups', metavar='PATH',
+                        help='aggregate activity and store the rollups in '
+                        'PATH, see rollups')
+    parser.add_argument('--history', metavar='PATH',
+                        help='record the events and commands in PATH, see '
+                        'history and analytics')
+    parser.add_argument('--gateway', type=int, metavar='PORT',
+                        help='serve the switches and lamps of nodes on '
+                        'other machines on PORT, see gateway')
+    parser.add_argument('--bus', metavar='PATH',
+                        help='publish the events and commands on the UNIX '
+                        'socket PATH, see bus')
+    parser.add_argument('--state-table', nargs='?', metavar='PATH',
+                        const=statetable.default_path(),
+                        help='publish the state of the devices in shared '
+                        'memory, in PATH or %(const)s, see statetable')
+    arguments = parser.parse_args(argv)
+    if arguments.shards > 1 and arguments.gateway is not None:
+        parser.error('--gateway cannot be used with --shards')
+    if arguments.shards > 1 and arguments.bus:
+        parser.error('--bus cannot be used with --shards')
+    if arguments.shards > 1 and arguments.state_table:
+        parser.error('--state-table cannot be used with --shards')
+    if arguments.shards > 1 and arguments.http is not None:
+        parser.error('--http cannot be used with --shards')
+    if arguments.shards > 1 and arguments.rollups:
+        parser.error('--rollups cannot be used with --shards')
+    if arguments.shards > 1 and arguments.history:
+        parser.error('--history cannot be used with --shards')
+    device_backend = None
+    backend_options = {}
+    if arguments.transport == 'usbfs':
+        # Imported here, usbfs is only available on Linux.
+        # pylint: disable = import-outside-toplevel
+        from yak_server import usbfs
+        device_backend = usbfs
+        backend_options['backend_factory'] = usbfs.backend
+    if arguments.shards > 1:
+        # Imported here, the sharding module builds on this one.
+        # pylint: disable = import-outside-toplevel
+        from yak_server import sharding
+        sharding.run_sharded(arguments.shards, **backend_options)
+        return
+    manifest = manifest_module.Manifest.load(manifest_module.default_path())
+    live_stream = None
+    if arguments.http is not None:
+        # Imported here, loading asyncio takes a good part of the
+        # startup time.
+        # pylint: disable = import-outside-toplevel
+        from yak_server import httpapi
+        from yak_server import livestream
+        live_stream = livestream.LiveStream()
+    rollups = None
+    if arguments.rollups:
+        rollups = rollups_module.Rollups(
+            store=rollups_module.RollupStore(arguments.rollups))
+    history = None
+    if arguments.history:
+        history = history_module.HistoryRecorder(arguments.history)
+    remote_gateway = None
+    if arguments.gateway is not None:
+        # Imported here, loading asyncio takes a good part of the
+        # startup time.
+        # pylint: disable = import-outside-toplevel
+        from yak_server import gateway
+        remote_gateway = gateway.GatewayInterface(port=arguments.gateway)
+    event_bus = None
+    if arguments.bus:
+        event_bus = bus.EventBus(arguments.bus)
+    state_table = None
+    if arguments.state_table:
+        state_table = statetable.StateTable(arguments.state_table)
+    application = Application(device_backend=device_backend,
+                              manifest=manifest, gateway=remote_gateway,
+                              event_bus=event_bus, state_table=state_table,
+                              live_stream=live_stream, rollups=rollups,
+                              history=history)
     application.setup()
+    if arguments.http is not None:
+        api = httpapi.HttpApi(application, port=arguments.http)
+        live_stream.attach(api)
+        api.start()
     application.main_loop()
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
@@ -0,0 +1,136 @@
+"""Analyse a recorded history with NumPy.
+
+This module needs NumPy, which the server itself does not, install
+yak_server with the 'analytics' extra for it. 'load' reads a
+'history' into columns, one array per field, so months of events are
+analysed with a few vectorized operations::
+
+    columns = analytics.load('/var/lib/yak_server/history')
+    switches = columns.select(columns.kind == bus.EVENT)
+    starts, counts = analytics.heatmap(switches, analytics.HOUR)
+    devices, pressed_at, durations = analytics.press_durations(switches)
+    chatter = durations < 20 * analytics.MILLISECOND
+
+Timestamps are POSIX times in nanoseconds, devices are numbers that
+index 'EventColumns.devices'.
+"""
+
+import os.path
+
+import numpy
+
+from yak_server import history
+
+
+MILLISECOND = 1000 * 1000
+SECOND = 1000 * MILLISECOND
+HOUR = 3600 * SECOND
+DAY = 24 * HOUR
+
+# The layout of history.RECORD.
+RECORD_DTYPE = numpy.dtype([('timestamp', '<i8'), ('device', '<u2'),
+                            ('type_code', 'u1'), ('kind', 'u1')])
+
+
+class EventColumns:
+    """Events and commands as NumPy arrays of equal length."""
+
+    def __init__(self, timestamp, device, type_code, kind, devices):
+        """Create columns, 'devices' are the names of device numbers."""
+        self.timestamp = timestamp
+        self.device = device
+        self.type_code = type_code
+        self.kind = kind
+        self.devices = devices
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def select(self, selection):
+        """Return the rows in a boolean mask or index array."""
+        return EventColumns(self.timestamp[selection], self.device[selection],
+                            self.type_code[selection], self.kind[selection],
+                            self.devices)
+
+    def device_number(self, name):
+        """Return the number of a device name."""
+        return self.devices.index(name)
+
+
+def load(path):
+    """Return the EventColumns of the history at 'path'."""
+    count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+    records = numpy.fromfile(path, dtype=RECORD_DTYPE, count=count)
+    return EventColumns(
+        numpy.ascontiguousarray(records['timestamp']),
+        numpy.ascontiguousarray(records['device']),
+        numpy.ascontiguousarray(records['type_code']),
+        numpy.ascontiguousarray(records['kind']),
+        history.read_devices(path))
+
+
+def time_buckets(timestamp, width, origin=0):
+    """Return the number of the bucket of 'width' of every timestamp."""
+    return (timestamp - origin) // width
+
+
+def bucket_counts(columns, width):
+    """Return the start times and row counts of the non-empty buckets."""
+    buckets, counts = numpy.unique(time_buckets(columns.timestamp, width),
+                                   return_counts=True)
+    return buckets * width, counts
+
+
+def device_counts(columns):
+    """Return the number of rows of every device number."""
+    return numpy.bincount(columns.device, minlength=len(columns.devices))
+
+
+def heatmap(columns, width):
+    """Return bucket start times and counts per device and bucket.
+
+    The counts are a (device count, bucket count) array covering all
+    buckets from the first row to the last.
+    """
+    if not len(columns):
+        return (numpy.zeros(0, numpy.int64),
+                numpy.zeros((len(columns.devices), 0), numpy.int64))
+    buckets = time_buckets(columns.timestamp, width)
+    first = buckets.min()
+    bucket_count = int(buckets.max() - first) + 1
+    device_count = len(columns.devices)
+    cells = columns.device.astype(numpy.int64) * bucket_count + (
+        buckets - first)
+    counts = numpy.bincount(cells, minlength=device_count * bucket_count)
+    starts = (first + numpy.arange(bucket_count)) * width
+    return starts, counts.reshape(device_count, bucket_count)
+
+
+def group_by_device(columns):
+    """Return a dict of the row indexes of every device name."""
+    order = numpy.argsort(columns.device, kind='stable')
+    ordered = columns.device[order]
+    boundaries = numpy.flatnonzero(numpy.diff(ordered)) + 1
+    groups = numpy.split(order, boundaries)
+    return {columns.devices[columns.device[group[0]]]: group
+            for group in groups if len(group)}
+
+
+def press_durations(columns):
+    """Pair every down with the up that follows it on the same device.
+
+    Return the device numbers, down timestamps and durations of the
+    presses. Downs without an up and ups without a down are skipped.
+    """
+    edges = columns.select(numpy.isin(columns.type_code,
+                                      [history.DOWN, history.UP]))
+    order = numpy.lexsort((edges.timestamp, edges.kind, edges.device))
+    device = edges.device[order]
+    kind = edges.kind[order]
+    timestamp = edges.timestamp[order]
+    type_code = edges.type_code[order]
+    pairs = numpy.flatnonzero(
+        (type_code[:-1] == history.DOWN) & (type_code[1:] == history.UP) &
+        (device[:-1] == device[1:]) & (kind[:-1] == kind[1:]))
+    return (device[pairs], timestamp[pairs],
+            timestamp[pairs + 1] - timestamp[pairs])
@@ -0,0 +1,280 @@
+"""Measure how the server scales with the number of devices.
+
+The server is run on a 'virtual.VirtualFleet' of the requested size
+while a random press pattern is played as fast as possible. For every
+event the time from reading it off the device to the command being
+written is measured. Run as::
+
+    python -m yak_server.benchmark --switches 10 100 1000 --ac 10
+
+With '--startup' the time to import the server in a fresh interpreter
+is measured instead. With '--transports' the time the pyusb and the
+usbfs transport take per transfer, without the time in the kernel or
+on the bus, is measured, see 'measure_transports'.
+"""
+
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import time
+import types
+
+import ezvalue
+import usb.backend
+import usb.core
+
+from yak_server import usbdevice
+from yak_server import virtual
+from yak_server.__main__ import Application
+
+
+class FleetResult(ezvalue.Value):
+    """The result of a fleet benchmark run."""
+
+    switch_count = 'Number of virtual switches.'
+    ac_count = 'Number of virtual AC devices.'
+    event_count = 'Number of events handled.'
+    elapsed = 'Wall clock time in seconds to handle all events.'
+    latencies = 'Sorted per event latencies in seconds.'
+
+    def throughput(self):
+        """Return the number of handled events per second."""
+        return self.event_count / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, fraction):
+        """Return the latency below which 'fraction' of events fall."""
+        if not self.latencies:
+            return 0.0
+        index = min(int(fraction * len(self.latencies)),
+                    len(self.latencies) - 1)
+        return self.latencies[index]
+
+
+def measure_fleet(switch_count, ac_count, press_count, seed=0):
+    """Run the server on a virtual fleet and return a FleetResult."""
+    fleet = virtual.VirtualFleet(switch_count=switch_count,
+                                 ac_count=ac_count)
+    application = Application(device_backend=fleet)
+    application.setup()
+    pattern = virtual.random_pattern(switch_count, press_count, seed=seed)
+    event_count = _count_state_changes(
+        virtual.random_pattern(switch_count, press_count, seed=seed))
+
+    latencies = []
+    start = time.perf_counter()
+    fleet.play_in_background(pattern)
+    for _ in range(event_count):
+        event = application.get_event()
+        application.handle_event(event)
+        latency = datetime.datetime.now() - event.timestamp
+        latencies.append(latency.total_seconds())
+    elapsed = time.perf_counter() - start
+
+    return FleetResult(switch_count=switch_count, ac_count=ac_count,
+                       event_count=event_count, elapsed=elapsed,
+                       latencies=sorted(latencies))
+
+
+def measure_startup(repeat=5):
+    """Return the fastest of 'repeat' imports of the server in seconds.
+
+    Every import is done by a new interpreter, so nothing is cached.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import yak_server.__main__'],
+                       check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+class TransportResult(ezvalue.Value):
+    """The result of a transport benchmark run."""
+
+    transport = 'Name of the transport.'
+    transfer_count = 'Number of writes and of reads measured.'
+    write_time = 'Seconds per 1 byte write.'
+    read_time = 'Seconds per 1 byte read.'
+
+
+def _descriptor(**fields):
+    return types.SimpleNamespace(extra_descriptors=[], **fields)
+
+
+class _NullBackend(usb.backend.IBackend):
+    """A pyusb backend with one lamp device whose transfers do nothing."""
+
+    # pylint: disable = unused-argument, too-many-arguments
+
+    DEVICE = _descriptor(
+        bLength=18, bDescriptorType=1, bcdUSB=0x200, bDeviceClass=0,
+        bDeviceSubClass=0, bDeviceProtocol=0, bMaxPacketSize0=8,
+        idVendor=0x04d8, idProduct=0x5901, bcdDevice=1, iManufacturer=0,
+        iProduct=0, iSerialNumber=0, bNumConfigurations=1, address=1,
+        bus=1, port_number=1, port_numbers=(1,), speed=None)
+    CONFIGURATION = _descriptor(
+        bLength=9, bDescriptorType=2, wTotalLength=32, bNumInterfaces=1,
+        bConfigurationValue=1, iConfiguration=0, bmAttributes=0x80,
+        bMaxPower=50)
+    INTERFACE = _descriptor(
+        bLength=9, bDescriptorType=4, bInterfaceNumber=0,
+        bAlternateSetting=0, bNumEndpoints=2, bInterfaceClass=0xff,
+        bInterfaceSubClass=0, bInterfaceProtocol=0, iInterface=0)
+    ENDPOINTS = [_descriptor(bLength=7, bDescriptorType=5,
+                             bEndpointAddress=address, bmAttributes=3,
+                             wMaxPacketSize=8, bInterval=1, bRefresh=0,
+                             bSynchAddress=0)
+                 for address in (0x01, 0x81)]
+
+    def enumerate_devices(self):
+        yield 'device'
+
+    def get_device_descriptor(self, dev):
+        return self.DEVICE
+
+    def get_configuration_descriptor(self, dev, config):
+        return self.CONFIGURATION
+
+    def get_interface_descriptor(self, dev, intf, alt, config):
+        if intf or alt:
+            raise IndexError('No interface {} setting {}.'.format(intf, alt))
+        return self.INTERFACE
+
+    def get_endpoint_descriptor(self, dev, ep, intf, alt, config):
+        return self.ENDPOINTS[ep]
+
+    def open_device(self, dev):
+        return 'handle'
+
+    def close_device(self, dev_handle):
+        pass
+
+    def set_configuration(self, dev_handle, config_value):
+        pass
+
+    def get_configuration(self, dev_handle):
+        return 1
+
+    def claim_interface(self, dev_handle, intf):
+        pass
+
+    def release_interface(self, dev_handle, intf):
+        pass
+
+    def is_kernel_driver_active(self, dev_handle, intf):
+        return False
+
+    def intr_write(self, dev_handle, ep, intf, data, timeout):
+        return len(data)
+
+    def intr_read(self, dev_handle, ep, intf, buff, timeout):
+        buff[0] = 1
+        return 1
+
+
+def _null_ioctl(descriptor, request, argument):
+    """Stand in for fcntl.ioctl, transferring all bytes asked for."""
+    # pylint: disable = unused-argument
+    return getattr(argument, 'len', 0)
+
+
+def _null_usbfs_transport():
+    """Return a usbfs transport class whose ioctls do nothing."""
+    # Imported here, usbfs is only available on Linux.
+    # pylint: disable = import-outside-toplevel
+    from yak_server import usbfs
+
+    class NullUsbfsTransport(usbfs.UsbfsTransport):
+        """A usbfs transport whose ioctls do nothing."""
+
+        ioctl = staticmethod(_null_ioctl)
+
+        def __init__(self, raw_device):
+            super().__init__(raw_device)
+            self.path = os.devnull
+
+    return NullUsbfsTransport
+
+
+def measure_transports(transfer_count=100000):
+    """Return a TransportResult for the pyusb and the usbfs transport.
+
+    Both transports run on a device whose transfers do nothing, a
+    pyusb backend for pyusb and an ioctl function for usbfs, so only
+    the time spent before the transfer reaches the kernel is measured.
+    For pyusb this leaves out the libusb calls, which only add to it.
+    """
+    results = []
+    for name, transport in [('pyusb', usbdevice.PyusbTransport),
+                            ('usbfs', _null_usbfs_transport())]:
+        raw_device = usb.core.Device('device', _NullBackend())
+        device = usbdevice.USBDevice(raw_device, transport=transport)
+        device.connect()
+        start = time.perf_counter()
+        for _ in range(transfer_count):
+            device.write(b'\x01')
+        write_time = (time.perf_counter() - start) / transfer_count
+        start = time.perf_counter()
+        for _ in range(transfer_count):
+            device.read(1)
+        read_time = (time.perf_counter() - start) / transfer_count
+        device.transport.close()
+        results.append(TransportResult(
+            transport=name, transfer_count=transfer_count,
+            write_time=write_time, read_time=read_time))
+    return results
+
+
+def _count_state_changes(pattern):
+    """Return the number of messages the switches send for 'pattern'."""
+    states = {}
+    count = 0
+    for _, switch_index, pressed in pattern:
+        if states.get(switch_index, False) != pressed:
+            count += 1
+        states[switch_index] = pressed
+    return count
+
+
+def format_result(result):
+    """Return a one line summary of a FleetResult."""
+    return ('{r.switch_count:6d} switches {r.ac_count:4d} ac '
+            '{r.event_count:7d} events {throughput:10.0f} events/s '
+            'p50 {p50:7.3f} ms p99 {p99:7.3f} ms').format(
+                r=result, throughput=result.throughput(),
+                p50=result.percentile(0.5) * 1000,
+                p99=result.percentile(0.99) * 1000)
+
+
+def main():
+    """Run the fleet benchmark for the given device counts."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--switches', type=int, nargs='+',
+                        default=[1, 10, 100, 1000])
+    parser.add_argument('--ac', type=int, default=1)
+    parser.add_argument('--presses', type=int, default=10000)
+    parser.add_argument('--startup', action='store_true')
+    parser.add_argument('--transports', action='store_true')
+    arguments = parser.parse_args()
+
+    if arguments.startup:
+        print('startup {:7.3f} ms'.format(measure_startup() * 1000))
+        return
+    if arguments.transports:
+        for result in measure_transports():
+            print('{r.transport:6s} write {write:7.2f} us '
+                  'read {read:7.2f} us'.format(
+                      r=result, write=result.write_time * 1e6,
+                      read=result.read_time * 1e6))
+        return
+
+    for switch_count in arguments.switches:
+        result = measure_fleet(switch_count, arguments.ac, arguments.presses)
+        print(format_result(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Publish the live events and commands to local processes.
+
+The 'EventBus' listens on a UNIX domain socket. Every event the
+application handles and every command it sends is published to all
+connected subscribers in a compact binary message, see
+'encode_message'. A subscriber can ask for the messages of some
+devices or event types only.
+
+Publishing never waits for a subscriber. Every subscriber has a
+bounded buffer that a thread of its own writes to its socket. When a
+subscriber falls behind and its buffer is full, either the oldest
+message in the buffer is dropped and the subscriber lags (the
+default), or the subscriber is disconnected. Use 'subscribe' to read
+the messages from another process::
+
+    for message in bus.subscribe('/run/yak_server/bus',
+                                 devices=['1-2'], types=['PatternEvent']):
+        print(message)
+"""
+
+import collections
+import datetime
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+
+import ezvalue
+
+
+_LOGGER = logging.getLogger(__name__)
+
+EVENT = 0
+COMMAND = 1
+
+LAG = 'lag'
+DISCONNECT = 'disconnect'
+
+# Length of a message, sent before it.
+MESSAGE_LENGTH = struct.Struct('<H')
+# Kind, POSIX timestamp and the lengths of the event type name, the
+# device and the detail, followed by those.
+MESSAGE_HEADER = struct.Struct('<BdBBB')
+
+
+class BusMessage(ezvalue.Value):
+    """An event or command as published on the bus."""
+
+    kind = 'EVENT or COMMAND.'
+    type_name = 'Name of the event class, like ButtonDownEvent.'
+    timestamp = 'The timestamp of the event.'
+    device = 'The device of the event, or an empty string.'
+    detail = 'The pattern name of a PatternEvent, or an empty string.'
+
+
+def encode_message(kind, event):
+    """Return the bus message for an event or command."""
+    type_name = type(event).__name__.encode('utf-8')
+    device = str(event.device or '').encode('utf-8')
+    detail = getattr(event, 'pattern', '').encode('utf-8')
+    body = b''.join([
+        MESSAGE_HEADER.pack(kind, event.timestamp.timestamp(),
+                            len(type_name), len(device), len(detail)),
+        type_name, device, detail])
+    return MESSAGE_LENGTH.pack(len(body)) + body
+
+
+def decode_message(body):
+    """Return the BusMessage of a message without its length."""
+    header = MESSAGE_HEADER.unpack_from(body)
+    kind, timestamp = header[:2]
+    offset = MESSAGE_HEADER.size
+    fields = []
+    for length in header[2:]:
+        fields.append(body[offset:offset + length].decode('utf-8'))
+        offset += length
+    type_name, device, detail = fields
+    return BusMessage(kind=kind, type_name=type_name,
+                      timestamp=datetime.datetime.fromtimestamp(timestamp),
+                      device=device, detail=detail)
+
+
+class _Subscriber:
+    """A connected subscriber with its filter and bounded buffer."""
+
+    def __init__(self, connection, devices, types, buffer_size, policy):
+        self.connection = connection
+        self.devices = devices
+        self.types = types
+        self.policy = policy
+        self.lagged = 0
+        self.closed = False
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._ready = threading.Condition()
+
+    def wants(self, event):
+        """Return True if the subscriber asked for an event."""
+        return ((self.devices is None or event.device in self.devices) and
+                (self.types is None or type(event).__name__ in self.types))
+
+    def offer(self, message):
+        """Buffer a message, return False if the subscriber must go."""
+        with self._ready:
+            if len(self._buffer) == self._buffer.maxlen:
+                if self.policy == DISCONNECT:
+                    return False
+                self.lagged += 1
+            self._buffer.append(message)
+            self._ready.notify()
+        return True
+
+    def close(self):
+        """Stop writing and close the connection."""
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+        try:
+            # Wake up a write blocked on a subscriber that reads nothing.
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def write_messages(self):
+        """Write buffered messages to the connection untill closed."""
+        try:
+            while True:
+                with self._ready:
+                    while not self._buffer and not self.closed:
+                        self._ready.wait()
+                    if self.closed:
+                        return
+                    messages = list(self._buffer)
+                    self._buffer.clear()
+                self.connection.sendall(b''.join(messages))
+        except OSError:
+            self.closed = True
+        finally:
+            self.connection.close()
+
+
+class EventBus:
+    """Broadcast events and commands over a UNIX domain socket.
+
+    Every subscriber buffers at most 'buffer_size' messages. 'policy'
+    is LAG or DISCONNECT and decides what happens to subscribers
+    whose buffer is full, see the module documentation.
+    """
+
+    def __init__(self, path, buffer_size=1024, policy=LAG):
+        """Create a bus listening on the socket at 'path'."""
+        self.path = path
+        self.buffer_size = buffer_size
+        self.policy = policy
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._socket = None
+
+    def start(self):
+        """Start accepting subscribers from a background thread."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.path)
+        self._socket.listen()
+        threading.Thread(target=self._accept, name='bus',
+                         daemon=True).start()
+
+    def close(self):
+        """Disconnect all subscribers and stop accepting new ones."""
+        self._socket.close()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscriber in subscribers:
+            subscriber.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def subscriber_count(self):
+        """Return the number of connected subscribers."""
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, kind, event):
+        """Publish a handled event or a sent command, without waiting."""
+        with self._lock:
+            subscribers = [subscriber for subscriber in self._subscribers
+                           if subscriber.wants(event)]
+        if not subscribers:
+            return
+        message = encode_message(kind, event)
+        for subscriber in subscribers:
+            if subscriber.closed or not subscriber.offer(message):
+                self._remove(subscriber)
+
+    def _remove(self, subscriber):
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.remove(subscriber)
+        subscriber.close()
+        _LOGGER.info('Dropped bus subscriber, %d messages lagged.',
+                     subscriber.lagged)
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(connection,),
+                             daemon=True).start()
+
+    def _serve(self, connection):
+        """Read the filter of a new subscriber and start writing to it."""
+        try:
+            request = json.loads(connection.makefile('rb').readline())
+        except (OSError, ValueError) as exception:
+            _LOGGER.warning('Invalid bus subscription: %s', exception)
+            connection.close()
+            return
+        subscriber = _Subscriber(connection,
+                                 _optional_set(request.get('devices')),
+                                 _optional_set(request.get('types')),
+                                 self.buffer_size, self.policy)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        subscriber.write_messages()
+        self._remove(subscriber)
+
+
+def _optional_set(values):
+    return None if values is None else frozenset(values)
+
+
+def subscribe(path, devices=None, types=None):
+    """Yield the BusMessages published on the bus at 'path'.
+
+    Only messages for the given devices and event type names are
+    sent, all of them if not given.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        request = {'devices': devices, 'types': types}
+        connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        reader = connection.makefile('rb')
+        while True:
+            header = reader.read(MESSAGE_LENGTH.size)
+            if len(header) < MESSAGE_LENGTH.size:
+                return
+            length, = MESSAGE_LENGTH.unpack(header)
+            yield decode_message(reader.read(length))
+
+
+def type_names(*event_types):
+    """Return the names to subscribe to the given event classes."""
+    return [event_type.__name__ for event_type in event_types]
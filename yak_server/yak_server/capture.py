@@ -0,0 +1,290 @@
+"""Record raw USB traffic and replay it.
+
+A capture file starts with a short header identifying the device
+class, followed by a sequence of records. Each record holds the time
+of the transfer, its direction and the raw data that was transferred.
+
+Recording and replay take their time from a clock, the default clock
+unless another one is given, so captures also replay in virtual time.
+"""
+
+import struct
+import threading
+
+import ezvalue
+
+from yak_server import clock
+from yak_server import interface
+from yak_server import translators
+from yak_server import usbdevice
+
+
+MAGIC = b'YAKCAP1\n'
+READ = 0
+WRITE = 1
+
+_HEADER = struct.Struct('<HHH')
+_RECORD = struct.Struct('<dBH')
+
+
+class CaptureError(Exception):
+    """The capture file is not valid."""
+
+
+class CaptureRecord(ezvalue.Value):
+    """A single transfer in a capture."""
+
+    timestamp = 'Time of the transfer in seconds since the epoch.'
+    direction = 'Either READ or WRITE.'
+    data = 'The raw data that was transferred.'
+
+
+class CaptureWriter:
+    """Write USB transfers to a capture file.
+
+    The writer is thread safe so reads and writes can be recorded from
+    different threads.
+    """
+
+    def __init__(self, file, device_class_id, capture_clock=None):
+        """Create a writer for an open binary file.
+
+        Transfers are timestamped with 'capture_clock', which defaults
+        to the default clock.
+        """
+        self._file = file
+        self._clock = capture_clock or clock.get_clock()
+        self._lock = threading.Lock()
+        self._write_header(device_class_id)
+
+    def record_read(self, data):
+        """Record data that was read from the device."""
+        self._record(READ, data)
+
+    def record_write(self, data):
+        """Record data that was written to the device."""
+        self._record(WRITE, data)
+
+    def close(self):
+        """Close the underlying file."""
+        with self._lock:
+            self._file.close()
+
+    def _record(self, direction, data):
+        header = _RECORD.pack(self._clock.now().timestamp(), direction,
+                              len(data))
+        with self._lock:
+            self._file.write(header + bytes(data))
+
+    def _write_header(self, device_class_id):
+        self._file.write(MAGIC + _HEADER.pack(device_class_id.vendor_id,
+                                              device_class_id.product_id,
+                                              device_class_id.release_number))
+
+
+class CaptureReader:
+    """Read USB transfers from a capture file."""
+
+    def __init__(self, file):
+        """Create a reader for an open binary file."""
+        self._file = file
+        self.class_identifier = self._read_header()
+
+    def close(self):
+        """Close the underlying file."""
+        self._file.close()
+
+    def __iter__(self):
+        """Return an iterator over the records in the capture."""
+        while True:
+            header = self._file.read(_RECORD.size)
+            if not header:
+                return
+            if len(header) != _RECORD.size:
+                raise CaptureError('Truncated record in capture file.')
+            timestamp, direction, length = _RECORD.unpack(header)
+            data = self._file.read(length)
+            if len(data) != length:
+                raise CaptureError('Truncated record in capture file.')
+            yield CaptureRecord(timestamp=timestamp, direction=direction,
+                                data=data)
+
+    def _read_header(self):
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise CaptureError('Not a capture file.')
+        header = self._file.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise CaptureError('Truncated capture file header.')
+        vendor_id, product_id, release_number = _HEADER.unpack(header)
+        return usbdevice.DeviceClassID(vendor_id=vendor_id,
+                                       product_id=product_id,
+                                       release_number=release_number)
+
+
+def open_writer(path, device_class_id):
+    """Return a CaptureWriter writing to a new file at 'path'."""
+    return CaptureWriter(open(path, 'wb'), device_class_id)
+
+
+def open_reader(path):
+    """Return a CaptureReader for the capture file at 'path'."""
+    return CaptureReader(open(path, 'rb'))
+
+
+def replay_interface(path, speed=1.0, replay_clock=None):
+    """Return a USBInterface that replays the capture file at 'path'.
+
+    The capture file is closed when the device of the interface is
+    closed.
+    """
+    device = ReplayDevice(open_reader(path), speed, identifier=path,
+                          replay_clock=replay_clock)
+    translator = translators.create_usb_translator(device)
+    return interface.USBInterface(device, translator)
+
+
+class ReplayDevice:
+    """A device that plays back the reads from a capture.
+
+    The device can be used in place of a USBDevice. Reads return the
+    captured data with the original timing scaled by 'speed', so a
+    speed of 2 replays twice as fast. If 'speed' is None the data is
+    returned as fast as it is read. Data written to the device is
+    collected with the time it was written, so throughput and the
+    latency from each read to the following write can be compared
+    between runs.
+
+    When all captured data has been read, further reads block untill
+    the device is closed. Closing the device also closes the reader.
+    All timing is done on 'replay_clock', which defaults to the
+    default clock.
+    """
+
+    max_packet_size = 8
+
+    def __init__(self, reader, speed=1.0, identifier='replay',
+                 replay_clock=None):
+        """Create a replay device from a CaptureReader."""
+        self.class_identifier = reader.class_identifier
+        self.identifier = identifier
+        self.writes = []
+        self.read_count = 0
+        self.finished = threading.Event()
+        self._reader = reader
+        self._records = (record for record in reader
+                         if record.direction == READ)
+        self._speed = speed
+        self._clock = replay_clock or clock.get_clock()
+        self._read_buffer = b''
+        self._closed = threading.Event()
+        self._first_timestamp = None
+        self._start_time = None
+        self._last_read_time = None
+        self._latencies = []
+
+    def __enter__(self):
+        """Return the device, it is closed when the context exits."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the device."""
+        self.close()
+
+    def connect(self):
+        """Start the replay clock."""
+        self._start_time = self._clock.monotonic()
+
+    def close(self):
+        """Stop the replay, unblock any pending read and close the reader."""
+        if not self._closed.is_set():
+            self._closed.set()
+            self._reader.close()
+
+    def device_info(self):
+        """Return a string containing device information."""
+        return '<ReplayDevice {} {}>'.format(self.identifier,
+                                             self.class_identifier)
+
+    @property
+    def written(self):
+        """Return the list of data written to the device."""
+        return [data for _, data in self.writes]
+
+    def elapsed(self):
+        """Return the seconds since the replay started."""
+        if self._start_time is None:
+            return 0.0
+        return self._clock.monotonic() - self._start_time
+
+    def read_rate(self):
+        """Return the number of reads per second since the start."""
+        return self._rate(self.read_count)
+
+    def write_rate(self):
+        """Return the number of writes per second since the start."""
+        return self._rate(len(self.writes))
+
+    def latencies(self):
+        """Return the seconds from each read to the write following it."""
+        return list(self._latencies)
+
+    def is_input(self):
+        """Return True, a replay device always has data to read."""
+        return True
+
+    def is_output(self):
+        """Return True, a replay device accepts writes."""
+        return True
+
+    def flush(self):
+        """Discard any partially read data."""
+        self._read_buffer = b''
+
+    def read(self, number_of_bytes):
+        """Read a number of bytes from the capture."""
+        while len(self._read_buffer) < number_of_bytes:
+            record = self._next_record()
+            if record is None:
+                self._closed.wait()
+                break
+            self._read_buffer += record.data
+        data = self._read_buffer[:number_of_bytes]
+        self._read_buffer = self._read_buffer[len(data):]
+        if data:
+            self.read_count += 1
+            self._last_read_time = self._clock.monotonic()
+        return data
+
+    def write(self, data):
+        """Collect the written data and return its length."""
+        now = self._clock.monotonic()
+        self.writes.append((now, bytes(data)))
+        if self._last_read_time is not None:
+            self._latencies.append(now - self._last_read_time)
+            self._last_read_time = None
+        return len(data)
+
+    def _rate(self, count):
+        elapsed = self.elapsed()
+        return count / elapsed if elapsed > 0 else 0.0
+
+    def _next_record(self):
+        try:
+            record = next(self._records)
+        except StopIteration:
+            self.finished.set()
+            return None
+        self._wait_for(record)
+        return record
+
+    def _wait_for(self, record):
+        if self._first_timestamp is None:
+            self._first_timestamp = record.timestamp
+        if self._start_time is None:
+            self._start_time = self._clock.monotonic()
+        if not self._speed:
+            return
+        offset = (record.timestamp - self._first_timestamp) / self._speed
+        delay = self._start_time + offset - self._clock.monotonic()
+        if delay > 0:
+            self._clock.wait(self._closed, delay)
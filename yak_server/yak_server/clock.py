@@ -0,0 +1,177 @@
+"""Clocks used for all time keeping in the server.
+
+Everything that needs the current time, waits or sleeps goes through
+a clock object, so that time can be replaced in tests and
+simulations. The 'SystemClock' uses real time. The 'VirtualClock'
+only moves when it is told to or when something waits on it, so
+hours of simulated traffic run in milliseconds of real time.
+
+The clock used by default is returned by 'get_clock' and can be
+replaced with 'set_clock'.
+"""
+
+import datetime
+import functools
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+
+class SystemClock:
+    """A clock following the real time."""
+
+    @staticmethod
+    def now():
+        """Return the current date and time."""
+        return datetime.datetime.now()
+
+    @staticmethod
+    def monotonic():
+        """Return a monotonic time in seconds."""
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(seconds):
+        """Wait for the given number of seconds."""
+        time.sleep(seconds)
+
+    @staticmethod
+    def get(source_queue, timeout=None):
+        """Get an item from a queue, waiting at most 'timeout' seconds.
+
+        Raise queue.Empty if no item arrived in time.
+        """
+        return source_queue.get(timeout=timeout)
+
+    @staticmethod
+    def wait(event, timeout=None):
+        """Wait untill 'event' is set, at most 'timeout' seconds.
+
+        Return True if the event is set.
+        """
+        return event.wait(timeout)
+
+
+class VirtualClock:
+    """A clock whose time only moves forward when asked to.
+
+    Every thread waiting on the clock, sleeping or waiting with a
+    timeout on a queue or an event, has a deadline in virtual time.
+    Once no waiter came or left and nothing arrived for 'settle'
+    seconds of real time, the clock moves to the earliest deadline
+    and wakes its waiter. So concurrent sleepers wake in the order of
+    their deadlines and time ends at the latest of them, not at the
+    sum of all sleeps, and a thread that is about to put an item in a
+    queue gets the chance to do so before a wait on it times out.
+    Waiting without a timeout blocks in real time, since only another
+    thread can end it.
+    """
+
+    def __init__(self, start=datetime.datetime(2000, 1, 1), settle=0.001):
+        """Create a clock that starts at the given date and time."""
+        self._start = start
+        self._settle = settle
+        self._elapsed = 0.0
+        self._condition = threading.Condition()
+        self._deadlines = []
+        self._order = itertools.count()
+
+    def now(self):
+        """Return the current virtual date and time."""
+        return self._start + datetime.timedelta(seconds=self.monotonic())
+
+    def monotonic(self):
+        """Return the number of virtual seconds since the start."""
+        with self._condition:
+            return self._elapsed
+
+    def advance(self, seconds):
+        """Move the clock forward by the given number of seconds."""
+        if seconds < 0:
+            raise ValueError('A clock can not go back in time.')
+        with self._condition:
+            self._elapsed += seconds
+            self._condition.notify_all()
+
+    def sleep(self, seconds):
+        """Wait untill the clock is 'seconds' further."""
+        self._wait(seconds, lambda: _NOTHING)
+
+    def get(self, source_queue, timeout=None):
+        """Get an item from a queue, waiting at most 'timeout' seconds.
+
+        Raise queue.Empty if no item arrived in time.
+        """
+        if timeout is None:
+            return source_queue.get()
+        item = self._wait(timeout, functools.partial(_poll_queue,
+                                                     source_queue))
+        if item is _NOTHING:
+            raise queue.Empty()
+        return item
+
+    def wait(self, event, timeout=None):
+        """Wait untill 'event' is set, at most 'timeout' seconds.
+
+        Return True if the event is set.
+        """
+        if timeout is None:
+            return event.wait()
+        self._wait(timeout, lambda: True if event.is_set() else _NOTHING)
+        return event.is_set()
+
+    def _wait(self, seconds, poll):
+        """Wait for a result of 'poll' or untill 'seconds' have passed.
+
+        Return the result, or _NOTHING if the deadline was reached.
+        """
+        with self._condition:
+            deadline = (self._elapsed + max(seconds, 0), next(self._order))
+            heapq.heappush(self._deadlines, deadline)
+            self._condition.notify_all()
+            try:
+                while True:
+                    result = poll()
+                    if result is not _NOTHING or (
+                            self._elapsed >= deadline[0]):
+                        return result
+                    if self._condition.wait(self._settle):
+                        continue
+                    if self._deadlines[0] != deadline:
+                        continue
+                    result = poll()
+                    if result is not _NOTHING:
+                        return result
+                    self._elapsed = deadline[0]
+            finally:
+                self._deadlines.remove(deadline)
+                heapq.heapify(self._deadlines)
+                self._condition.notify_all()
+
+
+# Returned by a poll of VirtualClock._wait that has no result yet.
+_NOTHING = object()
+
+
+def _poll_queue(source_queue):
+    try:
+        return source_queue.get_nowait()
+    except queue.Empty:
+        return _NOTHING
+
+
+_CLOCK = SystemClock()
+
+
+def get_clock():
+    """Return the default clock."""
+    return _CLOCK
+
+
+def set_clock(new_clock):
+    """Replace the default clock and return the previous one."""
+    global _CLOCK  # pylint: disable = global-statement
+    previous_clock, _CLOCK = _CLOCK, new_clock
+    return previous_clock
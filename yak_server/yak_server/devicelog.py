@@ -0,0 +1,185 @@
+"""Structured, lazily formatted log messages about devices.
+
+A 'DeviceLog' logs messages about one device through a standard
+logger. A message is a 'str.format' template with named fields. It is
+only formatted when a handler actually emits the record, and nothing
+at all is done when the level is disabled, so logging is close to
+free in the transfer path. The description of the device, which for
+pyusb devices is an expensive repr, is built once on first use.
+
+Errors are rate limited per device and message: after 'error_burst'
+messages in 'error_interval' seconds, further messages are counted
+instead of logged and the count is added to the next message that is
+logged.
+
+The template and fields travel with the log record, so besides the
+normal text output the 'JsonLinesHandler' and 'BinaryLogHandler'
+write them as structured records.
+"""
+
+import json
+import logging
+import struct
+
+from yak_server import clock
+
+
+class _Message:
+    """A message that is formatted when it is turned into a string."""
+
+    def __init__(self, template, fields, describe):
+        self.template = template
+        self.fields = fields
+        self._describe = describe
+
+    def __str__(self):
+        return self.template.format(device=self._describe(), **self.fields)
+
+
+class DeviceLog:
+    """Log messages about one device."""
+
+    def __init__(self, logger, describe, error_burst=5, error_interval=10.0,
+                 log_clock=None):
+        """Create a log for the device described by 'describe()'."""
+        self.logger = logger
+        self.error_burst = error_burst
+        self.error_interval = error_interval
+        self.clock = log_clock or clock.get_clock()
+        self._describe = describe
+        self._description = None
+        self._error_windows = {}
+
+    def description(self):
+        """Return the description of the device, built once."""
+        if self._description is None:
+            self._description = self._describe()
+        return self._description
+
+    def debug(self, template, **fields):
+        """Log a debug message."""
+        self._log(logging.DEBUG, template, fields)
+
+    def info(self, template, **fields):
+        """Log an info message."""
+        self._log(logging.INFO, template, fields)
+
+    def warning(self, template, **fields):
+        """Log a warning."""
+        self._log(logging.WARNING, template, fields)
+
+    def error(self, template, **fields):
+        """Log an error, unless too many of them were logged lately."""
+        if not self.logger.isEnabledFor(logging.ERROR):
+            return
+        suppressed = self._suppressed(template)
+        if suppressed is None:
+            return
+        if suppressed:
+            fields['suppressed'] = suppressed
+            template += ' ({suppressed} similar messages suppressed)'
+        self._log(logging.ERROR, template, fields)
+
+    def _log(self, level, template, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        message = _Message(template, fields, self.description)
+        self.logger.log(level, '%s', message,
+                        extra={'template': template, 'fields': fields,
+                               'device': self.description})
+
+    def _suppressed(self, template):
+        """Count an error, return None if it must not be logged.
+
+        Otherwise return the number of errors suppressed before it.
+        """
+        now = self.clock.monotonic()
+        start, count, suppressed = self._error_windows.get(
+            template, (now, 0, 0))
+        if now - start >= self.error_interval:
+            start, count = now, 0
+        if count >= self.error_burst:
+            self._error_windows[template] = (start, count, suppressed + 1)
+            return None
+        self._error_windows[template] = (start, count + 1, 0)
+        return suppressed
+
+
+def _structured(record):
+    """Return the template, fields and device of a record."""
+    template = getattr(record, 'template', None)
+    if template is None:
+        return record.getMessage(), {}, None
+    return template, record.fields, record.device()
+
+
+class JsonLinesHandler(logging.Handler):
+    """Write log records as one JSON object per line."""
+
+    def __init__(self, stream, level=logging.NOTSET):
+        """Write to the text stream 'stream'."""
+        super().__init__(level)
+        self.stream = stream
+
+    def emit(self, record):
+        """Write a record."""
+        try:
+            template, fields, device = _structured(record)
+            line = json.dumps({'time': record.created,
+                               'level': record.levelname,
+                               'logger': record.name,
+                               'template': template,
+                               'device': device,
+                               'fields': fields}, default=str)
+            self.stream.write(line + '\n')
+        except Exception:  # pylint: disable = broad-except
+            self.handleError(record)
+
+
+class BinaryLogHandler(logging.Handler):
+    """Write log records in a compact binary format.
+
+    The file starts with MAGIC. Every record is a header with the time,
+    level and the lengths of the template and of the JSON encoded
+    device and fields, followed by those. Read it back with
+    'read_binary_log'.
+    """
+
+    MAGIC = b'YAKLOG1\n'
+    HEADER = struct.Struct('<dBHH')
+
+    def __init__(self, stream, level=logging.NOTSET):
+        """Write to the binary stream 'stream'."""
+        super().__init__(level)
+        self.stream = stream
+        self.stream.write(self.MAGIC)
+
+    def emit(self, record):
+        """Write a record."""
+        try:
+            template, fields, device = _structured(record)
+            template = template.encode('utf-8')
+            payload = json.dumps([device, fields], default=str).encode(
+                'utf-8')
+            self.stream.write(self.HEADER.pack(
+                record.created, record.levelno, len(template), len(payload)))
+            self.stream.write(template + payload)
+        except Exception:  # pylint: disable = broad-except
+            self.handleError(record)
+
+
+def read_binary_log(stream):
+    """Yield (time, level, template, device, fields) from a binary log."""
+    magic = stream.read(len(BinaryLogHandler.MAGIC))
+    if magic != BinaryLogHandler.MAGIC:
+        raise ValueError('Not a binary log.')
+    header = BinaryLogHandler.HEADER
+    while True:
+        data = stream.read(header.size)
+        if len(data) < header.size:
+            return
+        created, level, template_length, payload_length = header.unpack(data)
+        template = stream.read(template_length).decode('utf-8')
+        device, fields = json.loads(stream.read(payload_length).decode(
+            'utf-8'))
+        yield created, level, template, device, fields
@@ -1,26 +1,32 @@
 """Define the event classes."""
 
-import datetime
-
 import ezvalue
 
+from yak_server import clock
+
 
 class Event(ezvalue.Value):
     """Baseclass for all events."""
 
     timestamp = 'The time the event was created.'
+    device = 'Identifier of the device the event came from or is for.'
 
     def __init__(self, *args, **kwargs):
         """Initialize the event.
 
         All fields are required except for timestamp, which will be
-        filled with the current time if omitted.
+        filled with the current time of the default clock if omitted,
+        and device, which defaults to None.
         """
-        try:
-            super().__init__(*args, **kwargs)
-        except AttributeError:
-            timestamp = datetime.datetime.now()
-            super().__init__(*args, timestamp=timestamp, **kwargs)
+        if not args:
+            kwargs.setdefault('device', None)
+            if 'timestamp' not in kwargs:
+                kwargs['timestamp'] = clock.get_clock().now()
+        super().__init__(*args, **kwargs)
+
+    def from_device(self, device):
+        """Return a copy of the event marked as coming from 'device'."""
+        return type(self)(self, device=device)
 
 
 class ButtonDownEvent(Event):
@@ -33,3 +39,9 @@ class ButtonUpEvent(Event):
 
 LampOnEvent = ButtonDownEvent
 LampOffEvent = ButtonUpEvent
+
+
+class PatternEvent(Event):
+    """Emitted when a sequence of events matched a pattern."""
+
+    pattern = 'Name of the pattern that matched.'
@@ -0,0 +1,550 @@
+"""Connect switch nodes on other machines to the server over the network.
+
+A node is a small machine running yak_server with its own USB devices.
+It forwards the events of its inputs to the server and applies the
+commands the server sends back to its outputs. On the server, the
+'GatewayInterface' is one input interface for the devices of all
+nodes. Remote devices are named 'node/device'.
+
+Events and commands travel in frames: the name of the node followed
+by any number of encoded events, see 'encode_frame'. A node batches
+the events that arrive close together into one frame. Over TCP every
+frame is preceded by its length. Nodes may also send events as UDP
+datagrams of one frame each to the same port, but commands only go
+back over TCP.
+
+Every node keeps one connection to the server open and reuses it for
+all its frames, and the server keeps the connection of every node in
+a pool, which it reuses for all commands to that node.
+
+'LoopbackNode' stands in for a node connected over the network, for
+tests and for running a node in the same process. Run a node with::
+
+    python -m yak_server.gateway NODE HOST:PORT
+"""
+
+import argparse
+import asyncio
+import datetime
+import logging
+import queue
+import socket
+import struct
+import threading
+
+from yak_server import clock
+from yak_server import events
+from yak_server import interface
+
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5900
+VERSION = 1
+
+# Frame header: version and length of the node name, followed by the
+# node name and the number of events.
+FRAME_HEADER = struct.Struct('<BB')
+EVENT_COUNT = struct.Struct('<H')
+# Event: type code, POSIX timestamp and length of the device name,
+# followed by the device name.
+EVENT_HEADER = struct.Struct('<BdB')
+# Length of a frame sent over TCP.
+FRAME_LENGTH = struct.Struct('<I')
+
+_EVENT_CODES = {events.ButtonUpEvent: 0, events.ButtonDownEvent: 1}
+_EVENT_TYPES = {code: event_type
+                for event_type, code in _EVENT_CODES.items()}
+
+
+class GatewayError(Exception):
+    """A frame could not be encoded or decoded."""
+
+
+def remote_name(node, device):
+    """Return the name of a device of a node on the server."""
+    return '{}/{}'.format(node, device)
+
+
+def split_remote_name(name):
+    """Return the node and device of a remote device name.
+
+    The node is None for names that are not remote.
+    """
+    node, separator, device = (name or '').partition('/')
+    if not separator:
+        return None, name
+    return node, device
+
+
+def encode_frame(node, event_list):
+    """Return the frame with the given events from or for 'node'."""
+    try:
+        node_name = node.encode('utf-8')
+        parts = [FRAME_HEADER.pack(VERSION, len(node_name)), node_name,
+                 EVENT_COUNT.pack(len(event_list))]
+        for event in event_list:
+            device = (event.device or '').encode('utf-8')
+            parts.append(EVENT_HEADER.pack(_EVENT_CODES[type(event)],
+                                           event.timestamp.timestamp(),
+                                           len(device)))
+            parts.append(device)
+    except (KeyError, struct.error) as exception:
+        raise GatewayError('Cannot encode {!r}: {}'.format(
+            event_list, exception)) from exception
+    return b''.join(parts)
+
+
+def decode_frame(data):
+    """Return the node and the list of events of a frame."""
+    try:
+        version, node_length = FRAME_HEADER.unpack_from(data)
+        if version != VERSION:
+            raise GatewayError('Unknown frame version {}.'.format(version))
+        offset = FRAME_HEADER.size
+        node = data[offset:offset + node_length].decode('utf-8')
+        offset += node_length
+        count, = EVENT_COUNT.unpack_from(data, offset)
+        offset += EVENT_COUNT.size
+        event_list = []
+        for _ in range(count):
+            code, timestamp, device_length = EVENT_HEADER.unpack_from(
+                data, offset)
+            offset += EVENT_HEADER.size
+            device = data[offset:offset + device_length].decode('utf-8')
+            offset += device_length
+            event_list.append(_EVENT_TYPES[code](
+                timestamp=datetime.datetime.fromtimestamp(timestamp),
+                device=device or None))
+    except (KeyError, struct.error, UnicodeDecodeError) as exception:
+        raise GatewayError('Invalid frame: {}'.format(
+            exception)) from exception
+    return node, event_list
+
+
+class GatewayInterface(interface.Interface):
+    """One input interface for the devices of all remote nodes.
+
+    'get_event' returns the events of all nodes, with the remote name
+    of their device. Commands for a remote device are sent to its node,
+    the commands for one node in one frame.
+    """
+
+    name = 'gateway'
+
+    def __init__(self, host='0.0.0.0', port=DEFAULT_PORT):
+        """Create a gateway listening on 'host' and 'port'.
+
+        Port 0 picks a free port, see 'address' after 'initialize'.
+        """
+        self.host = host
+        self.port = port
+        self.address = None
+        self._events = queue.Queue()
+        self._pool = {}
+        self._pool_lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._started = threading.Event()
+        self._start_error = None
+
+    def initialize(self):
+        """Start serving nodes from a background thread."""
+        thread = threading.Thread(target=self._run, name='gateway',
+                                  daemon=True)
+        thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    def close(self):
+        """Stop serving nodes."""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._stop(),
+                                             self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def nodes(self):
+        """Return the names of the connected nodes."""
+        with self._pool_lock:
+            return sorted(self._pool)
+
+    def owns(self, device):
+        """Return True if 'device' is the name of a remote device."""
+        return split_remote_name(device)[0] is not None
+
+    def get_event(self):
+        """Return the next event of any node."""
+        return self._events.get()
+
+    def send_command(self, command):
+        """Send a command to the node of its device."""
+        self.send_commands([command])
+
+    def send_commands(self, commands):
+        """Send commands to the nodes of their devices, a frame per node.
+
+        Commands for nodes that are not connected are dropped.
+        """
+        by_node = {}
+        for command in commands:
+            node, device = split_remote_name(command.device)
+            by_node.setdefault(node, []).append(
+                type(command)(command, device=device))
+        for node, node_commands in by_node.items():
+            with self._pool_lock:
+                send = self._pool.get(node)
+            if send is None:
+                _LOGGER.warning('Dropped %d commands for node %s, it is '
+                                'not connected.', len(node_commands), node)
+                continue
+            send(encode_frame(node, node_commands))
+
+    def attach(self, node, send):
+        """Send the frames for 'node' with 'send(frame)' from now on."""
+        with self._pool_lock:
+            self._pool[node] = send
+        _LOGGER.info('Node %s connected.', node)
+
+    def detach(self, node, send):
+        """Forget the connection of a node, unless it was replaced."""
+        with self._pool_lock:
+            if self._pool.get(node) != send:
+                return
+            del self._pool[node]
+        _LOGGER.info('Node %s disconnected.', node)
+
+    def receive(self, frame):
+        """Queue the events of a frame from a node, return the node."""
+        node, event_list = decode_frame(frame)
+        for event in event_list:
+            self._events.put(event.from_device(
+                remote_name(node, event.device)))
+        return node
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._start())
+        except OSError as exception:
+            self._start_error = exception
+            self._started.set()
+            return
+        self._started.set()
+        self._loop.run_forever()
+
+    async def _start(self):
+        self._server = await asyncio.start_server(self._serve, self.host,
+                                                  self.port)
+        self.address = self._server.sockets[0].getsockname()[:2]
+        await self._loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self),
+            local_addr=(self.host, self.address[1]))
+
+    async def _stop(self):
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks()
+                 if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _serve(self, reader, writer):
+        """Receive the frames of one node connection."""
+        node = None
+        outgoing = asyncio.Queue()
+        writing = asyncio.ensure_future(self._write_frames(writer, outgoing))
+
+        def send(frame):
+            self._loop.call_soon_threadsafe(outgoing.put_nowait, frame)
+
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_LENGTH.size)
+                length, = FRAME_LENGTH.unpack(header)
+                frame = await reader.readexactly(length)
+                frame_node = self.receive(frame)
+                if frame_node != node:
+                    node = frame_node
+                    self.attach(node, send)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except GatewayError as exception:
+            _LOGGER.error('Closing connection of node %s: %s', node,
+                          exception)
+        finally:
+            if node is not None:
+                self.detach(node, send)
+            writing.cancel()
+            writer.close()
+
+    @staticmethod
+    async def _write_frames(writer, outgoing):
+        """Write the queued frames, waiting while the node lags behind."""
+        try:
+            while True:
+                frame = await outgoing.get()
+                writer.write(FRAME_LENGTH.pack(len(frame)) + frame)
+                await writer.drain()
+        except ConnectionError as exception:
+            _LOGGER.info('Sending commands failed: %s', exception)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    """Receive frames sent as UDP datagrams."""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def datagram_received(self, data, addr):
+        try:
+            self.gateway.receive(data)
+        except GatewayError as exception:
+            _LOGGER.error('Invalid datagram from %s: %s', addr, exception)
+
+
+class GatewayNode:
+    """The connection of a node to the server.
+
+    Events given to 'forward' are batched: the events that arrive
+    within 'batch_interval' seconds, up to 'max_batch' of them, are
+    sent in one frame. Commands from the server are passed to
+    'on_command(command)' from a background thread.
+
+    A lost connection is opened again, waiting longer after every
+    failed attempt, from 'initial_delay' up to 'max_delay' seconds.
+    Events forwarded meanwhile are sent once it is back.
+    """
+
+    def __init__(self, node, address, on_command=None, max_batch=64,
+                 batch_interval=0.002, initial_delay=0.1, max_delay=30.0,
+                 node_clock=None):
+        """Create the connection of 'node' to the server at 'address'."""
+        self.node = node
+        self.address = address
+        self.on_command = on_command or (lambda command: None)
+        self.max_batch = max_batch
+        self.batch_interval = batch_interval
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.clock = node_clock or clock.get_clock()
+        self._socket = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._outgoing = queue.Queue()
+
+    def connect(self):
+        """Connect to the server and start sending and receiving."""
+        self._socket = self._open()
+        for target in (self._send_batches, self._receive_commands):
+            threading.Thread(target=target, daemon=True).start()
+
+    def close(self):
+        """Close the connection."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            connection = self._socket
+        self._outgoing.put(None)
+        connection.close()
+
+    def forward(self, event):
+        """Send an event to the server, batched with the events after it."""
+        self._outgoing.put(event)
+
+    def _open(self):
+        connection = socket.create_connection(self.address)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Announce the node, so commands can be sent before any event.
+        self._send_frame(connection, encode_frame(self.node, []))
+        return connection
+
+    def _send_batches(self):
+        while True:
+            batch = [self._outgoing.get()]
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(self._outgoing.get(
+                        timeout=self.batch_interval))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                return
+            frame = encode_frame(self.node, batch)
+            with self._condition:
+                connection = self._socket
+            while connection is not None:
+                try:
+                    self._send_frame(connection, frame)
+                    break
+                except OSError as exception:
+                    _LOGGER.info('Sending %d events failed: %s',
+                                 len(batch), exception)
+                    connection = self._wait_for_reconnect(connection)
+
+    @staticmethod
+    def _send_frame(connection, frame):
+        connection.sendall(FRAME_LENGTH.pack(len(frame)) + frame)
+
+    def _wait_for_reconnect(self, connection):
+        """Return the connection replacing 'connection', None once closed."""
+        try:
+            # Make the receiving thread notice and reconnect.
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._closed or self._socket is not connection)
+            return None if self._closed else self._socket
+
+    def _receive_commands(self):
+        with self._condition:
+            connection = self._socket
+        while connection is not None:
+            self._read_commands(connection)
+            connection.close()
+            connection = self._reconnect()
+
+    def _read_commands(self, connection):
+        reader = connection.makefile('rb')
+        try:
+            while True:
+                header = reader.read(FRAME_LENGTH.size)
+                if len(header) < FRAME_LENGTH.size:
+                    return
+                length, = FRAME_LENGTH.unpack(header)
+                _, commands = decode_frame(reader.read(length))
+                for command in commands:
+                    self.on_command(command)
+        except (OSError, ValueError, GatewayError) as exception:
+            _LOGGER.info('Stopped receiving commands: %s', exception)
+
+    def _reconnect(self):
+        """Connect again untill it works, return None once closed."""
+        delay = self.initial_delay
+        while True:
+            with self._condition:
+                if self._closed:
+                    return None
+            if delay == self.initial_delay:
+                _LOGGER.warning('Connection of node %s lost, reconnecting.',
+                                self.node)
+            self.clock.sleep(delay)
+            try:
+                connection = self._open()
+            except OSError as exception:
+                _LOGGER.info('Reconnecting node %s failed: %s', self.node,
+                             exception)
+                delay = min(delay * 2, self.max_delay)
+                continue
+            with self._condition:
+                if self._closed:
+                    connection.close()
+                    return None
+                self._socket = connection
+                self._condition.notify_all()
+            _LOGGER.info('Node %s reconnected.', self.node)
+            return connection
+
+
+class LoopbackNode:
+    """A node connected to a gateway in the same process.
+
+    Frames are encoded and decoded like on the network, but handed to
+    the gateway directly. The commands the node receives are kept in
+    'commands' and passed to 'on_command(command)', 'frame_count'
+    counts the frames they came in.
+    """
+
+    def __init__(self, node, gateway, on_command=None):
+        """Connect 'node' to 'gateway'."""
+        self.node = node
+        self.gateway = gateway
+        self.on_command = on_command or (lambda command: None)
+        self.commands = []
+        self.frame_count = 0
+        gateway.attach(node, self._receive)
+
+    def close(self):
+        """Disconnect the node."""
+        self.gateway.detach(self.node, self._receive)
+
+    def forward(self, event):
+        """Send an event to the gateway."""
+        self.forward_all([event])
+
+    def forward_all(self, event_list):
+        """Send events to the gateway in one frame."""
+        self.gateway.receive(encode_frame(self.node, event_list))
+
+    def _receive(self, frame):
+        _, commands = decode_frame(frame)
+        self.frame_count += 1
+        for command in commands:
+            self.commands.append(command)
+            self.on_command(command)
+
+
+def run_node(node, address, device_backend=None):
+    """Serve the local devices of a node from the server at 'address'.
+
+    Devices are found as by the server, see 'interface.InterfaceManager'.
+    The server drives the outputs of the node by name. A command for
+    an input goes to the output it is paired with, inputs and outputs
+    are paired in order like on the server.
+    """
+    manager = interface.InterfaceManager(device_backend)
+    inputs = manager.input_interfaces()
+    output_list = manager.output_interfaces()
+    outputs = {output.name: output for output in output_list}
+    if output_list:
+        outputs.update(
+            (input_interface.name, output_list[index % len(output_list)])
+            for index, input_interface in enumerate(inputs))
+
+    def apply_command(command):
+        output = outputs.get(command.device)
+        if output is None:
+            _LOGGER.warning('Node %s has no output %s.', node, command.device)
+            return
+        output.send_command(command)
+
+    connection = GatewayNode(node, address, on_command=apply_command)
+    connection.connect()
+
+    def forward_events(input_interface):
+        while True:
+            event = input_interface.get_event()
+            if event:
+                connection.forward(event.from_device(input_interface.name))
+
+    def start_forwarding(ready_interface):
+        if ready_interface in inputs:
+            threading.Thread(target=forward_events, args=(ready_interface,),
+                             daemon=True).start()
+
+    interface.initialize_all(inputs + output_list, start_forwarding)
+    return connection
+
+
+def _parse_address(text):
+    host, separator, port = text.rpartition(':')
+    if not separator:
+        return text, DEFAULT_PORT
+    return host, int(port)
+
+
+def main():
+    """Run a node."""
+    parser = argparse.ArgumentParser(description='Run a yak_server node.')
+    parser.add_argument('node', help='Name of this node.')
+    parser.add_argument('server', type=_parse_address,
+                        help='HOST:PORT of the server gateway.')
+    arguments = parser.parse_args()
+    run_node(arguments.node, arguments.server)
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
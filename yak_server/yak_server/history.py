@@ -0,0 +1,100 @@
+"""Record the history of handled events and sent commands.
+
+A history is a file of fixed size records, see RECORD, so it can be
+loaded in columns without parsing, see 'analytics'. Devices are
+stored as numbers; their names are kept in a device file next to the
+history, one name per line, the line number being the device number.
+"""
+
+import logging
+import struct
+
+from yak_server import events
+
+
+_LOGGER = logging.getLogger(__name__)
+
+# POSIX time in nanoseconds, device number, type code and kind, which
+# is bus.EVENT or bus.COMMAND.
+RECORD = struct.Struct('<qHBB')
+
+DOWN = 0
+UP = 1
+PATTERN = 2
+OTHER = 255
+
+_TYPE_CODES = {events.ButtonDownEvent: DOWN, events.ButtonUpEvent: UP,
+               events.PatternEvent: PATTERN}
+
+
+def devices_path(path):
+    """Return the path of the device file of the history at 'path'."""
+    return path + '.devices'
+
+
+def type_code(event):
+    """Return the type code of an event or command."""
+    return _TYPE_CODES.get(type(event), OTHER)
+
+
+def timestamp_ns(timestamp):
+    """Return the POSIX time of a datetime in nanoseconds."""
+    return round(timestamp.timestamp() * 1e6) * 1000
+
+
+def read_devices(path):
+    """Return the device names of the history at 'path'."""
+    try:
+        with open(devices_path(path), encoding='utf-8') as devices_file:
+            return devices_file.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+def read_records(path):
+    """Return the records of the history at 'path' as tuples."""
+    with open(path, 'rb') as history_file:
+        data = history_file.read()
+    end = len(data) - len(data) % RECORD.size
+    return list(RECORD.iter_unpack(data[:end]))
+
+
+class HistoryRecorder:
+    """Append events and commands to the history at 'path'.
+
+    Pass the recorder to the Application as 'history'. Every record
+    is written with a single unbuffered write, so a history is never
+    left with a partial record in the middle.
+    """
+
+    def __init__(self, path):
+        """Append to the history at 'path', creating it if needed."""
+        self.path = path
+        self._devices = {name: number for number, name
+                         in enumerate(read_devices(path))}
+        self._file = open(path, 'ab', buffering=0)
+        self._devices_file = open(devices_path(path), 'a', encoding='utf-8')
+
+    def close(self):
+        """Close the history."""
+        self._file.close()
+        self._devices_file.close()
+
+    def record(self, kind, event):
+        """Append an event or command, bus.EVENT or bus.COMMAND."""
+        if event.device is None:
+            return
+        try:
+            self._file.write(RECORD.pack(
+                timestamp_ns(event.timestamp), self._device(event.device),
+                type_code(event), kind))
+        except (OSError, struct.error):
+            _LOGGER.exception('Recording history in %s failed.', self.path)
+
+    def _device(self, name):
+        number = self._devices.get(name)
+        if number is None:
+            number = self._devices[name] = len(self._devices)
+            self._devices_file.write(str(name) + '\n')
+            self._devices_file.flush()
+        return number
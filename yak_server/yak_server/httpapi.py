@@ -0,0 +1,292 @@
+"""A local HTTP/JSON API to query the server and send commands.
+
+The API is served by an asyncio server in a background thread. It
+speaks just enough HTTP/1.1 for scripts: connections are kept alive
+and pipelined requests are answered in order, so a client that sends
+many requests over one connection pays no connection setup per
+request. The endpoints are:
+
+GET /interfaces
+    The names of the input and output interfaces.
+GET /state
+    The state of every device, as {"device": on}.
+GET /state/DEVICE
+    The state of one device, as {"device": DEVICE, "on": on}.
+POST /commands
+    Send one command {"device": DEVICE, "on": true} or a list of them
+    in one request. DEVICE is the name of an output and "on" true or
+    false, none of the commands is sent otherwise. The commands are
+    sent from the main loop of the application, like the commands for
+    handled events, see 'Application.submit_commands'.
+
+Errors are answered with a JSON object with an "error" message.
+Other protocols can take over a connection with an Upgrade header,
+see 'HttpApi.upgrade'.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import urllib.parse
+
+from yak_server import events
+
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8080
+
+_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request',
+            404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    """A request that is answered with an error status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    """A parsed HTTP request."""
+
+    def __init__(self, method, path, version, headers, body=b''):
+        """Create a request, header names are lower case."""
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def keep_alive(self):
+        """Return True if the connection stays open after the request."""
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def json(self):
+        """Return the decoded JSON body."""
+        try:
+            return json.loads(self.body)
+        except ValueError as exception:
+            raise HttpError(400, 'Invalid JSON: {}'.format(
+                exception)) from exception
+
+
+async def read_request(reader, max_body_size):
+    """Read a request from a stream, return None at the end of it."""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, path, version = lines[0].split(' ')
+    except ValueError as exception:
+        raise HttpError(400, 'Invalid request line.') from exception
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError as exception:
+        raise HttpError(400, 'Invalid Content-Length.') from exception
+    if length > max_body_size:
+        raise HttpError(413, 'Body larger than {} bytes.'.format(
+            max_body_size))
+    body = await reader.readexactly(length) if length else b''
+    return Request(method, path, version, headers, body)
+
+
+def encode_response(status, payload, keep_alive=True):
+    """Return an HTTP response with a JSON payload."""
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    head = ('HTTP/1.1 {} {}\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {}\r\n'
+            '{}\r\n').format(status, _REASONS[status], len(body),
+                             '' if keep_alive else 'Connection: close\r\n')
+    return head.encode('latin-1') + body
+
+
+def command_from_json(data):
+    """Return the command for {"device": DEVICE, "on": on}."""
+    try:
+        device = data['device']
+        on = data['on']
+    except (KeyError, TypeError) as exception:
+        message = 'A command needs "device" and "on".'
+        raise HttpError(400, message) from exception
+    if not isinstance(device, str) or not isinstance(on, bool):
+        raise HttpError(400, '"device" must be a name and "on" true or '
+                        'false.')
+    command_type = events.LampOnEvent if on else events.LampOffEvent
+    return command_type(device=device)
+
+
+class HttpApi:
+    """Serve the HTTP API of an application.
+
+    Other endpoints can be added with 'route', the handler is called
+    with the Request and returns a (status, payload) pair.
+    """
+
+    def __init__(self, application, host='127.0.0.1', port=DEFAULT_PORT,
+                 max_body_size=1 << 20):
+        """Serve 'application' on 'host' and 'port', 0 for a free port."""
+        self.application = application
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self.address = None
+        self.loop = None
+        self._server = None
+        self._routes = {}
+        self._upgrades = {}
+        self._started = threading.Event()
+        self._start_error = None
+        self.route('GET', '/interfaces', self._interfaces)
+        self.route('GET', '/state', self._states)
+        self.route('GET', '/state/', self._state)
+        self.route('POST', '/commands', self._commands)
+
+    def route(self, method, path, handler):
+        """Handle requests for 'path', or below it if it ends in '/'."""
+        self._routes[method, path] = handler
+
+    def upgrade(self, path, handler):
+        """Hand connections upgraded at 'path' to a coroutine function.
+
+        The handler is called with the Request and the reader and
+        writer of the connection, answers the request itself and
+        serves the connection untill it returns.
+        """
+        self._upgrades[path] = handler
+
+    def start(self):
+        """Start serving from a background thread."""
+        threading.Thread(target=self._run, name='http', daemon=True).start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    def close(self):
+        """Stop serving."""
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def handle(self, request):
+        """Return the (status, payload) of a request."""
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            prefixes = [path for method, path in self._routes
+                        if method == request.method and path.endswith('/')
+                        and request.path.startswith(path)]
+            if prefixes:
+                handler = self._routes[request.method, max(prefixes, key=len)]
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                raise HttpError(405, 'Method not allowed.')
+            raise HttpError(404, 'No such endpoint.')
+        return handler(request)
+
+    def _interfaces(self, request):
+        # pylint: disable = unused-argument
+        application = self.application
+        return 200, {
+            'inputs': [item.name for item in application.input_interfaces],
+            'outputs': [item.name
+                        for item in application.output_interfaces]}
+
+    def _states(self, request):
+        # pylint: disable = unused-argument
+        return 200, dict(self.application.device_states)
+
+    def _state(self, request):
+        device = urllib.parse.unquote(request.path[len('/state/'):])
+        try:
+            on = self.application.device_states[device]
+        except KeyError as exception:
+            raise HttpError(404, 'No state for {}.'.format(
+                device)) from exception
+        return 200, {'device': device, 'on': on}
+
+    def _commands(self, request):
+        data = request.json()
+        if isinstance(data, list):
+            commands = [command_from_json(item) for item in data]
+        else:
+            commands = [command_from_json(data)]
+        for command in commands:
+            if not self.application.has_output(command.device):
+                raise HttpError(404, 'No output {}.'.format(command.device))
+        self.application.submit_commands(commands)
+        return 202, {'accepted': len(commands)}
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self._server = self.loop.run_until_complete(asyncio.start_server(
+                self._serve, self.host, self.port))
+        except OSError as exception:
+            self._start_error = exception
+            self._started.set()
+            return
+        self.address = self._server.sockets[0].getsockname()[:2]
+        self._started.set()
+        self.loop.run_forever()
+
+    async def _stop(self):
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks()
+                 if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _respond(self, request):
+        try:
+            return self.handle(request)
+        except HttpError as exception:
+            return exception.status, {'error': str(exception)}
+        except Exception:  # pylint: disable = broad-except
+            _LOGGER.exception('Handling %s %s failed.', request.method,
+                              request.path)
+            return 500, {'error': 'Internal error.'}
+
+    async def _serve(self, reader, writer):
+        """Answer the requests of one connection in order."""
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body_size)
+                except HttpError as exception:
+                    # The stream can not be parsed any further.
+                    keep_alive = False
+                    status, payload = exception.status, {
+                        'error': str(exception)}
+                else:
+                    if request is None:
+                        break
+                    upgrade = self._upgrades.get(request.path)
+                    if upgrade is not None and 'upgrade' in request.headers:
+                        await upgrade(request, reader, writer)
+                        break
+                    keep_alive = request.keep_alive()
+                    status, payload = self._respond(request)
+                writer.write(encode_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
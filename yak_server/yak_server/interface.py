@@ -1,9 +1,17 @@
 """Devices various interfaces that are connected to the server."""
 
+import concurrent.futures
+import functools
+import logging
+
+from yak_server import supervisor
 from yak_server import usbdevice
 from yak_server import translators
 
 
+_LOGGER = logging.getLogger(__name__)
+
+
 class Interface:
     """Abstract interface class.
 
@@ -14,9 +22,18 @@ class Interface:
     'send_command'.
     """
 
+    name = None
+
     def initialize(self):
         """Initialize the interface so it is ready to use."""
 
+    def initialize_later(self):
+        """Keep initializing in the background after 'initialize' failed.
+
+        Return True if the interface does, by default it does not.
+        """
+        return False
+
     def get_event(self):
         """Return the next event from the interface.
 
@@ -31,6 +48,22 @@ class Interface:
         """
         raise NotImplementedError()
 
+    def sync_state(self):
+        """Return an event for the current state, None if it is unknown.
+
+        Subclasses that can ask their device should overwrite this.
+        """
+        return None
+
+    def send_commands(self, commands):
+        """Send a list of commands to the interface, in order.
+
+        Subclasses that can send several commands at once should
+        overwrite this.
+        """
+        for command in commands:
+            self.send_command(command)
+
 
 class USBInterface(Interface):
     """An interface that is connected to a USB device."""
@@ -40,21 +73,65 @@ class USBInterface(Interface):
         self._usb_device = usb_device
         self.translator = translator
 
+    @property
+    def name(self):
+        """Return the identifier of the underlying device."""
+        return self._usb_device.identifier
+
     def initialize(self):
         """Initialize the interface so it is ready to use."""
         self._usb_device.connect()
 
+    def initialize_later(self):
+        """Let the supervisor of the device keep trying to connect.
+
+        The device is a 'supervisor.SupervisedDevice', as made by the
+        InterfaceManager.
+        """
+        self._usb_device.connect_later()
+        return True
+
     def get_event(self):
-        """Return the next event from the interface."""
+        """Return the next event from the interface.
+
+        Return None if the device returned no data, for example when a
+        read timed out.
+        """
         data = self._read_data_from_device()
-        event = self.translator.raw_data_to_event(data)
-        return event
+        if not data:
+            return None
+        return self.translator.raw_data_to_event(data)
 
     def send_command(self, command):
         """Send a command to the interface."""
         data = self.translator.event_to_raw_data(command)
         self._write_data_to_device(data)
 
+    def sync_state(self):
+        """Return an event for the current state of the device.
+
+        The device is asked for its state instead of waiting untill it
+        changes, see 'usbdevice.USBDevice.query_state'. Return None if
+        it cannot tell, like firmware from before the GET_STATE request
+        or a device that is gone.
+        """
+        maximum_data_length = self.translator.maximum_data_length()
+        try:
+            data = self._usb_device.query_state(maximum_data_length)
+        except usbdevice.USBError as exception:
+            _LOGGER.debug('Could not sync the state of %s: %s', self.name,
+                          exception)
+            return None
+        return self.translator.raw_data_to_event(data)
+
+    def send_commands(self, commands):
+        """Send a list of commands, packed in as few transfers as possible."""
+        max_packet_size = self._usb_device.max_packet_size
+        packets = self.translator.events_to_raw_packets(commands,
+                                                        max_packet_size)
+        for data in packets:
+            self._write_data_to_device(data)
+
     def _read_data_from_device(self):
         maximum_data_length = self.translator.maximum_data_length()
         return self._usb_device.read(maximum_data_length)
@@ -64,20 +141,116 @@ class USBInterface(Interface):
 
 
 class InterfaceManager:
-    """Manages the various interfaces of the server."""
+    """Manages the various interfaces of the server.
+
+    Devices are looked up with the 'find' function of the device
+    backend, which is the 'usbdevice' module unless another backend,
+    for example a 'virtual.VirtualFleet', is given. Every device is
+    kept connected by a 'supervisor.SupervisedDevice', which finds
+    the device again through the backend after it was lost.
+
+    If a 'manifest.Manifest' is given, translators are taken from it
+    before they are looked up, and the translators looked up are
+    recorded in it.
+
+    'listener' is passed to the supervisor of every device, see
+    'supervisor.SupervisedDevice'.
+    """
+
+    INPUT_SEARCH = {'vendor_id': 0x04d8, 'product_id': 0x5900}
+    OUTPUT_SEARCH = {'vendor_id': 0x04d8, 'product_id': 0x5901}
+
+    def __init__(self, device_backend=None, manifest=None, listener=None):
+        """Create a manager finding devices through 'device_backend'."""
+        self._device_backend = device_backend or usbdevice
+        self._manifest = manifest
+        self._listener = listener
+        self.devices = []
 
-    @classmethod
-    def input_interfaces(cls):
+    def input_interfaces(self):
         """Return an iterable of all input devices."""
-        devices = usbdevice.find(vendor_id=0x04d8, product_id=0x5900)
-        return [cls._make_interface(device) for device in devices]
+        return self._make_interfaces(self.INPUT_SEARCH)
 
-    @classmethod
-    def output_interfaces(cls):
+    def output_interfaces(self):
         """Return an iterable of all output devices."""
-        devices = usbdevice.find(vendor_id=0x04d8, product_id=0x5901)
-        return [cls._make_interface(device) for device in devices]
+        return self._make_interfaces(self.OUTPUT_SEARCH)
+
+    def _make_interfaces(self, search_parameters):
+        devices = self._device_backend.find(**search_parameters)
+        self.devices.extend(devices)
+        return [self._make_interface(device, search_parameters)
+                for device in devices]
+
+    def _make_interface(self, device, search_parameters):
+        def rediscover():
+            return self._rediscover(device.identifier, search_parameters)
+        supervised_device = supervisor.SupervisedDevice(
+            device, rediscover=rediscover, listener=self._listener)
+        return USBInterface(supervised_device, self._make_translator(device))
+
+    def _make_translator(self, device):
+        if self._manifest is None:
+            return translators.create_usb_translator(device)
+        translator_class = self._manifest.translator_class(device)
+        if translator_class is None:
+            factory = translators.TranslatorFactory()
+            translator_class = factory.usb_translator_class(
+                device.class_identifier)
+            self._manifest.record(device, translator_class)
+        return translator_class()
+
+    def check_manifest(self):
+        """Update the manifest with the devices found and save it."""
+        if self._manifest is None:
+            return
+        try:
+            self._manifest.check(self.devices)
+        except OSError as exception:
+            _LOGGER.warning('Could not save manifest %s: %s',
+                            self._manifest.path, exception)
+
+    def _rediscover(self, identifier, search_parameters):
+        """Return the device with the given identifier once it is back."""
+        for device in self._device_backend.find(**search_parameters):
+            if device.identifier == identifier:
+                return device
+        raise usbdevice.USBError('Device {} not found.'.format(identifier))
+
+
+def initialize_all(interfaces, on_ready, max_workers=8, timeout=5.0):
+    """Initialize interfaces in parallel.
+
+    At most 'max_workers' interfaces are initialized at the same time.
+    'on_ready(interface)' is called, from a worker thread, as soon as
+    an interface is initialized. Failures are logged, interfaces that
+    keep initializing in the background, see
+    'Interface.initialize_later', are ready right away. Wait at most
+    'timeout' seconds and return the interfaces that are not done by
+    then, they keep initializing in the background.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix='initialize')
+    futures = {}
+    for interface in interfaces:
+        future = executor.submit(interface.initialize)
+        future.add_done_callback(
+            functools.partial(_initialized, interface, on_ready))
+        futures[future] = interface
+    executor.shutdown(wait=False)
+    _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    for future in not_done:
+        _LOGGER.warning('Interface %s is still initializing.',
+                        futures[future].name)
+    return [futures[future] for future in not_done]
+
 
-    @classmethod
-    def _make_interface(cls, device):
-        return USBInterface(device, translators.create_usb_translator(device))
+def _initialized(interface, on_ready, future):
+    exception = future.exception()
+    if exception is not None:
+        _LOGGER.error('Initializing interface %s failed: %s',
+                      interface.name, exception)
+        if not interface.initialize_later():
+            return
+        _LOGGER.info('Initializing interface %s in the background.',
+                     interface.name)
+    on_ready(interface)
@@ -0,0 +1,228 @@
+"""Push live events and device states to dashboards over WebSocket.
+
+The 'LiveStream' serves a WebSocket endpoint of the 'httpapi'. A
+client that connects first gets the state of every device and then a
+JSON message for every event the application handles and every
+command it sends, see 'message'::
+
+    {"kind": "event", "type": "ButtonDownEvent", "device": "1-2",
+     "timestamp": 1700000000.0, "on": true}
+
+Every message is encoded to a WebSocket frame once and the same frame
+is queued for all clients. The queue of a client holds at most one
+message per device and kind of message: a newer state of a device
+replaces the one still waiting, so a slow client gets the latest
+states instead of falling further behind. When the queue is full
+anyway the oldest message is dropped and the client lags. Clients
+that are not sent anything cost nothing but their connection.
+"""
+
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import logging
+import struct
+
+from yak_server import bus
+from yak_server import events
+from yak_server import httpapi
+
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PATH = '/live'
+
+_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+TEXT = 0x1
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xa
+
+# Largest frame read from a client, clients only send control frames.
+MAX_CLIENT_FRAME = 4096
+
+_KIND_NAMES = {bus.EVENT: 'event', bus.COMMAND: 'command'}
+
+
+def accept_key(key):
+    """Return the Sec-WebSocket-Accept value for a Sec-WebSocket-Key."""
+    digest = hashlib.sha1(key.encode('latin-1') + _GUID).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def encode_frame(opcode, payload):
+    """Return an unmasked, unfragmented frame as sent by a server."""
+    length = len(payload)
+    if length < 126:
+        head = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return head + payload
+
+
+async def read_frame(reader):
+    """Read a frame sent by a client, return its (opcode, payload)."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    if length > MAX_CLIENT_FRAME:
+        raise httpapi.HttpError(413, 'Frame of {} bytes.'.format(length))
+    mask = await reader.readexactly(4) if second & 0x80 else b'\0' * 4
+    payload = await reader.readexactly(length)
+    # Unmask four bytes at a time by xor'ing integers.
+    key = int.from_bytes(mask * (length // 4 + 1), 'big') >> (
+        8 * (4 - length % 4))
+    payload = (int.from_bytes(payload, 'big') ^ key).to_bytes(length, 'big')
+    return first & 0x0f, payload
+
+
+def message(kind, event):
+    """Return the message of a handled event or sent command."""
+    data = {'kind': _KIND_NAMES[kind], 'type': type(event).__name__,
+            'device': event.device,
+            'timestamp': event.timestamp.timestamp()}
+    if isinstance(event, (events.ButtonDownEvent, events.ButtonUpEvent)):
+        data['on'] = isinstance(event, events.ButtonDownEvent)
+    elif isinstance(event, events.PatternEvent):
+        data['pattern'] = event.pattern
+    return data
+
+
+def coalescing_key(kind, event):
+    """Return the key of the messages that replace each other.
+
+    The button states of a device replace each other, other events
+    only replace events of the same type.
+    """
+    if isinstance(event, (events.ButtonDownEvent, events.ButtonUpEvent)):
+        return kind, event.device
+    return kind, event.device, type(event).__name__
+
+
+def _encode_message(data):
+    text = json.dumps(data, separators=(',', ':'))
+    return encode_frame(TEXT, text.encode('utf-8'))
+
+
+class _Client:
+    """The coalescing queue of a connected client."""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.lagged = 0
+        self.ready = asyncio.Event()
+        self._pending = collections.OrderedDict()
+
+    def put(self, key, frame):
+        """Queue a frame, replacing the waiting one with the same key."""
+        if key not in self._pending and len(self._pending) >= self.queue_size:
+            self._pending.popitem(last=False)
+            self.lagged += 1
+        self._pending[key] = frame
+        self.ready.set()
+
+    def take(self):
+        """Return all queued frames as one string of bytes."""
+        data = b''.join(self._pending.values())
+        self._pending.clear()
+        self.ready.clear()
+        return data
+
+
+class LiveStream:
+    """Broadcast the events and commands of an application to clients.
+
+    Pass the stream to the Application as 'live_stream' and 'attach'
+    it to the HttpApi of the application. Every client queues at most
+    'queue_size' messages.
+    """
+
+    def __init__(self, queue_size=256):
+        """Create a stream that is not served yet."""
+        self.queue_size = queue_size
+        self._api = None
+        self._clients = set()
+
+    def attach(self, api, path=DEFAULT_PATH):
+        """Serve the stream at 'path' of 'api', an httpapi.HttpApi."""
+        self._api = api
+        api.upgrade(path, self._serve)
+
+    def client_count(self):
+        """Return the number of connected clients."""
+        return len(self._clients)
+
+    def publish(self, kind, event):
+        """Send an event or command, bus.EVENT or bus.COMMAND, to clients.
+
+        Called from the main loop, the message is handed to the server
+        thread once for all clients.
+        """
+        if not self._clients:
+            return
+        frame = _encode_message(message(kind, event))
+        self._api.loop.call_soon_threadsafe(
+            self._broadcast, coalescing_key(kind, event), frame)
+
+    def _broadcast(self, key, frame):
+        for client in self._clients:
+            client.put(key, frame)
+
+    async def _serve(self, request, reader, writer):
+        key = request.headers.get('sec-websocket-key')
+        if (request.headers.get('upgrade', '').lower() != 'websocket' or
+                key is None):
+            writer.write(httpapi.encode_response(
+                400, {'error': 'Not a WebSocket handshake.'}, False))
+            return
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\n'
+                      'Upgrade: websocket\r\n'
+                      'Connection: Upgrade\r\n'
+                      'Sec-WebSocket-Accept: {}\r\n\r\n').format(
+                          accept_key(key)).encode('latin-1'))
+        client = _Client(self.queue_size)
+        client.put('state', _encode_message({
+            'kind': 'state',
+            'states': dict(self._api.application.device_states)}))
+        self._clients.add(client)
+        sender = asyncio.ensure_future(self._send(client, writer))
+        try:
+            await self._receive(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError,
+                httpapi.HttpError):
+            pass
+        finally:
+            self._clients.discard(client)
+            sender.cancel()
+            if client.lagged:
+                _LOGGER.info('A live stream client lagged %d messages.',
+                             client.lagged)
+
+    @staticmethod
+    async def _send(client, writer):
+        try:
+            while True:
+                await client.ready.wait()
+                writer.write(client.take())
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    async def _receive(reader, writer):
+        while True:
+            opcode, payload = await read_frame(reader)
+            if opcode == CLOSE:
+                writer.write(encode_frame(CLOSE, payload[:2]))
+                await writer.drain()
+                return
+            if opcode == PING:
+                writer.write(encode_frame(PONG, payload))
@@ -0,0 +1,116 @@
+"""Remember which devices were connected and which translators they use.
+
+Finding the translator for a device may mean scanning the installed
+packages for plugins and importing them, see 'translators'. The
+manifest keeps the translator of every device from the last run, so
+at startup only the translators that are actually needed are
+imported, straight from their module. An entry is only used while the
+device still has the same device class id, a device with new firmware
+gets its translator looked up again.
+
+After startup the manifest is checked against the devices on the bus
+in the background and saved for the next run.
+"""
+
+import json
+import logging
+import os
+import os.path
+
+from yak_server import translators
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def default_path():
+    """Return the path of the manifest in the user's cache directory."""
+    cache_directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_directory, 'yak_server', 'manifest.json')
+
+
+class Manifest:
+    """Map device identifiers to their class id and translator."""
+
+    def __init__(self, path, entries=None):
+        """Create a manifest stored at 'path'."""
+        self.path = path
+        self.entries = dict(entries or {})
+        self._loaded = frozenset(self.entries)
+        self._changed = False
+
+    @classmethod
+    def load(cls, path):
+        """Load a manifest, an unreadable one is treated as empty."""
+        try:
+            with open(path, encoding='utf-8') as manifest_file:
+                entries = json.load(manifest_file)
+        except (OSError, ValueError) as exception:
+            _LOGGER.info('Not using manifest %s: %s', path, exception)
+            entries = {}
+        return cls(path, entries)
+
+    def save(self):
+        """Write the manifest, replacing the old one at once."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.path)
+
+    def translator_class(self, device):
+        """Return the remembered translator class of a device, or None."""
+        entry = self.entries.get(device.identifier)
+        class_id = translators.format_class_id(device.class_identifier)
+        if entry is None or entry['class_id'] != class_id:
+            return None
+        try:
+            return translators.load_translator_class(entry['translator'])
+        except (ImportError, AttributeError) as exception:
+            _LOGGER.warning('Translator %s of %s is gone: %s',
+                            entry['translator'], device.identifier,
+                            exception)
+            return None
+
+    def record(self, device, translator_class):
+        """Remember the translator class of a device."""
+        entry = {
+            'class_id': translators.format_class_id(device.class_identifier),
+            'translator': translators.translator_path(translator_class)}
+        if self.entries.get(device.identifier) != entry:
+            self.entries[device.identifier] = entry
+            self._changed = True
+
+    def check(self, devices):
+        """Compare the manifest with the devices now on the bus.
+
+        Devices that are gone are removed, new devices are added. The
+        manifest is saved if it changed since it was loaded. Return the
+        identifiers of the added and the removed devices.
+        """
+        current = {device.identifier: device for device in devices}
+        removed = sorted(self._loaded - set(current))
+        added = sorted(set(current) - self._loaded)
+        for identifier in set(self.entries) - set(current):
+            del self.entries[identifier]
+            self._changed = True
+        factory = translators.TranslatorFactory()
+        for identifier in set(current) - set(self.entries):
+            device = current[identifier]
+            try:
+                translator_class = factory.usb_translator_class(
+                    device.class_identifier)
+            except KeyError:
+                continue
+            self.record(device, translator_class)
+        if added or removed:
+            _LOGGER.info('Devices added since the last run: %s, removed: %s',
+                         added, removed)
+        if self._changed:
+            self.save()
+            self._changed = False
+        self._loaded = frozenset(self.entries)
+        return added, removed
@@ -0,0 +1,212 @@
+"""Recognise patterns like double presses in the stream of events.
+
+A pattern is a sequence of steps that must be seen in order within a
+time window, other events in between are ignored. The patterns are
+compiled into one automaton: every partially matched pattern is a
+state waiting for one kind of event, and states are indexed by the
+event type and device they wait for. An event therefore only touches
+the patterns that start with it and the partial matches that wait for
+it, no matter how many patterns there are.
+"""
+
+import collections
+import datetime
+import itertools
+
+from yak_server import events
+
+
+class Step:
+    """One step of a pattern: an event of a type, optionally on a device.
+
+    If 'min_gap' is given the event must come at least that many
+    seconds after the previous step, which is how a long press is
+    described.
+    """
+
+    def __init__(self, event_type, device=None, min_gap=0):
+        """Create a step."""
+        self.event_type = event_type
+        self.device = device
+        self.min_gap = datetime.timedelta(seconds=min_gap)
+
+
+class Pattern:
+    """A named sequence of steps that must complete within a window.
+
+    'within' is the maximum number of seconds between the first and
+    the last step, or None for no limit. If 'same_device' is True,
+    steps without a device must be on the device of the first step.
+    """
+
+    def __init__(self, name, steps, within=None, same_device=True):
+        """Create a pattern."""
+        if not steps:
+            raise ValueError('A pattern needs at least one step.')
+        self.name = name
+        self.steps = tuple(steps)
+        self.within = (None if within is None
+                       else datetime.timedelta(seconds=within))
+        self.same_device = same_device
+
+
+def double_press(name, device=None, within=0.5):
+    """Return a pattern for two presses of a switch in short succession."""
+    return Pattern(name, [Step(events.ButtonDownEvent, device),
+                          Step(events.ButtonUpEvent, device),
+                          Step(events.ButtonDownEvent, device)], within)
+
+
+def long_press(name, device=None, duration=1.0):
+    """Return a pattern for a switch held for at least 'duration' seconds.
+
+    The pattern matches when the switch is released.
+    """
+    return Pattern(name, [Step(events.ButtonDownEvent, device),
+                          Step(events.ButtonUpEvent, device,
+                               min_gap=duration)])
+
+
+def combination(name, devices, within=0.5):
+    """Return a pattern for pressing several switches in order."""
+    steps = [Step(events.ButtonDownEvent, device) for device in devices]
+    return Pattern(name, steps, within, same_device=False)
+
+
+class _PartialMatch:
+    """A pattern of which the first steps have been seen."""
+
+    def __init__(self, pattern_id, pattern, device, start, last):
+        self.pattern_id = pattern_id
+        self.pattern = pattern
+        self.device = device
+        self.start = start
+        self.last = last
+        self.next_step = 1
+        self.alive = True
+
+    @property
+    def key(self):
+        return self.pattern_id, self.device, self.next_step
+
+    def step(self):
+        return self.pattern.steps[self.next_step]
+
+    def waiting_for(self):
+        """Return the (event type, device) this match waits for."""
+        step = self.step()
+        device = step.device
+        if device is None and self.pattern.same_device:
+            device = self.device
+        return step.event_type, device
+
+    def expired(self, now):
+        within = self.pattern.within
+        return within is not None and now - self.start > within
+
+
+class PatternMatcher:
+    """Match events against a set of patterns.
+
+    Feed every event to 'feed', which returns a PatternEvent for every
+    pattern that completed.
+    """
+
+    def __init__(self, patterns=()):
+        """Create a matcher for the given patterns."""
+        self._pattern_ids = itertools.count()
+        self._starts = collections.defaultdict(list)
+        self._waiting = collections.defaultdict(dict)
+        self._partials = {}
+        self._by_age = collections.deque()
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        """Add a pattern to the matcher."""
+        first_step = pattern.steps[0]
+        start_key = (first_step.event_type, first_step.device)
+        self._starts[start_key].append((next(self._pattern_ids), pattern))
+
+    def active_matches(self):
+        """Return the number of partially matched patterns."""
+        return len(self._partials)
+
+    def feed(self, event):
+        """Advance the automaton with an event and return the matches."""
+        self._expire(event.timestamp)
+        matches = []
+        waiting = self._waiting_partials(event)
+        for partial in waiting:
+            if self._accepts(partial, event):
+                self._advance(partial, event, matches)
+        for pattern_id, pattern in self._starting_patterns(event):
+            partial = _PartialMatch(pattern_id, pattern, event.device,
+                                    event.timestamp, event.timestamp)
+            if len(pattern.steps) == 1:
+                matches.append(self._match_event(partial, event))
+            else:
+                self._store(partial)
+        return matches
+
+    def _lookup_keys(self, event):
+        for event_type in type(event).__mro__:
+            if event_type is object:
+                break
+            yield event_type, event.device
+            yield event_type, None
+
+    def _starting_patterns(self, event):
+        for key in self._lookup_keys(event):
+            yield from self._starts.get(key, ())
+
+    def _waiting_partials(self, event):
+        partials = []
+        for key in self._lookup_keys(event):
+            partials.extend(self._waiting.get(key, {}).values())
+        return partials
+
+    @staticmethod
+    def _accepts(partial, event):
+        if not partial.alive or partial.expired(event.timestamp):
+            return False
+        return event.timestamp - partial.last >= partial.step().min_gap
+
+    def _advance(self, partial, event, matches):
+        self._remove(partial)
+        partial.next_step += 1
+        partial.last = event.timestamp
+        if partial.next_step == len(partial.pattern.steps):
+            matches.append(self._match_event(partial, event))
+        else:
+            partial.alive = True
+            self._store(partial)
+
+    def _store(self, partial):
+        """Store a partial match, replacing an older one in the same state."""
+        older = self._partials.get(partial.key)
+        if older is not None:
+            self._remove(older)
+        self._partials[partial.key] = partial
+        self._waiting[partial.waiting_for()][partial.key] = partial
+        if partial.pattern.within is not None:
+            self._by_age.append(partial)
+
+    def _remove(self, partial):
+        if self._partials.get(partial.key) is partial:
+            del self._partials[partial.key]
+            waiting = self._waiting[partial.waiting_for()]
+            del waiting[partial.key]
+        partial.alive = False
+
+    def _expire(self, now):
+        """Drop partial matches whose window has passed."""
+        while self._by_age and (not self._by_age[0].alive or
+                                self._by_age[0].expired(now)):
+            self._remove(self._by_age.popleft())
+
+    @staticmethod
+    def _match_event(partial, event):
+        return events.PatternEvent(pattern=partial.pattern.name,
+                                   device=partial.device,
+                                   timestamp=event.timestamp)
@@ -0,0 +1,141 @@
+"""Serve interactive commands before background commands.
+
+Commands sent for a live button press are interactive, commands from
+schedules and scenes are background work. Every output device has a
+'PriorityGate' that lets one writer at a time write to the device.
+When the device is free it goes to the longest waiting interactive
+writer, so a press only waits for the write in progress and never
+for a whole scene. Background batches are written in chunks and give
+the device back between chunks. To keep background work from
+starving under a steady stream of presses, a waiting background
+writer gets the device after 'starvation_limit' interactive writers
+went ahead of it.
+"""
+
+import collections
+import contextlib
+import threading
+
+from yak_server import clock
+from yak_server import interface
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+
+class PriorityGate:
+    """Give one writer at a time access to a device, by priority."""
+
+    def __init__(self, starvation_limit=4, gate_clock=None,
+                 history_size=1000):
+        """Create a free gate.
+
+        The last 'history_size' wait times of every priority are kept.
+        """
+        self.starvation_limit = starvation_limit
+        self.clock = gate_clock or clock.get_clock()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        self._overtaken = 0
+        self._wait_times = {priority: collections.deque(maxlen=history_size)
+                            for priority in PRIORITIES}
+
+    @contextlib.contextmanager
+    def hold(self, priority):
+        """Wait for the device and hold it for the duration of the block."""
+        start = self.clock.monotonic()
+        with self._condition:
+            self._waiting[priority] += 1
+            while not self._may_enter(priority):
+                self._condition.wait()
+            self._waiting[priority] -= 1
+            self._enter(priority)
+            self._wait_times[priority].append(self.clock.monotonic() - start)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def wait_times(self, priority):
+        """Return the recent wait times of a priority in seconds, sorted."""
+        with self._condition:
+            return sorted(self._wait_times[priority])
+
+    def percentile(self, priority, fraction):
+        """Return the wait time below which 'fraction' of waits fall."""
+        wait_times = self.wait_times(priority)
+        if not wait_times:
+            return 0.0
+        index = min(int(fraction * len(wait_times)), len(wait_times) - 1)
+        return wait_times[index]
+
+    def _may_enter(self, priority):
+        if self._busy:
+            return False
+        starving = (self._waiting[BACKGROUND] and
+                    self._overtaken >= self.starvation_limit)
+        if priority == INTERACTIVE:
+            return not starving
+        return starving or not self._waiting[INTERACTIVE]
+
+    def _enter(self, priority):
+        self._busy = True
+        if priority == BACKGROUND:
+            self._overtaken = 0
+        elif self._waiting[BACKGROUND]:
+            self._overtaken += 1
+
+
+class PrioritizedInterface(interface.Interface):
+    """An output interface whose writes pass a PriorityGate.
+
+    Lists of commands are written 'chunk_size' commands at a time,
+    each chunk passing the gate on its own.
+    """
+
+    def __init__(self, output_interface, gate, priority, chunk_size=8):
+        """Wrap 'output_interface' with the given priority."""
+        self.output_interface = output_interface
+        self.gate = gate
+        self.priority = priority
+        self.chunk_size = chunk_size
+
+    @property
+    def name(self):
+        """Return the name of the wrapped interface."""
+        return self.output_interface.name
+
+    def initialize(self):
+        """Initialize the wrapped interface."""
+        self.output_interface.initialize()
+
+    def get_event(self):
+        """Return the next event from the wrapped interface."""
+        return self.output_interface.get_event()
+
+    def send_command(self, command):
+        """Send a command once the gate lets it through."""
+        with self.gate.hold(self.priority):
+            self.output_interface.send_command(command)
+
+    def send_commands(self, commands):
+        """Send commands in chunks, each once the gate lets it through."""
+        for start in range(0, len(commands), self.chunk_size):
+            with self.gate.hold(self.priority):
+                self.output_interface.send_commands(
+                    commands[start:start + self.chunk_size])
+
+
+def prioritized(output_interface, gate=None):
+    """Return an interactive and a background view of an interface.
+
+    Both views share 'gate', a new PriorityGate if none is given.
+    """
+    gate = gate or PriorityGate()
+    return (PrioritizedInterface(output_interface, gate, INTERACTIVE),
+            PrioritizedInterface(output_interface, gate, BACKGROUND))
@@ -0,0 +1,212 @@
+"""Limit the rate of commands sent to output devices.
+
+Every channel of an output device gets a token bucket: a command may
+be sent when a token is available, and tokens come back at a fixed
+rate up to a burst size. A command that arrives while its channel is
+out of tokens is not queued behind the earlier ones. It becomes the
+pending command of its channel, replacing the command that was
+pending before, so a chattering switch costs the relays no more than
+one write per token and the lamp still ends up in the newest state.
+
+The limiter does not run by itself: the owner asks how long it may
+wait with 'timeout' and calls 'flush' afterwards, like the
+'scheduler.Scheduler'.
+"""
+
+import collections
+import threading
+
+import ezvalue
+
+from yak_server import clock
+from yak_server import interface
+
+
+class TokenBucket:
+    """Tokens that come back at 'rate' per second up to 'burst'."""
+
+    # Rounding errors must not leave a bucket just short of a token
+    # after waiting exactly 'time_until_available'.
+    _EPSILON = 1e-9
+
+    def __init__(self, rate, burst, bucket_clock=None):
+        """Create a full bucket."""
+        self.rate = rate
+        self.burst = burst
+        self.clock = bucket_clock or clock.get_clock()
+        self._tokens = burst
+        self._last = self.clock.monotonic()
+
+    def try_take(self):
+        """Take a token and return True, or return False if there is none."""
+        self._refill()
+        if self._tokens < 1 - self._EPSILON:
+            return False
+        self._tokens = max(self._tokens - 1, 0.0)
+        return True
+
+    def time_until_available(self):
+        """Return the seconds untill a token is available."""
+        self._refill()
+        return max((1 - self._tokens) / self.rate, 0.0)
+
+    def _refill(self):
+        now = self.clock.monotonic()
+        self._tokens = min(self._tokens + (now - self._last) * self.rate,
+                           self.burst)
+        self._last = now
+
+
+class ChannelStats(ezvalue.Value):
+    """Counters of the commands for one channel of an output device."""
+
+    sent = 'Number of commands that were sent.'
+    coalesced = 'Number of pending commands replaced by a newer one.'
+    dropped = 'Number of pending commands for a state already sent.'
+
+
+class _Channel:
+    """The bucket, pending command and counters of one channel.
+
+    The pending command is sent to the interface it was submitted to.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.pending = None
+        self.output_interface = None
+        self.last_sent = None
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def take_ready(self):
+        """Return the pending command if it may be sent now, else None."""
+        if self.pending is None:
+            return None
+        if not self.bucket.try_take():
+            if _same_state(self.pending, self.last_sent):
+                self.pending = None
+                self.dropped += 1
+            return None
+        command, self.pending = self.pending, None
+        self.last_sent = command
+        self.sent += 1
+        return command
+
+
+def _same_state(command, other):
+    return (other is not None and type(command) is type(other) and
+            command.device == other.device)
+
+
+def single_channel(command):
+    """Return the channel of a command for single channel devices."""
+    # pylint: disable = unused-argument
+    return 0
+
+
+class RateLimiter:
+    """Token buckets for every channel of every output device.
+
+    'channel_of' maps a command to the channel of its device it
+    drives. The 230V interface has a single relay, so by default all
+    commands of a device share one channel.
+    """
+
+    def __init__(self, rate=10.0, burst=4, limiter_clock=None,
+                 channel_of=single_channel):
+        """Create a limiter allowing 'rate' commands per second."""
+        self.rate = rate
+        self.burst = burst
+        self.clock = limiter_clock or clock.get_clock()
+        self.channel_of = channel_of
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, output_interface):
+        """Return an interface that sends through this limiter."""
+        return RateLimitedInterface(output_interface, self)
+
+    def submit(self, output_interface, commands):
+        """Send the commands that may be sent now, keep the others."""
+        keys = collections.OrderedDict()
+        with self._lock:
+            for command in commands:
+                key = (output_interface.name, self.channel_of(command))
+                channel = self._channel(key)
+                if channel.pending is not None:
+                    channel.coalesced += 1
+                channel.pending = command
+                channel.output_interface = output_interface
+                keys[key] = None
+            ready = [self._channels[key].take_ready() for key in keys]
+        ready = [command for command in ready if command is not None]
+        if ready:
+            output_interface.send_commands(ready)
+
+    def timeout(self):
+        """Return the seconds untill 'flush' must be called, or None."""
+        with self._lock:
+            waits = [channel.bucket.time_until_available()
+                     for channel in self._channels.values()
+                     if channel.pending is not None]
+        return min(waits) if waits else None
+
+    def flush(self):
+        """Send the pending commands whose channel has a token again."""
+        ready = collections.OrderedDict()
+        with self._lock:
+            for channel in self._channels.values():
+                output_interface = channel.output_interface
+                command = channel.take_ready()
+                if command is not None:
+                    ready.setdefault(output_interface, []).append(command)
+        for output_interface, commands in ready.items():
+            output_interface.send_commands(commands)
+
+    def stats(self):
+        """Return a dict mapping (device, channel) to ChannelStats."""
+        with self._lock:
+            return {key: ChannelStats(sent=channel.sent,
+                                      coalesced=channel.coalesced,
+                                      dropped=channel.dropped)
+                    for key, channel in self._channels.items()}
+
+    def _channel(self, key):
+        try:
+            return self._channels[key]
+        except KeyError:
+            bucket = TokenBucket(self.rate, self.burst, self.clock)
+            channel = self._channels[key] = _Channel(bucket)
+            return channel
+
+
+class RateLimitedInterface(interface.Interface):
+    """An output interface whose commands go through a RateLimiter."""
+
+    def __init__(self, output_interface, rate_limiter):
+        """Wrap 'output_interface'."""
+        self.output_interface = output_interface
+        self.rate_limiter = rate_limiter
+
+    @property
+    def name(self):
+        """Return the name of the wrapped interface."""
+        return self.output_interface.name
+
+    def initialize(self):
+        """Initialize the wrapped interface."""
+        self.output_interface.initialize()
+
+    def get_event(self):
+        """Return the next event from the wrapped interface."""
+        return self.output_interface.get_event()
+
+    def send_command(self, command):
+        """Send a command unless its channel is throttled."""
+        self.rate_limiter.submit(self.output_interface, [command])
+
+    def send_commands(self, commands):
+        """Send the newest command of every channel that is not throttled."""
+        self.rate_limiter.submit(self.output_interface, commands)
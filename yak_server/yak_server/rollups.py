@@ -0,0 +1,355 @@
+"""Aggregate switch and lamp activity while the server runs.
+
+'Rollups' is fed every event the application handles and every
+command it sends. For every window duration, by default an hour and a
+day, it keeps the open tumbling window in arrays of counters, one
+element per switch or lamp channel:
+
+- the number of presses of every switch,
+- the seconds every lamp channel was on,
+- the number of events and the most events in one second.
+
+When a window closes it becomes a 'Rollup'. The last rollups are kept
+in memory for 'Rollups.query' and appended to a 'RollupStore' in a
+compact binary format, from which they are loaded again at startup,
+so no query ever rescans events. A sliding window over the last
+minute gives the current event rate, see 'SlidingCounter'.
+
+Windows are aligned to multiples of their duration since the POSIX
+epoch, so daily windows start at midnight UTC. Time is taken from the
+timestamps of the events, and from the clock of the main loop while
+there are none, see 'Rollups.close_due'. Every window is closed, also
+those without any event, so the on-time of a lamp that stays on is
+counted in all of them.
+"""
+
+import array
+import collections
+import datetime
+import logging
+import struct
+
+import ezvalue
+
+from yak_server import bus
+from yak_server import events
+from yak_server import ratelimit
+
+
+_LOGGER = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Length of a stored rollup, written before it.
+RECORD_LENGTH = struct.Struct('<I')
+# Start, duration, event count, peak rate and the number of press and
+# on-time entries, followed by those.
+RECORD_HEADER = struct.Struct('<ddIIHH')
+# Presses and the length of the device name, followed by the name.
+PRESS_ENTRY = struct.Struct('<IB')
+# Seconds on, channel and the length of the device name, followed by
+# the name. Names are cut off after MAX_NAME_SIZE bytes.
+ON_TIME_ENTRY = struct.Struct('<dHB')
+MAX_NAME_SIZE = 255
+
+
+class Rollup(ezvalue.Value):
+    """The activity in one closed window."""
+
+    start = 'Datetime the window started.'
+    duration = 'Length of the window in seconds.'
+    event_count = 'Number of handled events.'
+    peak_rate = 'Most events handled in one second.'
+    presses = 'Dict of the number of presses per switch.'
+    on_time = 'Dict of the seconds on per (lamp, channel).'
+
+
+def encode_rollup(rollup):
+    """Return the stored record of a rollup."""
+    parts = [RECORD_HEADER.pack(
+        rollup.start.timestamp(), rollup.duration, rollup.event_count,
+        rollup.peak_rate, len(rollup.presses), len(rollup.on_time))]
+    for device, count in rollup.presses.items():
+        name = _encode_name(device)
+        parts += [PRESS_ENTRY.pack(count, len(name)), name]
+    for (device, channel), seconds in rollup.on_time.items():
+        name = _encode_name(device)
+        parts += [ON_TIME_ENTRY.pack(seconds, channel, len(name)), name]
+    body = b''.join(parts)
+    return RECORD_LENGTH.pack(len(body)) + body
+
+
+def _encode_name(device):
+    name = device.encode('utf-8')[:MAX_NAME_SIZE]
+    # Do not cut a character in half.
+    return name.decode('utf-8', 'ignore').encode('utf-8')
+
+
+def decode_rollup(body):
+    """Return the Rollup of a record without its length."""
+    start, duration, event_count, peak_rate, press_count, on_time_count = (
+        RECORD_HEADER.unpack_from(body))
+    offset = RECORD_HEADER.size
+    presses = {}
+    for _ in range(press_count):
+        count, length = PRESS_ENTRY.unpack_from(body, offset)
+        offset += PRESS_ENTRY.size
+        presses[body[offset:offset + length].decode('utf-8')] = count
+        offset += length
+    on_time = {}
+    for _ in range(on_time_count):
+        seconds, channel, length = ON_TIME_ENTRY.unpack_from(body, offset)
+        offset += ON_TIME_ENTRY.size
+        device = body[offset:offset + length].decode('utf-8')
+        on_time[device, channel] = seconds
+        offset += length
+    return Rollup(start=datetime.datetime.fromtimestamp(start),
+                  duration=duration, event_count=event_count,
+                  peak_rate=peak_rate, presses=presses, on_time=on_time)
+
+
+class RollupStore:
+    """An append only file of closed rollups."""
+
+    def __init__(self, path):
+        """Store the rollups in the file at 'path'."""
+        self.path = path
+
+    def append(self, rollup):
+        """Add a rollup to the end of the file."""
+        with open(self.path, 'ab') as store_file:
+            store_file.write(encode_rollup(rollup))
+
+    def load(self):
+        """Return all stored rollups, oldest first."""
+        try:
+            with open(self.path, 'rb') as store_file:
+                data = store_file.read()
+        except FileNotFoundError:
+            return []
+        rollups = []
+        offset = 0
+        while offset + RECORD_LENGTH.size <= len(data):
+            length, = RECORD_LENGTH.unpack_from(data, offset)
+            offset += RECORD_LENGTH.size
+            body = data[offset:offset + length]
+            offset += length
+            try:
+                rollups.append(decode_rollup(body))
+            except (struct.error, UnicodeDecodeError):
+                _LOGGER.warning('Ignoring a damaged rollup in %s.',
+                                self.path)
+        return rollups
+
+
+class SlidingCounter:
+    """Count things over the last 'span' seconds.
+
+    The span is divided into 'bucket_count' buckets in a ring, so the
+    count is exact to a bucket and adding is constant time.
+    """
+
+    def __init__(self, span=60, bucket_count=60):
+        """Create a counter over the last 'span' seconds."""
+        self.span = span
+        self._width = span / bucket_count
+        self._buckets = array.array('L', [0]) * bucket_count
+        self._last = None
+
+    def add(self, timestamp, count=1):
+        """Count things at a POSIX timestamp."""
+        index = self._advance(timestamp)
+        self._buckets[index] += count
+
+    def total(self, timestamp):
+        """Return the count in the span up to a POSIX timestamp."""
+        self._advance(timestamp)
+        return sum(self._buckets)
+
+    def _advance(self, timestamp):
+        bucket = int(timestamp // self._width)
+        size = len(self._buckets)
+        if self._last is None or bucket - self._last >= size:
+            self._buckets = array.array('L', [0]) * size
+        elif bucket > self._last:
+            for passed in range(self._last + 1, bucket + 1):
+                self._buckets[passed % size] = 0
+        if self._last is None or bucket > self._last:
+            self._last = bucket
+        return self._last % size
+
+
+class _Window:
+    """An open tumbling window."""
+
+    def __init__(self, start, duration):
+        self.start = start
+        self.end = start + duration
+        self.duration = duration
+        self.presses = array.array('L')
+        self.on_time = array.array('d')
+        self.event_count = 0
+        self.peak_rate = 0
+        self._second = None
+        self._second_count = 0
+
+    def count_event(self, timestamp):
+        """Count an event at a POSIX timestamp."""
+        self.event_count += 1
+        second = int(timestamp)
+        if second != self._second:
+            self._second = second
+            self._second_count = 0
+        self._second_count += 1
+        self.peak_rate = max(self.peak_rate, self._second_count)
+
+    def add_on_time(self, index, since, until):
+        """Add the part of an on period within the window."""
+        seconds = min(until, self.end) - max(since, self.start)
+        if seconds > 0:
+            _grow(self.on_time, index + 1)
+            self.on_time[index] += seconds
+
+
+def _grow(counters, size):
+    if len(counters) < size:
+        counters.extend([0] * (size - len(counters)))
+
+
+class Rollups:
+    """Aggregate the activity of an application in tumbling windows.
+
+    Pass the rollups to the Application as 'rollups'. Windows of every
+    duration in 'durations' are kept, the last 'keep' closed rollups
+    of each are kept in memory and all are appended to 'store', a
+    RollupStore, if given. 'channel_of' maps a command to the channel
+    of its lamp, like for 'ratelimit.RateLimiter'.
+    """
+
+    def __init__(self, durations=(HOUR, DAY), store=None, keep=48,
+                 channel_of=ratelimit.single_channel):
+        """Create the rollups, loading the stored ones."""
+        self.durations = tuple(durations)
+        self.store = store
+        self.channel_of = channel_of
+        self.recent_events = SlidingCounter()
+        self._closed = {duration: collections.deque(maxlen=keep)
+                        for duration in self.durations}
+        self._windows = {}
+        self._switches = {}
+        self._channels = {}
+        self._lamps_on = {}
+        self._now = None
+        for rollup in (store.load() if store else []):
+            if rollup.duration in self._closed:
+                self._closed[rollup.duration].append(rollup)
+
+    def record(self, kind, event):
+        """Aggregate an event or command, bus.EVENT or bus.COMMAND."""
+        timestamp = event.timestamp.timestamp()
+        self._advance(timestamp)
+        if kind == bus.EVENT:
+            self.recent_events.add(timestamp)
+            for window in self._windows.values():
+                window.count_event(timestamp)
+            if isinstance(event, events.ButtonDownEvent):
+                index = _index(self._switches, event.device)
+                for window in self._windows.values():
+                    _grow(window.presses, index + 1)
+                    window.presses[index] += 1
+        elif isinstance(event, events.LampOnEvent):
+            index = _index(self._channels,
+                           (event.device, self.channel_of(event)))
+            self._lamps_on.setdefault(index, timestamp)
+        elif isinstance(event, events.LampOffEvent):
+            index = _index(self._channels,
+                           (event.device, self.channel_of(event)))
+            since = self._lamps_on.pop(index, None)
+            if since is not None:
+                for window in self._windows.values():
+                    window.add_on_time(index, since, timestamp)
+
+    def query(self, duration, since=None):
+        """Return the closed rollups of a duration, oldest first.
+
+        Only rollups starting at or after the datetime 'since' are
+        returned, if given.
+        """
+        return [rollup for rollup in self._closed[duration]
+                if since is None or rollup.start >= since]
+
+    def current(self, duration):
+        """Return the Rollup of the open window so far, or None."""
+        window = self._windows.get(duration)
+        if window is None:
+            return None
+        return self._rollup(window, min(self._now, window.end))
+
+    def timeout(self, now):
+        """Return the seconds from 'now' untill 'close_due' must be called.
+
+        None is returned if there is no open window.
+        """
+        if not self._windows:
+            return None
+        end = min(window.end for window in self._windows.values())
+        return max(end - now.timestamp(), 0)
+
+    def close_due(self, now):
+        """Close the windows that ended by the datetime 'now'."""
+        if self._windows:
+            self._advance(now.timestamp())
+
+    def event_rate(self, timestamp=None):
+        """Return the events per second over the last minute."""
+        if timestamp is None:
+            timestamp = self._now or 0
+        return self.recent_events.total(timestamp) / self.recent_events.span
+
+    def _advance(self, timestamp):
+        if self._now is None or timestamp > self._now:
+            self._now = timestamp
+        for duration in self.durations:
+            window = self._windows.get(duration)
+            if window is None:
+                start = timestamp - timestamp % duration
+                self._windows[duration] = _Window(start, duration)
+                continue
+            while timestamp >= window.end:
+                self._close(window)
+                window = _Window(window.end, duration)
+            self._windows[duration] = window
+
+    def _close(self, window):
+        rollup = self._rollup(window, window.end)
+        self._closed[window.duration].append(rollup)
+        if self.store is not None:
+            try:
+                self.store.append(rollup)
+            except (OSError, struct.error):
+                _LOGGER.exception('Storing a rollup in %s failed.',
+                                  self.store.path)
+
+    def _rollup(self, window, until):
+        on_time = array.array('d', window.on_time)
+        for index, since in self._lamps_on.items():
+            seconds = min(until, window.end) - max(since, window.start)
+            if seconds > 0:
+                _grow(on_time, index + 1)
+                on_time[index] += seconds
+        return Rollup(
+            start=datetime.datetime.fromtimestamp(window.start),
+            duration=window.duration, event_count=window.event_count,
+            peak_rate=window.peak_rate,
+            presses=_by_key(self._switches, window.presses),
+            on_time=_by_key(self._channels, on_time))
+
+
+def _index(indexes, key):
+    return indexes.setdefault(key, len(indexes))
+
+
+def _by_key(indexes, counters):
+    return {key: counters[index] for key, index in indexes.items()
+            if index < len(counters) and counters[index]}
@@ -0,0 +1,118 @@
+"""Scenes: one trigger driving many lamps at once.
+
+A scene is a list of commands for lamps that may be spread over
+several output interfaces. The 'SceneRunner' gives every output
+interface its own worker, so the commands for different interfaces
+are written in parallel, while commands for the same interface keep
+their order. Running a scene therefore takes as long as the slowest
+interface instead of the sum of all of them.
+"""
+
+import collections
+import concurrent.futures
+import logging
+
+import ezvalue
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Scene:
+    """A named list of commands, each command names its device."""
+
+    def __init__(self, name, commands):
+        """Create a scene."""
+        self.name = name
+        self.commands = list(commands)
+
+    def commands_by_device(self):
+        """Return the commands grouped by device, keeping their order."""
+        grouped = collections.OrderedDict()
+        for command in self.commands:
+            grouped.setdefault(command.device, []).append(command)
+        return grouped
+
+
+class DeviceResult(ezvalue.Value):
+    """The outcome of the commands of a scene for one device."""
+
+    device = 'Identifier of the device.'
+    submitted = ('Number of commands handed to the output, 0 on error. '
+                 'A rate limited output may still throttle or merge them.')
+    error = 'The exception that stopped the writes, or None.'
+    timed_out = 'True if the writes did not finish in time.'
+
+    def ok(self):
+        """Return True if all commands were handed to the output."""
+        return self.error is None and not self.timed_out
+
+
+class SceneRunner:
+    """Run scenes with one worker thread per output interface."""
+
+    def __init__(self, timeout=1.0):
+        """Create a runner that waits at most 'timeout' seconds."""
+        self.timeout = timeout
+        self._workers = {}
+
+    def run(self, scene, output_interfaces):
+        """Send the commands of 'scene' and return the results.
+
+        'output_interfaces' maps device identifiers to interfaces.
+        Return a dict mapping each device of the scene to a
+        DeviceResult once all writes finished or the timeout passed.
+        Raise ValueError, before sending anything, if the scene has
+        commands for unknown devices.
+        """
+        grouped = scene.commands_by_device()
+        unknown = [device for device in grouped
+                   if device not in output_interfaces]
+        if unknown:
+            raise ValueError('Scene {} has unknown devices: {}'.format(
+                scene.name, unknown))
+        futures = {}
+        for device, commands in grouped.items():
+            output_interface = output_interfaces[device]
+            worker = self._worker(device)
+            futures[device] = worker.submit(_send_all, output_interface,
+                                            commands)
+        concurrent.futures.wait(futures.values(), timeout=self.timeout)
+        return {device: self._result(device, future)
+                for device, future in futures.items()}
+
+    def close(self):
+        """Stop the workers after their pending writes."""
+        for worker in self._workers.values():
+            worker.shutdown(wait=False)
+        self._workers.clear()
+
+    def _worker(self, device):
+        try:
+            return self._workers[device]
+        except KeyError:
+            worker = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='scene-{}'.format(device))
+            self._workers[device] = worker
+            return worker
+
+    @staticmethod
+    def _result(device, future):
+        if not future.done():
+            _LOGGER.error('Scene writes to %s timed out.', device)
+            return DeviceResult(device=device, submitted=0, error=None,
+                                timed_out=True)
+        submitted, error = future.result()
+        if error is not None:
+            _LOGGER.error('Scene writes to %s failed: %s', device, error)
+        return DeviceResult(device=device, submitted=submitted, error=error,
+                            timed_out=False)
+
+
+def _send_all(output_interface, commands):
+    """Send commands in order, in as few transfers as possible."""
+    try:
+        output_interface.send_commands(commands)
+    except Exception as exception:  # pylint: disable = broad-except
+        return 0, exception
+    return len(commands), None
@@ -0,0 +1,185 @@
+"""Schedule actions to run at a later time.
+
+Timers are kept in a hierarchical timer wheel. Each level of the
+wheel is a ring of slots, every slot of level k covering SLOTS**k
+ticks. A timer is put in the slot of the lowest level whose range
+reaches its deadline and moves down a level every time the level
+below wraps around. Adding and cancelling a timer are O(1) and
+advancing the wheel only touches the slots that come due, so
+thousands of pending timers cost next to nothing.
+"""
+
+import math
+
+from yak_server import clock
+
+
+class Timer:
+    """A pending call, returned by the scheduler so it can be cancelled."""
+
+    def __init__(self, deadline_tick, callback, args):
+        """Create a timer that calls 'callback(*args)' at 'deadline_tick'."""
+        self.deadline_tick = deadline_tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.slot = None
+        self.level = None
+
+    def fire(self):
+        """Call the callback."""
+        self.callback(*self.args)
+
+
+class TimerWheel:
+    """A hierarchical timer wheel counting in integer ticks."""
+
+    SLOTS = 256
+    LEVELS = 4
+
+    def __init__(self):
+        """Create an empty wheel at tick 0."""
+        self.current_tick = 0
+        self._levels = [[set() for _ in range(self.SLOTS)]
+                        for _ in range(self.LEVELS)]
+        self._level_counts = [0] * self.LEVELS
+
+    def __len__(self):
+        """Return the number of pending timers."""
+        return sum(self._level_counts)
+
+    def add(self, timer):
+        """Add a timer to the wheel.
+
+        Timers that are already due fire on the next tick.
+        """
+        self._insert(timer, self.current_tick + 1)
+
+    def cancel(self, timer):
+        """Remove a pending timer from the wheel."""
+        if timer.slot is not None:
+            timer.slot.discard(timer)
+            timer.slot = None
+            self._level_counts[timer.level] -= 1
+        timer.cancelled = True
+
+    def advance(self, target_tick):
+        """Move the wheel to 'target_tick' and return the timers due."""
+        due = []
+        while self.current_tick < target_tick:
+            ticks = self.ticks_until_next()
+            if ticks is None or self.current_tick + ticks > target_tick:
+                self.current_tick = target_tick
+                break
+            self.current_tick += ticks
+            self._cascade()
+            due.extend(self._take_slot(0, self.current_tick % self.SLOTS))
+        return due
+
+    def ticks_until_next(self):
+        """Return the number of ticks untill the wheel must be advanced.
+
+        This is the distance to the next occupied slot of the lowest
+        level, or to the next time the lowest occupied level wraps
+        around and its timers move down. Empty stretches are skipped
+        this way. Return None if there are no timers.
+        """
+        if self._level_counts[0]:
+            lowest_level = self._levels[0]
+            for distance in range(1, self.SLOTS + 1):
+                tick = self.current_tick + distance
+                if lowest_level[tick % self.SLOTS] or tick % self.SLOTS == 0:
+                    return distance
+        for level in range(1, self.LEVELS):
+            if self._level_counts[level]:
+                span = self.SLOTS ** level
+                return span - self.current_tick % span
+        return None
+
+    def _insert(self, timer, earliest_tick):
+        deadline_tick = max(timer.deadline_tick, earliest_tick)
+        delta = deadline_tick - self.current_tick
+        level = min(self._level_for(delta), self.LEVELS - 1)
+        index = (deadline_tick // self.SLOTS ** level) % self.SLOTS
+        timer.slot = self._levels[level][index]
+        timer.level = level
+        timer.slot.add(timer)
+        self._level_counts[level] += 1
+
+    def _level_for(self, delta):
+        level = 0
+        while delta >= self.SLOTS ** (level + 1):
+            level += 1
+        return level
+
+    def _cascade(self):
+        """Move the timers of wrapped levels one level down."""
+        for level in range(self.LEVELS - 1, 0, -1):
+            span = self.SLOTS ** level
+            if self.current_tick % span == 0:
+                index = (self.current_tick // span) % self.SLOTS
+                for timer in self._take_slot(level, index):
+                    self._insert(timer, self.current_tick)
+
+    def _take_slot(self, level, index):
+        timers = self._levels[level][index]
+        self._levels[level][index] = set()
+        for timer in timers:
+            timer.slot = None
+        self._level_counts[level] -= len(timers)
+        return timers
+
+
+class Scheduler:
+    """Run callbacks after a delay or at a given time.
+
+    The scheduler does not run by itself: the owner asks how long it
+    may wait with 'timeout' and calls 'run_due' afterwards. It is not
+    thread safe and should only be used from the main loop.
+    """
+
+    def __init__(self, scheduler_clock=None, resolution=0.1):
+        """Create a scheduler with a resolution in seconds."""
+        self.clock = scheduler_clock or clock.get_clock()
+        self.resolution = resolution
+        self._wheel = TimerWheel()
+        self._start = self.clock.monotonic()
+
+    def __len__(self):
+        """Return the number of pending timers."""
+        return len(self._wheel)
+
+    def call_later(self, delay, callback, *args):
+        """Call 'callback(*args)' after 'delay' seconds."""
+        deadline = self.clock.monotonic() + delay - self._start
+        timer = Timer(math.ceil(deadline / self.resolution), callback, args)
+        self._wheel.add(timer)
+        return timer
+
+    def call_at(self, when, callback, *args):
+        """Call 'callback(*args)' at the datetime 'when'."""
+        delay = (when - self.clock.now()).total_seconds()
+        return self.call_later(max(delay, 0), callback, *args)
+
+    def cancel(self, timer):
+        """Cancel a timer, it is not an error if it already fired."""
+        self._wheel.cancel(timer)
+
+    def timeout(self):
+        """Return the seconds untill 'run_due' must be called, or None."""
+        ticks = self._wheel.ticks_until_next()
+        if ticks is None:
+            return None
+        next_tick = self._wheel.current_tick + ticks
+        return max(next_tick * self.resolution - self._elapsed(), 0)
+
+    def run_due(self):
+        """Run the callbacks of all timers that are due."""
+        target_tick = math.floor(self._elapsed() / self.resolution + 1e-9)
+        due = self._wheel.advance(target_tick)
+        for timer in sorted(due, key=lambda timer: timer.deadline_tick):
+            if not timer.cancelled:
+                timer.fire()
+
+    def _elapsed(self):
+        return self.clock.monotonic() - self._start
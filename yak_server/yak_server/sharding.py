@@ -0,0 +1,313 @@
+"""Run the server as several processes, each serving part of the devices.
+
+One Python process can only use one core for reading and translating
+events. In sharded mode the supervisor finds the devices and assigns
+them round robin to 'shard_count' worker processes, see 'plan_shards'.
+Every worker runs a 'ShardApplication', a normal application that
+only serves its own devices.
+
+Switches are routed to lamps over all devices, as in a single
+process. When a switch drives a lamp of another shard, the command
+goes through a 'ShmRing', a ring buffer in shared memory. There is a
+ring for every pair of shards, so every ring has one writer and one
+reader and needs no locks. Commands are encoded like frames of the
+network 'gateway'. Every shard has a doorbell, a semaphore released
+for every record pushed to one of its rings, which its receiving
+thread waits on.
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.shared_memory
+import struct
+
+from yak_server import gateway
+from yak_server import interface
+from yak_server import usbdevice
+from yak_server.__main__ import Application
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ShmRing:
+    """A single producer, single consumer ring of records in shared memory.
+
+    The ring holds 'capacity' records of at most 'record_size' bytes.
+    The header holds the number of records written and read so far,
+    each only changed by one side, followed by the capacity and record
+    size, so the other side can attach by name alone.
+    """
+
+    HEADER = struct.Struct('<QQII')
+    RECORD_LENGTH = struct.Struct('<H')
+    _HEAD = 0
+    _TAIL = 8
+
+    def __init__(self, memory, owner):
+        """Use 'memory', see 'create' and 'attach'."""
+        self._memory = memory
+        self._owner = owner
+        self._buffer = memory.buf
+        _, _, self.capacity, self.record_size = self.HEADER.unpack_from(
+            self._buffer)
+        self._slot_size = self.RECORD_LENGTH.size + self.record_size
+
+    @classmethod
+    def create(cls, capacity=1024, record_size=128):
+        """Create a new ring."""
+        size = cls.HEADER.size + capacity * (cls.RECORD_LENGTH.size +
+                                             record_size)
+        memory = multiprocessing.shared_memory.SharedMemory(create=True,
+                                                            size=size)
+        cls.HEADER.pack_into(memory.buf, 0, 0, 0, capacity, record_size)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to the ring created by another process."""
+        memory = multiprocessing.shared_memory.SharedMemory(name=name)
+        return cls(memory, owner=False)
+
+    @property
+    def name(self):
+        """Return the name to attach to the ring."""
+        return self._memory.name
+
+    def push(self, data):
+        """Add a record, return False if the ring is full."""
+        if len(data) > self.record_size:
+            raise ValueError('Record of {} bytes does not fit in {}.'.format(
+                len(data), self.record_size))
+        head = self._read_counter(self._HEAD)
+        if head - self._read_counter(self._TAIL) >= self.capacity:
+            return False
+        offset = self._slot_offset(head)
+        self.RECORD_LENGTH.pack_into(self._buffer, offset, len(data))
+        start = offset + self.RECORD_LENGTH.size
+        self._buffer[start:start + len(data)] = data
+        # Publish the record only after it was written.
+        self._write_counter(self._HEAD, head + 1)
+        return True
+
+    def pop(self):
+        """Remove and return the oldest record, or None if there is none."""
+        tail = self._read_counter(self._TAIL)
+        if tail == self._read_counter(self._HEAD):
+            return None
+        offset = self._slot_offset(tail)
+        length, = self.RECORD_LENGTH.unpack_from(self._buffer, offset)
+        start = offset + self.RECORD_LENGTH.size
+        data = bytes(self._buffer[start:start + length])
+        self._write_counter(self._TAIL, tail + 1)
+        return data
+
+    def close(self):
+        """Detach from the ring, removing it if this process created it."""
+        self._buffer.release()
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+    def _slot_offset(self, counter):
+        return self.HEADER.size + (counter % self.capacity) * self._slot_size
+
+    def _read_counter(self, offset):
+        return struct.unpack_from('<Q', self._buffer, offset)[0]
+
+    def _write_counter(self, offset, value):
+        struct.pack_into('<Q', self._buffer, offset, value)
+
+
+class Shard:
+    """The devices and rings of one worker process."""
+
+    def __init__(self, index, devices, routes, owners):
+        """Create shard 'index' serving the identifiers in 'devices'.
+
+        'routes' maps every input to the output it drives and 'owners'
+        every output to the index of its shard.
+        """
+        self.index = index
+        self.devices = frozenset(devices)
+        self.routes = routes
+        self.owners = owners
+        self.inbound = []
+        self.outbound = {}
+        self.doorbell = None
+        self.doorbells = {}
+
+
+def plan_shards(inputs, outputs, shard_count):
+    """Return the Shards for the given input and output identifiers.
+
+    Inputs drive outputs in order, wrapping around when there are more
+    inputs than outputs, like 'Application' does. Inputs and outputs
+    are each dealt round robin over the shards, so the work of reading
+    is spread evenly.
+    """
+    routes = {}
+    if outputs:
+        routes = {input_name: outputs[index % len(outputs)]
+                  for index, input_name in enumerate(inputs)}
+    owners = {output: index % shard_count
+              for index, output in enumerate(outputs)}
+    devices = [[] for _ in range(shard_count)]
+    for index, input_name in enumerate(inputs):
+        devices[index % shard_count].append(input_name)
+    for output, owner in owners.items():
+        devices[owner].append(output)
+    return [Shard(index, shard_devices, routes, owners)
+            for index, shard_devices in enumerate(devices)]
+
+
+class _ShardBackend:
+    """A device backend only finding the devices of one shard."""
+
+    def __init__(self, device_backend, identifiers):
+        self._device_backend = device_backend
+        self._identifiers = identifiers
+
+    def find(self, **search_parameters):
+        """Return the devices of the shard matching the parameters."""
+        return [device
+                for device in self._device_backend.find(**search_parameters)
+                if device.identifier in self._identifiers]
+
+
+class _RemoteOutput(interface.Interface):
+    """An output of another shard, reached through a ShmRing."""
+
+    def __init__(self, name, ring, doorbell):
+        self.name = name
+        self._ring = ring
+        self._doorbell = doorbell
+
+    def send_command(self, command):
+        """Pass a command to the shard of the output."""
+        frame = gateway.encode_frame(self.name, [command])
+        if not self._ring.push(frame):
+            _LOGGER.warning('Dropped command for %s, its shard falls '
+                            'behind.', self.name)
+            return
+        self._doorbell.release()
+
+
+class ShardApplication(Application):
+    """The application of one worker process.
+
+    Commands for outputs of other shards are passed to them through
+    the shard rings, commands from other shards are sent to the own
+    outputs from the main loop, see 'submit_commands'.
+    """
+
+    def __init__(self, shard, **kwargs):
+        """Create the application for 'shard', see Application."""
+        super().__init__(**kwargs)
+        self.shard = shard
+        self._remote_outputs = {}
+
+    def setup(self):
+        """Initialize the application and start receiving from shards."""
+        super().setup()
+        self._start_thread(self._receive_remote_commands)
+
+    def _default_routes(self):
+        local_outputs = {output_interface.name: output_interface
+                         for output_interface in self.output_interfaces}
+        routes = {}
+        for input_interface in self.input_interfaces:
+            output = self.shard.routes.get(input_interface.name)
+            if output is None:
+                continue
+            routes[input_interface.name] = local_outputs.get(
+                output) or self._remote_output(output)
+        return routes
+
+    def _remote_output(self, name):
+        if name not in self._remote_outputs:
+            owner = self.shard.owners[name]
+            self._remote_outputs[name] = _RemoteOutput(
+                name, self.shard.outbound[owner], self.shard.doorbells[owner])
+        return self._remote_outputs[name]
+
+    def _output_interface(self, device):
+        if device in self._remote_outputs:
+            return self._remote_outputs[device]
+        return super()._output_interface(device)
+
+    def _receive_remote_commands(self):
+        while True:
+            # Every ring of the shard rings the doorbell once per
+            # record, so after waiting one of them has a record.
+            self.shard.doorbell.acquire()
+            frame = None
+            while frame is None:
+                for ring in self.shard.inbound:
+                    frame = ring.pop()
+                    if frame is not None:
+                        break
+            device, commands = gateway.decode_frame(frame)
+            self.submit_commands(type(command)(command, device=device)
+                                 for command in commands)
+
+
+def attach_rings(shard, ring_names, doorbells):
+    """Attach a shard to its rings, given by name per (from, to) pair.
+
+    'doorbells' holds the doorbell of every shard.
+    """
+    shard.doorbell = doorbells[shard.index]
+    for (source, target), name in ring_names.items():
+        if target == shard.index:
+            shard.inbound.append(ShmRing.attach(name))
+        elif source == shard.index:
+            shard.outbound[target] = ShmRing.attach(name)
+            shard.doorbells[target] = doorbells[target]
+
+
+def run_shard(shard, ring_names, doorbells, backend_factory=None):
+    """Run the worker process of a shard.
+
+    The devices are found through the backend made by
+    'backend_factory()', by default pyusb.
+    """
+    attach_rings(shard, ring_names, doorbells)
+    device_backend = backend_factory() if backend_factory else usbdevice
+    application = ShardApplication(
+        shard, device_backend=_ShardBackend(device_backend, shard.devices))
+    application.setup()
+    application.main_loop()
+
+
+def run_sharded(shard_count, backend_factory=None):
+    """Find the devices and serve them from 'shard_count' processes.
+
+    Return when all worker processes stopped.
+    """
+    device_backend = backend_factory() if backend_factory else usbdevice
+    manager = interface.InterfaceManager
+    inputs = sorted(device.identifier for device in
+                    device_backend.find(**manager.INPUT_SEARCH))
+    outputs = sorted(device.identifier for device in
+                     device_backend.find(**manager.OUTPUT_SEARCH))
+    shards = plan_shards(inputs, outputs, shard_count)
+    rings = {(source, target): ShmRing.create()
+             for source in range(shard_count)
+             for target in range(shard_count) if source != target}
+    ring_names = {pair: ring.name for pair, ring in rings.items()}
+    doorbells = [multiprocessing.Semaphore(0) for _ in range(shard_count)]
+    workers = [multiprocessing.Process(
+        target=run_shard,
+        args=(shard, ring_names, doorbells, backend_factory),
+        name='shard-{}'.format(shard.index)) for shard in shards]
+    for shard, worker in zip(shards, workers):
+        worker.start()
+        _LOGGER.info('Started %s with %d devices.', worker.name,
+                     len(shard.devices))
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for ring in rings.values():
+            ring.close()
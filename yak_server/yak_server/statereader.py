@@ -0,0 +1,100 @@
+"""Read the device state table of a running server.
+
+The server publishes the state of its devices in a 'statetable'
+file. This module maps that file read only and reads slots without
+any locking, so it can be polled from any process::
+
+    reader = statereader.StateReader()
+    if reader.read('1-2').on:
+        ...
+"""
+
+import datetime
+import mmap
+
+import ezvalue
+
+from yak_server import statetable
+
+
+class TableError(Exception):
+    """The file is not a state table."""
+
+
+class DeviceState(ezvalue.Value):
+    """The state of one channel of a device."""
+
+    device = 'Identifier of the device.'
+    channel = 'Channel of the device.'
+    kind = 'statetable.SWITCH or statetable.LAMP.'
+    on = 'True if the switch is pressed or the lamp is on.'
+    changed = 'Datetime of the last change.'
+
+
+class StateReader:
+    """Read the state table at 'path'.
+
+    A read retries untill it sees a slot that was not being written,
+    see 'statetable'. Slots never move, so the slot of a device is
+    looked up once.
+    """
+
+    def __init__(self, path=None):
+        """Map the table, by default the one at its default path."""
+        with open(path or statetable.default_path(), 'rb') as table_file:
+            self._map = mmap.mmap(table_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        header = statetable.HEADER.unpack_from(self._map)
+        magic, version, slot_size, slot_count = header
+        if (magic != statetable.MAGIC or version != statetable.VERSION or
+                slot_size != statetable.SLOT_SIZE):
+            raise TableError('Not a version {} state table.'.format(
+                statetable.VERSION))
+        self.slot_count = slot_count
+        self._indexes = {}
+
+    def close(self):
+        """Unmap the table."""
+        self._map.close()
+
+    def read(self, device, channel=0):
+        """Return the DeviceState of a device channel, None if unknown."""
+        index = self._indexes.get((device, channel))
+        if index is None:
+            self._index_slots()
+            index = self._indexes.get((device, channel))
+            if index is None:
+                return None
+        return self._read_slot(index)
+
+    def read_all(self):
+        """Return the DeviceStates of all devices."""
+        self._index_slots()
+        return [self._read_slot(index)
+                for index in sorted(self._indexes.values())]
+
+    def _index_slots(self):
+        for index in range(len(self._indexes), self.slot_count):
+            state = self._read_slot(index)
+            if state is None:
+                return
+            self._indexes[state.device, state.channel] = index
+
+    def _read_slot(self, index):
+        offset = statetable.slot_offset(index)
+        while True:
+            before, = statetable.SEQUENCE.unpack_from(self._map, offset)
+            if before % 2:
+                continue
+            fields = statetable.SLOT.unpack_from(
+                self._map, offset + statetable.SEQUENCE.size)
+            after, = statetable.SEQUENCE.unpack_from(self._map, offset)
+            if before == after:
+                break
+        name, channel, kind, on, changed = fields
+        name = name.rstrip(b'\0')
+        if not name:
+            return None
+        return DeviceState(device=name.decode('utf-8', 'ignore'),
+                           channel=channel, kind=kind, on=bool(on),
+                           changed=datetime.datetime.fromtimestamp(changed))
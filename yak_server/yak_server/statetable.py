@@ -0,0 +1,121 @@
+"""Publish the state of every device in shared memory.
+
+The 'StateTable' is a memory mapped file with a fixed layout: a
+HEADER followed by 'slot_count' slots. There is one slot per device
+and channel, holding whether the switch is pressed or the lamp is on
+and when that last changed. Other processes map the same file and
+read it without any locking or messages, see 'statereader'.
+
+Every slot starts with a sequence number, which makes it a seqlock:
+the writer makes the number odd before it changes the slot and even
+again afterwards. A reader reads the number, the slot and the number
+again, and retries if the number was odd or changed in between. There
+is one writer, the application, so writers need no lock either.
+"""
+
+import logging
+import mmap
+import os
+import os.path
+import struct
+import tempfile
+
+from yak_server import events
+from yak_server import ratelimit
+
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'YAKSTATE'
+VERSION = 1
+
+# Magic, version, size of a slot and number of slots.
+HEADER = struct.Struct('<8sHHI')
+SEQUENCE = struct.Struct('<I')
+# After the sequence number: device name, channel, kind, on and the
+# POSIX time of the last change. A slot with an empty name is free,
+# names are cut off after 32 bytes.
+SLOT = struct.Struct('<32sHBBd')
+SLOT_SIZE = SEQUENCE.size + SLOT.size
+
+SWITCH = 0
+LAMP = 1
+
+
+def default_path():
+    """Return the default path of the table, in shared memory if possible."""
+    directory = '/dev/shm'
+    if not os.path.isdir(directory):
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, 'yak_server-state')
+
+
+def slot_offset(index):
+    """Return the offset of a slot in the table."""
+    return HEADER.size + index * SLOT_SIZE
+
+
+class StateTable:
+    """Write the state of every device to a shared memory table.
+
+    'channel_of' maps a command or event to the channel of its device,
+    like for 'ratelimit.RateLimiter'.
+    """
+
+    def __init__(self, path=None, slot_count=256,
+                 channel_of=ratelimit.single_channel):
+        """Create, or replace, the table at 'path'."""
+        self.path = path or default_path()
+        self.slot_count = slot_count
+        self.channel_of = channel_of
+        self._slots = {}
+        self._full = False
+        size = slot_offset(slot_count)
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                             0o644)
+        try:
+            os.ftruncate(descriptor, size)
+            self._map = mmap.mmap(descriptor, size)
+        finally:
+            os.close(descriptor)
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, SLOT_SIZE,
+                         slot_count)
+
+    def close(self):
+        """Unmap the table, the file is left for readers."""
+        self._map.close()
+
+    def update(self, kind, event):
+        """Store the state a button or lamp event leaves its device in."""
+        if isinstance(event, events.ButtonDownEvent):
+            on = True
+        elif isinstance(event, events.ButtonUpEvent):
+            on = False
+        else:
+            return
+        channel = self.channel_of(event)
+        index = self._slot(str(event.device), channel)
+        if index is None:
+            return
+        offset = slot_offset(index)
+        sequence, = SEQUENCE.unpack_from(self._map, offset)
+        SEQUENCE.pack_into(self._map, offset, (sequence + 1) & 0xffffffff)
+        SLOT.pack_into(self._map, offset + SEQUENCE.size,
+                       str(event.device).encode('utf-8'), channel, kind, on,
+                       event.timestamp.timestamp())
+        SEQUENCE.pack_into(self._map, offset, (sequence + 2) & 0xffffffff)
+
+    def _slot(self, device, channel):
+        try:
+            return self._slots[device, channel]
+        except KeyError:
+            pass
+        if len(self._slots) == self.slot_count:
+            if not self._full:
+                _LOGGER.warning('State table %s is full, state of %s '
+                                'and later devices is not published.',
+                                self.path, device)
+                self._full = True
+            return None
+        index = self._slots[device, channel] = len(self._slots)
+        return index
@@ -0,0 +1,212 @@
+"""Keep USB devices connected.
+
+A 'SupervisedDevice' wraps a 'usbdevice.USBDevice' and provides the
+same interface. When a transfer finds the device gone, the
+supervisor marks it disconnected and a thread of its own reconnects
+it, waiting longer after every failed attempt (exponential backoff,
+with random jitter so boards on a shared hub do not all retry at
+once). Reads of a disconnected device block untill it is back, and
+writes are remembered instead of sent, as are writes that failed.
+After reconnecting, the last data written to the device is written
+again so the output is in the state the server last asked for.
+
+Only the reader thread of the device itself waits on a disconnected
+device, events from other devices keep flowing.
+"""
+
+import logging
+import random
+import threading
+
+from yak_server import clock
+from yak_server import usbdevice
+
+
+_LOGGER = logging.getLogger(__name__)
+
+CONNECTED = 'connected'
+DISCONNECTED = 'disconnected'
+RECONNECTING = 'reconnecting'
+
+
+class SupervisedDevice:
+    """A USB device that reconnects by itself when it is lost.
+
+    'rediscover' is called before every reconnect attempt and returns
+    the device to connect to, since a device that was unplugged comes
+    back as a new device object. It raises USBError if the device is
+    not there. By default the same device object is connected again.
+    Every state change is logged and passed to
+    'listener(identifier, old_state, new_state)' if one is given.
+
+    The maximum packet size of the device is remembered, so commands
+    can be packed while it is not connected. Before it was ever
+    connected DEFAULT_MAX_PACKET_SIZE is used, the packet size of the
+    yak firmware; a smaller packet than the device takes is still
+    sent correctly.
+    """
+
+    DEFAULT_MAX_PACKET_SIZE = 8
+
+    def __init__(self, usb_device, rediscover=None, listener=None,
+                 initial_delay=0.1, max_delay=30.0, jitter=0.5,
+                 supervisor_clock=None, rng=None):
+        """Wrap 'usb_device', which is not connected yet."""
+        self.usb_device = usb_device
+        self.identifier = usb_device.identifier
+        self.state = DISCONNECTED
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.clock = supervisor_clock or clock.get_clock()
+        self._rediscover = rediscover or (lambda: self.usb_device)
+        self._listener = listener
+        self._rng = rng or random.Random()
+        self._condition = threading.Condition()
+        self._last_written = None
+        self._max_packet_size = self.DEFAULT_MAX_PACKET_SIZE
+
+    def __getattr__(self, name):
+        return getattr(self.usb_device, name)
+
+    def connect(self):
+        """Connect to the device, raising USBError if that fails.
+
+        Data written before the device was connected is written now.
+        """
+        self.usb_device.connect()
+        self._connected(self.usb_device)
+        self._report(DISCONNECTED, CONNECTED)
+
+    def connect_later(self):
+        """Keep trying to connect from the reconnect thread.
+
+        For a device whose first connect failed. Reads wait and writes
+        are remembered untill it is connected.
+        """
+        with self._condition:
+            if self.state != DISCONNECTED:
+                return
+        self._start_reconnect()
+
+    @property
+    def max_packet_size(self):
+        """Return the packet size of the device, or the last one known."""
+        with self._condition:
+            return self._max_packet_size
+
+    def read(self, number_of_bytes, timeout=None):
+        """Read from the device, waiting while it is disconnected.
+
+        A read that finds the device gone waits for it to be back and
+        reads again. If 'timeout' is given and the device is not back
+        in time, an empty bytes object is returned.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = self.clock.monotonic() + timeout
+        while True:
+            usb_device = self._wait_until_connected(deadline)
+            if usb_device is None:
+                return b''
+            try:
+                if timeout is None:
+                    return usb_device.read(number_of_bytes)
+                return usb_device.read(number_of_bytes, timeout=timeout)
+            except usbdevice.DeviceDisconnected:
+                self._lost(usb_device)
+
+    def write(self, data):
+        """Write to the device, or remember the data if it is gone.
+
+        Return the number of bytes written, 0 if the device is
+        disconnected or the write failed. The data is written again
+        once the device is reconnected.
+        """
+        with self._condition:
+            self._last_written = data
+            if self.state != CONNECTED:
+                _LOGGER.warning('Device %s is %s, keeping %s for later.',
+                                self.identifier, self.state, data)
+                return 0
+            usb_device = self.usb_device
+        try:
+            return usb_device.write(data)
+        except usbdevice.DeviceDisconnected:
+            self._lost(usb_device)
+        except usbdevice.USBError as exception:
+            _LOGGER.error('Writing %s to device %s failed: %s', data,
+                          self.identifier, exception)
+        return 0
+
+    def _wait_until_connected(self, deadline):
+        """Return the connected device, None if 'deadline' passed first."""
+        with self._condition:
+            while self.state != CONNECTED:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - self.clock.monotonic()
+                    if timeout <= 0:
+                        return None
+                self._condition.wait(timeout)
+            return self.usb_device
+
+    def _lost(self, usb_device):
+        with self._condition:
+            if self.state != CONNECTED or usb_device is not self.usb_device:
+                return
+            self.state = DISCONNECTED
+        self._report(CONNECTED, DISCONNECTED)
+        self._start_reconnect()
+
+    def _start_reconnect(self):
+        thread = threading.Thread(target=self._reconnect, daemon=True,
+                                  name='reconnect-{}'.format(self.identifier))
+        thread.start()
+
+    def _reconnect(self):
+        """Try to connect untill it works, then replay the last write."""
+        delay = self.initial_delay
+        self._set_state(RECONNECTING)
+        while True:
+            self.clock.sleep(self._with_jitter(delay))
+            try:
+                usb_device = self._rediscover()
+                usb_device.connect()
+                self._connected(usb_device)
+            except usbdevice.USBError as exception:
+                _LOGGER.info('Reconnecting %s failed: %s', self.identifier,
+                             exception)
+                delay = min(delay * 2, self.max_delay)
+                continue
+            self._report(RECONNECTING, CONNECTED)
+            return
+
+    def _connected(self, usb_device):
+        """Replay the last write and start using 'usb_device'."""
+        with self._condition:
+            if self._last_written is not None:
+                usb_device.write(self._last_written)
+            try:
+                self._max_packet_size = usb_device.max_packet_size
+            except usbdevice.USBError:
+                pass  # An input, it has no OUT endpoint.
+            self.usb_device = usb_device
+            self.state = CONNECTED
+            self._condition.notify_all()
+
+    def _with_jitter(self, delay):
+        return delay * (1 + self.jitter * self._rng.uniform(-1, 1))
+
+    def _set_state(self, state):
+        with self._condition:
+            old_state, self.state = self.state, state
+            self._condition.notify_all()
+        if old_state != state:
+            self._report(old_state, state)
+
+    def _report(self, old_state, new_state):
+        level = logging.WARNING if new_state == DISCONNECTED else logging.INFO
+        _LOGGER.log(level, 'Device %s %s.', self.identifier, new_state)
+        if self._listener:
+            self._listener(self.identifier, old_state, new_state)
@@ -1,9 +1,40 @@
-"""Defines translators for various interfaces."""
+"""Defines translators for various interfaces.
+
+Translators for devices that are not built in are plugins, registered
+as entry points in the ENTRY_POINT_GROUP group. The name of the entry
+point is the device class id as given by 'format_class_id', the value
+points to the translator class. A plugin is only imported when a
+device of its class is found.
+"""
+
+import importlib
 
 from yak_server import events
 from yak_server import usbdevice
 
 
+ENTRY_POINT_GROUP = 'yak_server.translators'
+
+
+def format_class_id(device_class_id):
+    """Return a device class id as 'vendor:product:release' in hex."""
+    return '{:04x}:{:04x}:{:04x}'.format(device_class_id.vendor_id,
+                                         device_class_id.product_id,
+                                         device_class_id.release_number)
+
+
+def translator_path(translator_class):
+    """Return the 'module:Class' path of a translator class."""
+    return '{}:{}'.format(translator_class.__module__,
+                          translator_class.__qualname__)
+
+
+def load_translator_class(path):
+    """Import and return the translator class at a 'module:Class' path."""
+    module_name, _, class_name = path.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
 class LookupTable(dict):
     """One to one mapping with forward and reverse lookup."""
 
@@ -29,11 +60,32 @@ class TranslatorFactory:
 
     def create_usb_translator(self, device):
         """Create a translator for a USB interface."""
-        TranslatorClass = self._usb_translator_class(device.class_identifier)
+        TranslatorClass = self.usb_translator_class(device.class_identifier)
         return TranslatorClass()
 
-    def _usb_translator_class(self, device_class_identifier):
-        return self._usb_translator_map[device_class_identifier]
+    def usb_translator_class(self, device_class_identifier):
+        """Return the translator class for a device class.
+
+        Built in translators are found first, plugins are imported on
+        demand. Raise KeyError if there is no translator.
+        """
+        try:
+            return self._usb_translator_map[device_class_identifier]
+        except KeyError:
+            return self._plugin_translator_class(device_class_identifier)
+
+    @staticmethod
+    def _plugin_translator_class(device_class_identifier):
+        # Imported here, it takes a good part of the startup time and
+        # is only needed for devices without a built in translator.
+        # pylint: disable = import-outside-toplevel
+        import importlib.metadata
+        name = format_class_id(device_class_identifier)
+        entry_points = importlib.metadata.entry_points(
+            group=ENTRY_POINT_GROUP, name=name)
+        for entry_point in entry_points:
+            return entry_point.load()
+        raise KeyError(device_class_identifier)
 
     @property
     def _usb_translator_map(self):
@@ -71,6 +123,16 @@ class Translator:
         """Translate and event to raw data."""
         raise NotImplementedError()
 
+    def events_to_raw_packets(self, event_list, max_packet_size):
+        """Translate a list of events to a list of raw packets.
+
+        Translators of devices that accept several commands in one
+        transfer pack as many events as fit in 'max_packet_size' bytes
+        in each packet. By default every event is a packet of its own.
+        """
+        # pylint: disable = unused-argument
+        return [self.event_to_raw_data(event) for event in event_list]
+
     @staticmethod
     def _check_raw_data_type(raw_data):
         if not isinstance(raw_data, bytes):
@@ -103,6 +165,7 @@ class LookupTranslator(Translator):
     """
 
     TRANSLATION_TABLE = None
+    BATCH_MARKER = None
 
     def raw_data_to_event(self, raw_data):
         """Translate raw data to the corresponding event.
@@ -124,6 +187,27 @@ class LookupTranslator(Translator):
         except KeyError:
             self._handle_unknown_event(event)
 
+    def events_to_raw_packets(self, event_list, max_packet_size):
+        """Translate a list of events to a list of raw packets.
+
+        If the class defines a BATCH_MARKER, events are packed into
+        packets made up of the marker followed by the raw data of as
+        many events as fit in 'max_packet_size'. A single event is
+        sent on its own, without the marker.
+        """
+        if self.BATCH_MARKER is None or len(event_list) < 2:
+            return super().events_to_raw_packets(event_list, max_packet_size)
+        packets = []
+        packet = self.BATCH_MARKER
+        for event in event_list:
+            raw_data = self.event_to_raw_data(event)
+            if len(packet) + len(raw_data) > max_packet_size:
+                packets.append(packet)
+                packet = self.BATCH_MARKER
+            packet += raw_data
+        packets.append(packet)
+        return packets
+
     @staticmethod
     def maximum_data_length():
         """Return the maximum data length expected from the device."""
@@ -156,3 +240,16 @@ class ACInterfaceTranslator(LookupTranslator, USBTranslator):
     TRANSLATION_TABLE = LookupTable({
         b'\x00': events.LampOffEvent,
         b'\x01': events.LampOnEvent})
+
+
+class ACInterfaceTranslatorV0_0_2(ACInterfaceTranslator):
+    """Translate messages for the 230V interface with batch support.
+
+    A packet starting with BATCH_MARKER holds several commands, which
+    the firmware applies in order.
+    """
+
+    DEVICE_CLASS_ID = usbdevice.DeviceClassID(vendor_id=0x04d8,
+                                              product_id=0x5901,
+                                              release_number=0x0002)
+    BATCH_MARKER = b'\xba'
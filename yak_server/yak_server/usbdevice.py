@@ -1,15 +1,53 @@
 """Defines abstractions for USB devices."""
 
 
+import errno
+import importlib.util
 import logging
-import usb
+import sys
 
 import ezvalue
 
+from yak_server import clock
+from yak_server import devicelog
+
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _lazy_import(name):
+    """Return a module that is only loaded when it is first used.
+
+    Loading pyusb takes a good part of the startup time, and it is not
+    needed at all with other device backends.
+    """
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+usb = _lazy_import('usb')
+
+
+# The direction bit of an endpoint address, as in usb.util.
+ENDPOINT_DIRECTION_MASK = 0x80
+ENDPOINT_IN = 0x80
+
+# The vendor request the firmware answers with its current state, in
+# the format of the data it sends when the state changes. It is a
+# device to host vendor request to the device (bmRequestType 0xC0).
+GET_STATE = 0x01
+GET_STATE_REQUEST_TYPE = 0xC0
+
+
 class USBError(Exception):
     """Generic USB exception."""
 
@@ -18,6 +56,15 @@ class IncompleteUSBWrite(USBError):
     """Not all data could be written to the USB device."""
 
 
+class DeviceDisconnected(USBError):
+    """The USB device is no longer there."""
+
+
+def _is_disconnect(exception):
+    """Return True if a transfer error means the device is gone."""
+    return exception.errno == errno.ENODEV
+
+
 def _translate_search_parameters(search_parameters):
     """Translate search parameters into kwargs for pyusb."""
     parameter_translation_table = {'product_id': 'idProduct',
@@ -50,7 +97,7 @@ def find(**search_parameters):
     devices = tuple(USBDevice(raw_device) for raw_device in raw_devices)
 
     for device in devices:
-        _LOGGER.info('Found usb device: %s', device.device_info())
+        device.log.info('Found usb device: {device}')
 
     return devices
 
@@ -78,72 +125,210 @@ class DeviceClassID(ezvalue.Value):
 def _managed(message_template):
     """Manage execution of the decorated function.
 
-    The function call will be logged and any exceptions from pyusb
-    will be logged and reraised as our own USBError.
+    The function call will be logged and any exceptions from the
+    transport will be logged and reraised as our own USBError.
     """
     # pylint: disable = protected-access
     def outer(function):
         def wrapper(self, *args, **kwargs):
-            _LOGGER.info(self._format_message(message_template))
+            self.log.info(message_template, interface=self.INTERFACE)
             try:
                 return function(self, *args, **kwargs)
-            except usb.core.USBError as exception:
+            except OSError as exception:
                 self._handle_exception(message_template, exception)
         return wrapper
     return outer
 
 
+class PyusbTransport:
+    """Claim devices and transfer data through pyusb.
+
+    A transport opens a device for a USBDevice and makes the Endpoints
+    that do its transfers. Transports raise OSErrors, with errno ENODEV
+    when the device is gone, like pyusb does: its USBError is an
+    OSError. See 'usbfs' for a transport without pyusb.
+    """
+
+    def __init__(self, raw_device):
+        """Create the transport of a pyusb device."""
+        self.raw_device = raw_device
+
+    def is_kernel_driver_active(self, interface):
+        """Return True if a kernel driver is bound to an interface."""
+        return self.raw_device.is_kernel_driver_active(interface)
+
+    def detach_kernel_driver(self, interface):
+        """Unbind the kernel driver from an interface."""
+        self.raw_device.detach_kernel_driver(interface)
+
+    def set_configuration(self):
+        """Select the first configuration of the device."""
+        self.raw_device.set_configuration()
+
+    def claim_interface(self, interface):
+        """Claim an interface for the transfers."""
+        usb.util.claim_interface(self.raw_device, interface)
+
+    def endpoint(self, raw_endpoint):
+        """Return the Endpoint for a pyusb endpoint descriptor."""
+        return Endpoint(raw_endpoint)
+
+    def control_read(self, request_type, request, value, index, length):
+        """Do a device to host control transfer, return the data read."""
+        return bytes(self.raw_device.ctrl_transfer(request_type, request,
+                                                   value, index, length))
+
+    def close(self):
+        """Release the resources pyusb holds for the device."""
+        usb.util.dispose_resources(self.raw_device)
+
+
+class Endpoint:
+    """A USB endpoint with its address, direction and packet size cached.
+
+    Reading the descriptor fields of a pyusb endpoint is cheap, but
+    the values never change while a device is connected, so they are
+    looked up once.
+    """
+
+    def __init__(self, raw_endpoint):
+        """Wrap a pyusb endpoint."""
+        self.raw_endpoint = raw_endpoint
+        self.address = raw_endpoint.bEndpointAddress
+        self.direction = self.address & ENDPOINT_DIRECTION_MASK
+        self.max_packet_size = raw_endpoint.wMaxPacketSize
+
+    def is_in(self):
+        """Return True for an IN (device to host) endpoint."""
+        return self.direction == ENDPOINT_IN
+
+    def read(self, number_of_bytes):
+        """Read from the endpoint."""
+        return self.raw_endpoint.read(number_of_bytes)
+
+    def write(self, data):
+        """Write to the endpoint."""
+        return self.raw_endpoint.write(data)
+
+
 class USBDevice:
-    """Provide an interface to a connected USB device."""
+    """Provide an interface to a connected USB device.
+
+    The device uses the first IN and the first OUT endpoint of its
+    interface. Reads only use the IN endpoint and writes only the OUT
+    endpoint, so a read and a write can be in progress at the same
+    time.
+    """
 
     INTERFACE = 0
-    IN_ENDPOINT = 0
+    # The direction of this endpoint tells if the device is an input
+    # or an output.
+    PRIMARY_ENDPOINT = 0
 
-    def __init__(self, raw_device):
-        """Initialize the device given a pyusb device."""
+    def __init__(self, raw_device, device_clock=None, transport=None):
+        """Initialize the device given a pyusb device.
+
+        Read timeouts are measured with 'device_clock', which defaults
+        to the default clock. The device is claimed and transferred to
+        through the transport made by 'transport(raw_device)', by
+        default a PyusbTransport.
+        """
         self.raw_device = raw_device
-        self._endpoint = None
+        self.transport = (transport or PyusbTransport)(raw_device)
+        self._clock = device_clock or clock.get_clock()
+        self.log = devicelog.DeviceLog(_LOGGER, self._describe,
+                                       log_clock=self._clock)
+        self._in_endpoint = None
+        self._out_endpoint = None
+        self._is_input = None
+        self._capture = None
 
     def connect(self):
         """Connect to the usb device.
 
         Detach the kernel driver if it is attached and then claim
         the interface. This must be done before calling any of the other
-        methods of this class. Changes to the INTERFACE and IN_ENDPOINT
-        attributes after this point are not supported.
+        methods of this class. Changes to the INTERFACE and
+        PRIMARY_ENDPOINT attributes after this point are not supported.
         """
         self._detach_kernel_driver_if_attached()
         self._set_configuration()
         self._claim_interface()
-        self._endpoint = self._get_endpoint()
+        self._get_endpoints()
 
     def is_input(self):
         """Return if the device is an input."""
-        endpoint_address = self._endpoint.bEndpointAddress
-        direction = usb.util.endpoint_direction(endpoint_address)
-        return direction == usb.util.ENDPOINT_IN
+        return self._is_input
 
     def is_output(self):
         """Return if the device is an output."""
         return not self.is_input()
 
+    def start_capture(self, capture_writer):
+        """Record all reads and writes to the given capture writer.
+
+        The writer should provide 'record_read' and 'record_write'
+        methods, see 'yak_server.capture.CaptureWriter'.
+        """
+        self._capture = capture_writer
+
+    def stop_capture(self):
+        """Stop recording reads and writes."""
+        self._capture = None
+
+    @property
+    def max_packet_size(self):
+        """Return the maximum packet size of a write."""
+        return self._endpoint_for_writing().max_packet_size
+
     def flush(self):
-        """Flush the input buffer."""
+        """Flush the input buffer.
+
+        Every read asks for a full packet, so each transfer drains
+        all data of a packet at once, untill nothing is left.
+        """
+        endpoint = self._endpoint_for_reading()
         try:
-            while self._endpoint.read(1):
+            while endpoint.read(endpoint.max_packet_size):
                 pass
-        except usb.core.USBError:
+        except OSError:
             pass
 
-    def read(self, number_of_bytes):
+    def query_state(self, number_of_bytes):
+        """Return the current state of the device, as the firmware tells.
+
+        The state is asked with the GET_STATE vendor request, so it
+        is known right away instead of when it next changes. USBError
+        is raised if the firmware does not answer the request and
+        DeviceDisconnected if the device is gone.
+        """
+        try:
+            return self.transport.control_read(
+                GET_STATE_REQUEST_TYPE, GET_STATE, 0, self.INTERFACE,
+                number_of_bytes)
+        except OSError as exception:
+            if _is_disconnect(exception):
+                self._handle_disconnect('querying', exception)
+            raise USBError(self._format_message(
+                'Device {device} did not report its state: {exception}',
+                exception=exception)) from exception
+
+    def read(self, number_of_bytes, timeout=None):
         """Read a number of bytes from the device.
 
         If there is no data to be read an empty bytes object is
         returned. The 'number_of_bytes' arguments gives the maximum
         number of bytes to read. The function will block untill that
-        number of bytes has been received.
+        number of bytes has been received, or, if 'timeout' is given,
+        untill that many seconds have passed on the device clock. In
+        that case the data received so far is returned.
+        DeviceDisconnected is raised if the device is gone.
         """
-        return self._read_blocking(number_of_bytes)
+        self._endpoint_for_reading()
+        data = self._read_blocking(number_of_bytes, timeout)
+        if self._capture:
+            self._capture.record_read(data)
+        return data
 
     def write(self, data):
         """Write the given bytes to the device.
@@ -151,12 +336,15 @@ class USBDevice:
         Return the number of bytes written. An exception is raised if
         not all data could be written.
         """
+        endpoint = self._endpoint_for_writing()
         try:
-            bytes_written = self._endpoint.write(data)
+            bytes_written = endpoint.write(data)
+            if self._capture:
+                self._capture.record_write(data[:bytes_written])
             if bytes_written != len(data):
                 self._handle_incomplete_write(bytes_written, data)
             return bytes_written
-        except usb.core.USBError as exception:
+        except OSError as exception:
             self._handle_write_exception(exception)
 
     @property
@@ -166,62 +354,116 @@ class USBDevice:
                              product_id=self.raw_device.idProduct,
                              release_number=self.raw_device.bcdDevice)
 
+    @property
+    def identifier(self):
+        """Return an identifier for the physical device.
+
+        The identifier is made up of the bus number and the port path
+        (like '1-2.3'), so it stays the same when the device is
+        plugged back into the same port.
+        """
+        port_numbers = getattr(self.raw_device, 'port_numbers', None)
+        if port_numbers:
+            port_path = '.'.join(str(port) for port in port_numbers)
+        else:
+            port_path = 'a{}'.format(self.raw_device.address)
+        return '{}-{}'.format(self.raw_device.bus, port_path)
+
     def device_info(self):
         """Return a string containing device information."""
+        return self.log.description()
+
+    def _describe(self):
         return repr(self.raw_device)
 
-    def _read_blocking(self, number_of_bytes):
+    def _read_blocking(self, number_of_bytes, timeout=None):
+        deadline = None
+        if timeout is not None:
+            deadline = self._clock.monotonic() + timeout
         data = b''
         while len(data) < number_of_bytes:
+            if deadline is not None and self._clock.monotonic() >= deadline:
+                break
             bytes_remaining = number_of_bytes - len(data)
             data += self._read_non_blocking(bytes_remaining)
         return data
 
     def _read_non_blocking(self, number_of_bytes):
         try:
-            return bytes(self._endpoint.read(number_of_bytes))
-        except usb.core.USBError:
+            return bytes(self._in_endpoint.read(number_of_bytes))
+        except OSError as exception:
+            if _is_disconnect(exception):
+                self._handle_disconnect('reading from', exception)
             return b''
 
     def _handle_incomplete_write(self, bytes_written, data):
-        msg = 'Not all data written to interface {} of device {}.'.format(
-            self.INTERFACE, self.device_info())
-        msg2 = 'Tried to write {} bytes ({}), but only wrote {}.'.format(
-            len(data), data, bytes_written)
-        _LOGGER.error(msg)
-        _LOGGER.error(msg2)
-        raise IncompleteUSBWrite(msg)
+        template = ('Not all data written to interface {interface} of '
+                    'device {device}.')
+        self.log.error(template + ' Tried to write {length} bytes ({data}), '
+                       'but only wrote {written}.', interface=self.INTERFACE,
+                       length=len(data), data=data, written=bytes_written)
+        raise IncompleteUSBWrite(self._format_message(template))
+
+    def _handle_disconnect(self, action, exception):
+        template = ('Device {device} disconnected while {action} it: '
+                    '{exception}')
+        self.log.error(template, action=action, exception=exception)
+        raise DeviceDisconnected(self._format_message(
+            template, action=action, exception=exception)) from exception
 
     def _handle_write_exception(self, exception):
-        msg = 'Error when writing to interface {} of device {}: {}'.format(
-            self.INTERFACE, self.device_info(), str(exception))
-        _LOGGER.error(msg)
-        raise USBError(msg) from exception
+        if _is_disconnect(exception):
+            self._handle_disconnect('writing to', exception)
+        template = ('Error when writing to interface {interface} of '
+                    'device {device}: {exception}')
+        self.log.error(template, interface=self.INTERFACE,
+                       exception=exception)
+        raise USBError(self._format_message(
+            template, exception=exception)) from exception
 
     def _detach_kernel_driver_if_attached(self):
         if self._is_kernel_driver_attached():
             self._detach_kernel_driver()
 
     def _is_kernel_driver_attached(self):
-        return self.raw_device.is_kernel_driver_active(self.INTERFACE)
+        return self.transport.is_kernel_driver_active(self.INTERFACE)
 
     @_managed('detaching kernel driver for interface {interface} of ' +
               'device {device}')
     def _detach_kernel_driver(self):
-        self.raw_device.detach_kernel_driver(self.INTERFACE)
+        self.transport.detach_kernel_driver(self.INTERFACE)
 
     @_managed('setting configuration for device {device}')
     def _set_configuration(self):
-        self.raw_device.set_configuration()
+        self.transport.set_configuration()
 
     @_managed('claiming interface {interface} of device {device}')
     def _claim_interface(self):
-        usb.util.claim_interface(self.raw_device, self.INTERFACE)
+        self.transport.claim_interface(self.INTERFACE)
 
-    def _get_endpoint(self):
+    def _get_endpoints(self):
         active_configuration = self.raw_device.get_active_configuration()
         interface = active_configuration.interfaces()[self.INTERFACE]
-        return interface.endpoints()[self.IN_ENDPOINT]
+        endpoints = [self.transport.endpoint(raw_endpoint)
+                     for raw_endpoint in interface.endpoints()]
+        self._is_input = endpoints[self.PRIMARY_ENDPOINT].is_in()
+        self._in_endpoint = next(
+            (endpoint for endpoint in endpoints if endpoint.is_in()), None)
+        self._out_endpoint = next(
+            (endpoint for endpoint in endpoints if not endpoint.is_in()),
+            None)
+
+    def _endpoint_for_reading(self):
+        if self._in_endpoint is None:
+            raise USBError('Device {} has no IN endpoint.'.format(
+                self.device_info()))
+        return self._in_endpoint
+
+    def _endpoint_for_writing(self):
+        if self._out_endpoint is None:
+            raise USBError('Device {} has no OUT endpoint.'.format(
+                self.device_info()))
+        return self._out_endpoint
 
     def _format_message(self, template, **kwargs):
         return template.format(interface=self.INTERFACE,
@@ -229,6 +471,7 @@ class USBDevice:
 
     def _handle_exception(self, template, exception):
         error_template = 'Error ' + template + ':\n{exception}'
-        msg = self._format_message(error_template, exception=str(exception))
-        _LOGGER.error(msg)
-        raise USBError(msg) from exception
+        self.log.error(error_template, interface=self.INTERFACE,
+                       exception=exception)
+        raise USBError(self._format_message(
+            error_template, exception=exception)) from exception
@@ -0,0 +1,225 @@
+"""Transfer data through Linux usbfs instead of pyusb.
+
+With pyusb every transfer passes the pyusb endpoint and device
+objects, its resource manager and the libusb backend before it gets
+to the kernel; for the 1 byte interrupt transfers of the switches and
+lamps that is most of the time a transfer takes. 'UsbfsTransport'
+opens the usbfs file of the device, /dev/bus/usb/BUS/ADDRESS, and does
+every transfer with one USBDEVFS_BULK ioctl, which serves interrupt
+endpoints as well. The request and its buffer are allocated once for
+every endpoint and reused.
+
+Devices are still found and described through pyusb, only claiming
+and the transfers go through usbfs. The module is a device backend,
+see 'interface.InterfaceManager'::
+
+    application = Application(device_backend=usbfs)
+
+or run 'python -m yak_server --transport usbfs'. Compare the overhead
+of both transports with 'python -m yak_server.benchmark --transports'.
+"""
+
+import ctypes
+import errno
+import fcntl
+import os
+import os.path
+import struct
+import sys
+
+from yak_server import usbdevice
+
+
+DEVICE_DIRECTORY = '/dev/bus/usb'
+
+# Milliseconds a transfer may take, the default timeout of pyusb.
+TIMEOUT = 1000
+
+
+class BulkTransfer(ctypes.Structure):
+    """The argument of USBDEVFS_BULK, struct usbdevfs_bulktransfer."""
+
+    _fields_ = [('ep', ctypes.c_uint), ('len', ctypes.c_uint),
+                ('timeout', ctypes.c_uint), ('data', ctypes.c_void_p)]
+
+
+class ControlTransfer(ctypes.Structure):
+    """The argument of USBDEVFS_CONTROL, struct usbdevfs_ctrltransfer."""
+
+    _fields_ = [('bRequestType', ctypes.c_uint8),
+                ('bRequest', ctypes.c_uint8), ('wValue', ctypes.c_uint16),
+                ('wIndex', ctypes.c_uint16), ('wLength', ctypes.c_uint16),
+                ('timeout', ctypes.c_uint32), ('data', ctypes.c_void_p)]
+
+
+class _GetDriver(ctypes.Structure):
+    _fields_ = [('interface', ctypes.c_uint),
+                ('driver', ctypes.c_char * 256)]
+
+
+class _Ioctl(ctypes.Structure):
+    _fields_ = [('ifno', ctypes.c_int), ('ioctl_code', ctypes.c_int),
+                ('data', ctypes.c_void_p)]
+
+
+def _request(direction, number, size):
+    """Return an ioctl request number like the _IOC macro of Linux."""
+    return direction << 30 | size << 16 | ord('U') << 8 | number
+
+
+_NONE = 0
+_WRITE = 1
+_READ = 2
+
+USBDEVFS_CONTROL = _request(_READ | _WRITE, 0,
+                            ctypes.sizeof(ControlTransfer))
+USBDEVFS_BULK = _request(_READ | _WRITE, 2, ctypes.sizeof(BulkTransfer))
+USBDEVFS_SETCONFIGURATION = _request(_READ, 5, 4)
+USBDEVFS_GETDRIVER = _request(_WRITE, 8, ctypes.sizeof(_GetDriver))
+USBDEVFS_CLAIMINTERFACE = _request(_READ, 15, 4)
+USBDEVFS_IOCTL = _request(_READ | _WRITE, 18, ctypes.sizeof(_Ioctl))
+USBDEVFS_DISCONNECT = _request(_NONE, 22, 0)
+
+
+def device_path(bus, address):
+    """Return the usbfs file of a device."""
+    return os.path.join(DEVICE_DIRECTORY, '{:03d}'.format(bus),
+                        '{:03d}'.format(address))
+
+
+def find(**search_parameters):
+    """Return the USBDevices found by 'usbdevice.find', using usbfs."""
+    return tuple(usbdevice.USBDevice(device.raw_device,
+                                     transport=UsbfsTransport)
+                 for device in usbdevice.find(**search_parameters))
+
+
+def backend():
+    """Return this module as device backend, see 'sharding.run_sharded'."""
+    return sys.modules[__name__]
+
+
+class UsbfsTransport:
+    """Claim a device and transfer data with usbfs ioctls.
+
+    The usbfs file is opened when the device is connected. Once a
+    transfer found the device gone the file is closed and every later
+    call fails with ENODEV, like pyusb does.
+    """
+
+    # The ioctl function, replaced to run without a device.
+    ioctl = staticmethod(fcntl.ioctl)
+
+    def __init__(self, raw_device):
+        """Create the transport of a pyusb device."""
+        self.raw_device = raw_device
+        self.path = device_path(raw_device.bus, raw_device.address)
+        self._descriptor = None
+        self._gone = False
+
+    def is_kernel_driver_active(self, interface):
+        """Return True if a kernel driver is bound to an interface."""
+        try:
+            self._call(USBDEVFS_GETDRIVER, _GetDriver(interface=interface))
+        except OSError as exception:
+            if exception.errno == errno.ENODATA:
+                return False
+            raise
+        return True
+
+    def detach_kernel_driver(self, interface):
+        """Unbind the kernel driver from an interface."""
+        self._call(USBDEVFS_IOCTL, _Ioctl(ifno=interface,
+                                          ioctl_code=USBDEVFS_DISCONNECT))
+
+    def set_configuration(self):
+        """Select the first configuration of the device, like pyusb."""
+        value = self.raw_device[0].bConfigurationValue
+        self._call(USBDEVFS_SETCONFIGURATION, struct.pack('I', value))
+
+    def claim_interface(self, interface):
+        """Claim an interface for the transfers."""
+        self._call(USBDEVFS_CLAIMINTERFACE, struct.pack('I', interface))
+
+    def endpoint(self, raw_endpoint):
+        """Return the Endpoint for a pyusb endpoint descriptor."""
+        return UsbfsEndpoint(self, raw_endpoint)
+
+    def control_read(self, request_type, request, value, index, length):
+        """Do a device to host control transfer, return the data read."""
+        buffer = ctypes.create_string_buffer(max(length, 1))
+        count = self._call(USBDEVFS_CONTROL, ControlTransfer(
+            bRequestType=request_type, bRequest=request, wValue=value,
+            wIndex=index, wLength=length, timeout=TIMEOUT,
+            data=ctypes.addressof(buffer)))
+        return buffer.raw[:count]
+
+    def transfer(self, request):
+        """Do a BulkTransfer, return the number of bytes transferred."""
+        descriptor = self._descriptor
+        if descriptor is None:
+            return self._call(USBDEVFS_BULK, request)
+        try:
+            return self.ioctl(descriptor, USBDEVFS_BULK, request)
+        except OSError as exception:
+            self._check_gone(exception)
+            raise
+
+    def close(self):
+        """Close the usbfs file."""
+        if self._descriptor is not None:
+            os.close(self._descriptor)
+            self._descriptor = None
+
+    def _call(self, request, argument):
+        if self._gone:
+            raise OSError(errno.ENODEV, os.strerror(errno.ENODEV))
+        if self._descriptor is None:
+            self._descriptor = os.open(self.path, os.O_RDWR | os.O_CLOEXEC)
+        try:
+            return self.ioctl(self._descriptor, request, argument)
+        except OSError as exception:
+            self._check_gone(exception)
+            raise
+
+    def _check_gone(self, exception):
+        if exception.errno == errno.ENODEV:
+            self._gone = True
+            self.close()
+
+
+class UsbfsEndpoint(usbdevice.Endpoint):
+    """An endpoint transferring through a UsbfsTransport.
+
+    The buffer holds at least a packet and grows to the largest
+    transfer asked for.
+    """
+
+    def __init__(self, transport, raw_endpoint):
+        """Wrap a pyusb endpoint descriptor."""
+        super().__init__(raw_endpoint)
+        self._transport = transport
+        self._allocate(self.max_packet_size)
+
+    def read(self, number_of_bytes):
+        """Read from the endpoint."""
+        if number_of_bytes > len(self._buffer):
+            self._allocate(number_of_bytes)
+        self._request.len = number_of_bytes
+        count = self._transport.transfer(self._request)
+        return self._view[:count].tobytes()
+
+    def write(self, data):
+        """Write to the endpoint."""
+        length = len(data)
+        if length > len(self._buffer):
+            self._allocate(length)
+        self._view[:length] = data
+        self._request.len = length
+        return self._transport.transfer(self._request)
+
+    def _allocate(self, size):
+        self._buffer = ctypes.create_string_buffer(max(size, 1))
+        self._view = memoryview(self._buffer).cast('B')
+        self._request = BulkTransfer(ep=self.address, timeout=TIMEOUT,
+                                     data=ctypes.addressof(self._buffer))
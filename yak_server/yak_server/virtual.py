@@ -0,0 +1,243 @@
+"""Virtual devices for running the server without USB hardware.
+
+A 'VirtualFleet' is a device backend: like the 'usbdevice' module it
+provides a 'find' function, so it can be handed to the
+'InterfaceManager' in place of pyusb. The fleet holds any number of
+virtual switch and AC devices, which speak the same protocol as the
+real firmware. Switches are operated directly or by playing a press
+pattern.
+
+The fleet also reports which devices have input waiting through
+'wait_for_input', so the application can serve every virtual switch
+from a single thread instead of one blocking reader per device.
+"""
+
+import queue
+import random
+import threading
+
+from yak_server import clock
+from yak_server import usbdevice
+
+
+SWITCH_CLASS_ID = usbdevice.DeviceClassID(vendor_id=0x04d8,
+                                          product_id=0x5900,
+                                          release_number=0x0000)
+AC_CLASS_ID = usbdevice.DeviceClassID(vendor_id=0x04d8,
+                                      product_id=0x5901,
+                                      release_number=0x0000)
+
+
+class VirtualDevice:
+    """Baseclass for virtual devices.
+
+    Provides the same interface as 'usbdevice.USBDevice'.
+    """
+
+    DEVICE_CLASS_ID = None
+    max_packet_size = 8
+
+    def __init__(self, identifier, ready_queue=None):
+        """Create a virtual device with a unique identifier.
+
+        If 'ready_queue' is given, the device puts itself in it every
+        time it has new data to be read.
+        """
+        self.identifier = identifier
+        self.connected = False
+        self._read_queue = queue.Queue()
+        self._read_buffer = b''
+        self._ready_queue = ready_queue
+
+    def connect(self):
+        """Connect to the device."""
+        self.connected = True
+
+    def is_input(self):
+        """Return if the device is an input."""
+        return False
+
+    def is_output(self):
+        """Return if the device is an output."""
+        return not self.is_input()
+
+    def flush(self):
+        """Flush the input buffer."""
+        self._read_buffer = b''
+        while not self._read_queue.empty():
+            self._read_queue.get()
+
+    def read(self, number_of_bytes):
+        """Read a number of bytes, blocking untill they are available."""
+        while len(self._read_buffer) < number_of_bytes:
+            self._read_buffer += self._read_queue.get()
+        data = self._read_buffer[:number_of_bytes]
+        self._read_buffer = self._read_buffer[number_of_bytes:]
+        return data
+
+    def query_state(self, number_of_bytes):
+        """Raise USBError, like firmware without the GET_STATE request."""
+        raise usbdevice.USBError('Device {} does not report its state.'
+                                 .format(self.identifier))
+
+    def _send(self, data):
+        self._read_queue.put(data)
+        if self._ready_queue is not None:
+            self._ready_queue.put(self)
+
+    def write(self, data):
+        """Write the given bytes to the device."""
+        raise usbdevice.USBError('Device {} has no output endpoint.'
+                                 .format(self.identifier))
+
+    @property
+    def class_identifier(self):
+        """Return a unique identifier for the device class."""
+        return self.DEVICE_CLASS_ID
+
+    def device_info(self):
+        """Return a string containing device information."""
+        return '<{} {}>'.format(type(self).__name__, self.identifier)
+
+
+class VirtualSwitchDevice(VirtualDevice):
+    """A virtual single button switch interface."""
+
+    DEVICE_CLASS_ID = SWITCH_CLASS_ID
+
+    def __init__(self, identifier, ready_queue=None):
+        """Create a virtual switch that is initially released."""
+        super().__init__(identifier, ready_queue)
+        self.pressed = False
+
+    def is_input(self):
+        """Return True, the switch is an input."""
+        return True
+
+    def press(self):
+        """Press the button."""
+        self.set_state(True)
+
+    def release(self):
+        """Release the button."""
+        self.set_state(False)
+
+    def set_state(self, pressed):
+        """Set the button state, sending it if it changed."""
+        if pressed != self.pressed:
+            self.pressed = pressed
+            self._send(b'\x01' if pressed else b'\x00')
+
+
+class VirtualACDevice(VirtualDevice):
+    """A virtual single channel 230V interface."""
+
+    DEVICE_CLASS_ID = AC_CLASS_ID
+
+    def __init__(self, identifier):
+        """Create a virtual AC interface with the lamp off."""
+        super().__init__(identifier)
+        self.lamp_on = False
+        self.write_count = 0
+
+    def write(self, data):
+        """Switch the lamp according to the last byte written."""
+        if data:
+            self.lamp_on = bool(data[-1])
+        self.write_count += 1
+        return len(data)
+
+
+class VirtualFleet:
+    """A collection of virtual devices usable as a device backend."""
+
+    def __init__(self, switch_count=1, ac_count=1, fleet_clock=None):
+        """Create a fleet with the given number of devices.
+
+        Patterns are played on 'fleet_clock', which defaults to the
+        default clock.
+        """
+        self.clock = fleet_clock or clock.get_clock()
+        self._ready_queue = queue.Queue()
+        self.switches = [VirtualSwitchDevice('virtual-switch-{}'.format(i),
+                                             self._ready_queue)
+                         for i in range(switch_count)]
+        self.ac_devices = [VirtualACDevice('virtual-ac-{}'.format(i))
+                           for i in range(ac_count)]
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Create a fleet from a dict like {'switches': 2, 'ac': 1}."""
+        return cls(switch_count=spec.get('switches', 0),
+                   ac_count=spec.get('ac', 0))
+
+    @property
+    def devices(self):
+        """Return all devices in the fleet."""
+        return self.switches + self.ac_devices
+
+    def find(self, **search_parameters):
+        """Return the devices matching the search parameters.
+
+        Takes the same search parameters as 'usbdevice.find'.
+        """
+        return tuple(device for device in self.devices
+                     if _matches(device.class_identifier, search_parameters))
+
+    def wait_for_input(self, timeout=None):
+        """Return a device that has data waiting to be read.
+
+        A device is returned once for every message it sends, so
+        reading one message from it will not block. Block untill a
+        device has data, or return None after 'timeout' seconds.
+        """
+        try:
+            return self._ready_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def play(self, pattern, speed=None):
+        """Operate the switches according to a press pattern.
+
+        A pattern is an iterable of (delay, switch_index, pressed)
+        tuples, delays are in seconds. The delays are scaled by
+        'speed'; if it is None the pattern is played without waiting.
+        Return the number of steps played.
+        """
+        steps = 0
+        for delay, switch_index, pressed in pattern:
+            if speed and delay > 0:
+                self.clock.sleep(delay / speed)
+            self.switches[switch_index].set_state(pressed)
+            steps += 1
+        return steps
+
+    def play_in_background(self, pattern, speed=None):
+        """Play a pattern in a daemon thread and return the thread."""
+        thread = threading.Thread(target=self.play, args=(pattern, speed),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+
+def _matches(class_identifier, search_parameters):
+    return all(getattr(class_identifier, name) == value
+               for name, value in search_parameters.items())
+
+
+def scripted_pattern(steps):
+    """Return a pattern playing the given (delay, switch, pressed) steps."""
+    return iter(steps)
+
+
+def random_pattern(switch_count, press_count, mean_interval=0.1, seed=0):
+    """Return a pattern of random presses and releases.
+
+    Each press is followed by a release of the same switch. The time
+    between steps is exponentially distributed with the given mean.
+    """
+    rng = random.Random(seed)
+    for _ in range(press_count):
+        switch_index = rng.randrange(switch_count)
+        yield rng.expovariate(1 / mean_interval), switch_index, True
+        yield rng.expovariate(1 / mean_interval), switch_index, False